@@ -0,0 +1,75 @@
+"""
+Writing to the append-only activity log.
+
+Domain methods (quantity changes, approvals, uploads) record their own
+events with the acting user; model signals record creates, edits and
+deletes. When no actor is passed, the user of the request being served is
+used, which ``CurrentRequestMiddleware`` makes available to signal handlers.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .models import ActivityEvent
+
+_current_request = ContextVar('current_request', default=None)
+
+
+class CurrentRequestMiddleware:
+    """Expose the request being handled to code without access to it"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+
+
+def current_user():
+    """The authenticated user of the current request, if any"""
+    request = _current_request.get()
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    return None
+
+
+def build_event(verb, obj, actor=None, **data):
+    """Unsaved ActivityEvent for obj, for use with bulk_create"""
+    return ActivityEvent(
+        verb=verb,
+        actor=actor or current_user(),
+        object_type=obj._meta.label_lower,
+        object_id=str(obj.pk),
+        object_repr=str(obj)[:200],
+        data=data,
+    )
+
+
+def record(verb, obj, actor=None, **data):
+    """Append one event about obj"""
+    event = build_event(verb, obj, actor, **data)
+    event.save()
+    return event
+
+
+def record_many(events):
+    """Append events built with build_event in one insert"""
+    return ActivityEvent.objects.bulk_create(events, batch_size=1000)
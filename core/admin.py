@@ -1,3 +1,29 @@
 from django.contrib import admin
+from .models import ActivityEvent, ContentImage, RenderedContent
 
-# Register your models here.
+@admin.register(ContentImage)
+class ContentImageAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'content_type', 'size', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'image', 'content_type', 'size', 'created_at')
+
+
+@admin.register(RenderedContent)
+class RenderedContentAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'excerpt', 'created_at')
+    search_fields = ('sha256', 'text')
+    readonly_fields = ('sha256', 'html', 'text', 'excerpt', 'created_at')
+
+
+@admin.register(ActivityEvent)
+class ActivityEventAdmin(admin.ModelAdmin):
+    list_display = ('occurred_at', 'verb', 'object_type', 'object_repr', 'actor')
+    list_filter = ('verb', 'object_type')
+    search_fields = ('object_id', 'object_repr')
+    list_select_related = ('actor',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,101 @@
+"""
+Save-time pipeline for rich-text content.
+
+CKEditor stores pasted screenshots as ``data:image/...;base64`` URIs inside
+the HTML. ``extract_inline_images`` moves each one into a ``ContentImage``
+blob (deduplicated by SHA-256) and rewrites the ``src`` to the blob URL, so
+the HTML columns only carry markup.
+
+Only raster formats whose bytes match their declared type are extracted.
+Anything else (notably SVG, which can carry script and would be served
+from our own origin) is left inline for the HTML sanitizer to reject.
+"""
+import base64
+import binascii
+import hashlib
+import re
+
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+
+from .models import ContentImage
+
+INLINE_IMAGE_MARKER = 'data:image/'
+INLINE_IMAGE_RE = re.compile(
+    r'(?P<prefix>\bsrc\s*=\s*(?P<quote>["\']))'
+    r'data:(?P<mime>image/[\w.+-]+);base64,(?P<data>[A-Za-z0-9+/=\s]+)'
+    r'(?P=quote)',
+    re.IGNORECASE
+)
+
+
+# content type -> (file extension, leading bytes of the format)
+EXTRACTED_IMAGE_TYPES = {
+    'image/png': ('.png', (b'\x89PNG\r\n\x1a\n',)),
+    'image/jpeg': ('.jpg', (b'\xff\xd8\xff',)),
+    'image/gif': ('.gif', (b'GIF87a', b'GIF89a')),
+    'image/webp': ('.webp', (b'RIFF',)),
+}
+
+
+def is_extractable(raw, content_type):
+    """Check the bytes really are one of the raster formats we store"""
+    if content_type not in EXTRACTED_IMAGE_TYPES:
+        return False
+    if content_type == 'image/webp' and raw[8:12] != b'WEBP':
+        return False
+    return raw.startswith(EXTRACTED_IMAGE_TYPES[content_type][1])
+
+
+def store_image(raw, content_type):
+    """Return the ContentImage for these bytes, creating it on first sight"""
+    sha256 = hashlib.sha256(raw).hexdigest()
+    existing = ContentImage.objects.filter(sha256=sha256).first()
+    if existing:
+        return existing
+
+    image = ContentImage(sha256=sha256, content_type=content_type, size=len(raw))
+    extension = EXTRACTED_IMAGE_TYPES[content_type][0]
+    image.image.save(f'{sha256}{extension}', ContentFile(raw), save=False)
+    try:
+        with transaction.atomic():
+            image.save()
+    except IntegrityError:
+        # Another request stored the same image first
+        image.image.delete(save=False)
+        return ContentImage.objects.get(sha256=sha256)
+    return image
+
+
+def extract_inline_images(html):
+    """Replace inline base64 images in html with URLs of stored blobs"""
+    if not html or INLINE_IMAGE_MARKER not in html:
+        return html
+
+    def replace(match):
+        try:
+            raw = base64.b64decode(re.sub(r'\s+', '', match.group('data')), validate=True)
+        except (binascii.Error, ValueError):
+            return match.group(0)
+        content_type = match.group('mime').lower()
+        if content_type == 'image/jpg':
+            content_type = 'image/jpeg'
+        if not is_extractable(raw, content_type):
+            return match.group(0)
+        image = store_image(raw, content_type)
+        quote = match.group('quote')
+        return f"{match.group('prefix')}{image.image.url}{quote}"
+
+    return INLINE_IMAGE_RE.sub(replace, html)
+
+
+def extract_inline_images_from(instance, fields):
+    """Rewrite the given rich-text attributes in place, returning the changed field names"""
+    changed = []
+    for field in fields:
+        value = getattr(instance, field)
+        new_value = extract_inline_images(value)
+        if new_value != value:
+            setattr(instance, field, new_value)
+            changed.append(field)
+    return changed
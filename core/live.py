@@ -0,0 +1,219 @@
+"""
+Live event fan-out for Server-Sent Events.
+
+Model signal handlers call ``publish()``. After the surrounding transaction
+commits the message is sent to every ASGI worker: with PostgreSQL through
+``NOTIFY`` on ``LIVE_EVENTS['CHANNEL']``, each worker holding a single
+``LISTEN`` connection, and with other databases straight to the in-process
+hub (single process only). The hub hands each message to the bounded queue
+of every open SSE connection; a connection that falls behind gets one
+``resync`` event telling the client to refetch instead of an unbounded
+backlog.
+
+Live events are off unless ``LIVE_EVENTS['ENABLED']`` is set, which only
+makes sense when the site is served by an ASGI server; WSGI deployments
+keep the pages' periodic polling.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BACKEND': 'postgres',
+    'CHANNEL': 'lims_live',
+    'HEARTBEAT_SECONDS': 15,
+    'QUEUE_SIZE': 100,
+    'RECONNECT_SECONDS': 5,
+}
+# NOTIFY payloads must stay below 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'LIVE_EVENTS', {})}
+
+
+def is_enabled():
+    return bool(get_config()['ENABLED'])
+
+
+def uses_postgres():
+    return get_config()['BACKEND'] == 'postgres' and connections['default'].vendor == 'postgresql'
+
+
+class Subscription:
+    """Bounded queue of messages for one connected client"""
+
+    def __init__(self, hub, types, maxsize):
+        self.hub = hub
+        self.types = set(types) if types else None
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def wants(self, message):
+        return self.types is None or message['type'] in self.types
+
+    def offer(self, message):
+        """Called on the subscriber's event loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Drop the backlog; the client refetches once instead
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync', 'data': {}})
+
+    async def get(self, timeout):
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        if message['type'] == 'resync':
+            self.overflowed = False
+        return message
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """In-process registry of subscriptions; thread-safe to broadcast into"""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def subscribe(self, types=None):
+        subscription = Subscription(self, types, get_config()['QUEUE_SIZE'])
+        with self.lock:
+            self.subscriptions.add(subscription)
+        if uses_postgres() and self.listener is None:
+            self.listener = PostgresListener(self, subscription.loop)
+            self.listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def broadcast(self, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if not subscription.wants(message):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(subscription)
+
+    @property
+    def connection_count(self):
+        return len(self.subscriptions)
+
+
+class PostgresListener:
+    """One LISTEN connection per worker process, read without blocking the event loop"""
+
+    def __init__(self, hub, loop):
+        self.hub = hub
+        self.loop = loop
+        self.conn = None
+
+    def start(self):
+        self.loop.create_task(self.connect())
+
+    async def connect(self):
+        config = get_config()
+        while True:
+            try:
+                self.conn = await asyncio.to_thread(self._open, config['CHANNEL'])
+                self.loop.add_reader(self.conn.fileno(), self._on_readable)
+                logger.info("Listening for live events on %s", config['CHANNEL'])
+                return
+            except Exception:
+                logger.exception("Live event listener could not connect, retrying")
+                await asyncio.sleep(config['RECONNECT_SECONDS'])
+
+    def _open(self, channel):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = connections['default'].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{channel}"')
+        return conn
+
+    def _on_readable(self):
+        try:
+            self.conn.poll()
+        except Exception:
+            logger.exception("Live event listener lost its connection")
+            self.loop.remove_reader(self.conn.fileno())
+            self.conn = None
+            # Clients may have missed messages while reconnecting
+            self.hub.broadcast({'type': 'resync', 'data': {}})
+            self.loop.create_task(self.connect())
+            return
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            try:
+                self.hub.broadcast(json.loads(notify.payload))
+            except ValueError:
+                logger.warning("Ignoring malformed live event payload")
+
+
+hub = Hub()
+_sequence = itertools.count(1)
+
+
+def encode(event_type, data):
+    return json.dumps({'type': event_type, 'data': data, 'sent_at': time.time()},
+                      cls=DjangoJSONEncoder)
+
+
+def send(payload):
+    """Deliver an encoded message now, outside of any transaction bookkeeping"""
+    if uses_postgres():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [get_config()['CHANNEL'], payload])
+    else:
+        hub.broadcast(json.loads(payload))
+
+
+def publish(event_type, data):
+    """
+    Push a small delta to connected clients once the current transaction commits
+
+    Rolled back changes are never announced. Payloads must stay small; send
+    ids and changed values and let clients fetch anything larger.
+    """
+    if not is_enabled():
+        return
+    payload = encode(event_type, data)
+    if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+        logger.warning("Live event %s too large to publish (%d bytes)", event_type, len(payload))
+        return
+    transaction.on_commit(lambda: send(payload))
+
+
+def format_sse(message):
+    """Encode one message as an SSE frame"""
+    return (f"id: {next(_sequence)}\n"
+            f"event: {message['type']}\n"
+            f"data: {json.dumps(message, cls=DjangoJSONEncoder)}\n\n")
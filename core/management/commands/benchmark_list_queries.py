@@ -0,0 +1,107 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.mixins import optimize_queryset_for_serializer
+from experiments.models import Experiment
+from experiments.serializers import ExperimentListSerializer
+from experiments.views import ExperimentViewSet
+from protocols.models import Protocol
+from protocols.serializers import ProtocolListSerializer
+from protocols.views import ProtocolViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Measure bytes fetched from the database and list endpoint latency with and "
+            "without deferred rich-text loading. Runs inside a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help="Protocols and experiments to generate")
+        parser.add_argument('--content-kb', type=int, default=50,
+                            help="Size of each generated rich-text field in KB")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per measurement")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rows = options['rows']
+        blob = '<p>' + 'x' * (options['content_kb'] * 1024) + '</p>'
+        user = User.objects.create(username=f'benchmark-{time.time_ns()}')
+
+        self.stdout.write(f"Generating {rows} protocols and experiments with "
+                          f"{options['content_kb']} KB rich-text fields...")
+        content = {field: blob for field in Protocol.CONTENT_FIELDS}
+        Protocol.objects.bulk_create(
+            [Protocol(title=f'Benchmark {i}', protocol_code=f'BENCH-{i:06d}', created_by=user, **content)
+             for i in range(rows)],
+            batch_size=500
+        )
+        Experiment.objects.bulk_create(
+            [Experiment(title=f'Benchmark {i}', created_by=user, objective=blob, materials=blob,
+                        procedure=blob, results=blob, conclusion=blob, notes=blob)
+             for i in range(rows)],
+            batch_size=500
+        )
+
+        cases = [
+            ('protocols', Protocol.objects.all(), ProtocolListSerializer, ProtocolViewSet),
+            ('experiments', Experiment.objects.all(), ExperimentListSerializer, ExperimentViewSet),
+        ]
+        for label, queryset, serializer_class, viewset in cases:
+            before = self.fetched_bytes(queryset)
+            after = self.fetched_bytes(optimize_queryset_for_serializer(queryset, serializer_class))
+            self.stdout.write(f"\n{label}: full scan of list queryset")
+            self.stdout.write(f"  SELECT *  {before / 1024 / 1024:10.1f} MB")
+            self.stdout.write(f"  deferred  {after / 1024 / 1024:10.1f} MB")
+
+            plain = self.time_endpoint(viewset, user, options['repeat'], optimized=False)
+            optimized = self.time_endpoint(viewset, user, options['repeat'], optimized=True)
+            self.stdout.write(f"{label}: GET list (page of 20), {options['repeat']} requests")
+            self.stdout.write(f"  SELECT *  p50 {plain[0]:7.1f} ms  p99 {plain[1]:7.1f} ms")
+            self.stdout.write(f"  deferred  p50 {optimized[0]:7.1f} ms  p99 {optimized[1]:7.1f} ms")
+
+    def fetched_bytes(self, queryset):
+        """Approximate bytes sent by the database for every row of a queryset"""
+        sql, params = queryset.query.sql_with_params()
+        total = 0
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(1000)
+                if not batch:
+                    break
+                for row in batch:
+                    total += sum(len(str(value).encode()) for value in row if value is not None)
+        return total
+
+    def time_endpoint(self, viewset, user, repeat, optimized):
+        factory = APIRequestFactory()
+        actions = viewset.deferred_list_actions if optimized else ()
+        view = viewset.as_view({'get': 'list'}, deferred_list_actions=actions)
+
+        timings = []
+        for _ in range(repeat):
+            request = factory.get('/')
+            force_authenticate(request, user=user)
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        return statistics.median(timings), p99
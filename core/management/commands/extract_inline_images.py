@@ -0,0 +1,98 @@
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+
+from core.content import INLINE_IMAGE_MARKER, extract_inline_images
+from experiments.models import Experiment
+from protocols import deltas
+from protocols.models import Protocol, ProtocolRevision
+
+
+class Command(BaseCommand):
+    help = ("Move inline base64 images out of existing experiment and protocol rich-text "
+            "content into deduplicated image blobs")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count affected rows")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+
+        for model in (Experiment, Protocol):
+            count = self.process_model(model)
+            self.stdout.write(f"{model._meta.verbose_name_plural}: {count} row(s)")
+
+        count = self.process_revisions()
+        self.stdout.write(f"protocol revisions: {count} row(s)")
+
+        verb = 'Would rewrite' if self.dry_run else 'Rewrote'
+        self.stdout.write(self.style.SUCCESS(f"{verb} all rows containing inline images"))
+
+    def process_model(self, model):
+        fields = model.CONTENT_FIELDS
+        has_inline_image = reduce(or_, [Q(**{f'{field}__contains': INLINE_IMAGE_MARKER}) for field in fields])
+        rows = model.objects.filter(has_inline_image).only('pk', *fields)
+
+        count = 0
+        for row in rows.iterator(chunk_size=100):
+            count += 1
+            if self.dry_run:
+                continue
+            changes = {}
+            for field in fields:
+                value = getattr(row, field)
+                new_value = extract_inline_images(value)
+                if new_value != value:
+                    changes[field] = new_value
+            if changes:
+                # Plain UPDATE: no save() side effects and no updated_at bump
+                model.objects.filter(pk=row.pk).update(**changes)
+        return count
+
+    def process_revisions(self):
+        """
+        Rewrite compacted protocol content
+
+        Replacing an image changes how its revision tokenizes (a wrapped
+        base64 payload spans several newline-ended tokens), which would
+        shift every later delta in the chain. So each affected family is
+        rebuilt: every revision's content is reconstructed, rewritten, and
+        stored again as a snapshot or as a delta against its rewritten
+        base, with a new content hash and cache entry.
+        """
+        family_ids = ProtocolRevision.objects.annotate(
+            data_text=Cast('data', TextField())
+        ).filter(data_text__contains=INLINE_IMAGE_MARKER).values_list('family_id', flat=True).distinct()
+
+        count = 0
+        for family_id in family_ids:
+            revisions = list(ProtocolRevision.objects.filter(family_id=family_id).order_by('version', 'created_at'))
+            count += len(revisions)
+            if not self.dry_run:
+                self.rewrite_family(revisions)
+        return count
+
+    def rewrite_family(self, revisions):
+        content = {revision.pk: revision.get_content() for revision in revisions}
+        rewritten = {
+            pk: {field: extract_inline_images(html) for field, html in fields.items()}
+            for pk, fields in content.items()
+        }
+        with transaction.atomic():
+            for revision in revisions:
+                old_key = revision.cache_key
+                new_content = rewritten[revision.pk]
+                if revision.is_snapshot:
+                    data = new_content
+                else:
+                    data = deltas.make_content_delta(rewritten[revision.base_id], new_content)
+                content_hash = ProtocolRevision.hash_content(new_content)
+                ProtocolRevision.objects.filter(pk=revision.pk).update(data=data, content_hash=content_hash)
+                revision.content_hash = content_hash
+                cache.delete(old_key)
+                cache.set(revision.cache_key, new_content, ProtocolRevision.CACHE_TIMEOUT)
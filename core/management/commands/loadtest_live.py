@@ -0,0 +1,183 @@
+import asyncio
+import json
+import resource
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import live
+from core.sessions import create_login_session
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Client:
+    """One idle SSE connection that records when ping events arrive"""
+
+    def __init__(self, host, port, path, cookie):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.cookie = cookie
+        self.connect_ms = None
+        self.latencies = []
+        self.keepalives = 0
+        self.error = None
+        self.closed = False
+
+    async def run(self, connected):
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            writer.write((
+                f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nCookie: {self.cookie}\r\n"
+                f"Accept: text/event-stream\r\nCache-Control: no-cache\r\n\r\n"
+            ).encode())
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if b' 200 ' not in status_line:
+                raise ConnectionError(status_line.decode(errors='replace').strip() or 'no response')
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.lower()] = value.strip().lower()
+            self.connect_ms = (time.perf_counter() - start) * 1000
+        except (OSError, ConnectionError) as exc:
+            self.error = str(exc)
+            connected.release()
+            return
+        connected.release()
+
+        chunked = headers.get('transfer-encoding') == 'chunked'
+        buffer = b''
+        try:
+            while True:
+                if chunked:
+                    size = int((await reader.readline()).strip() or b'0', 16)
+                    if size == 0:
+                        break
+                    data = await reader.readexactly(size + 2)
+                    buffer += data[:-2]
+                else:
+                    data = await reader.read(4096)
+                    if not data:
+                        break
+                    buffer += data
+                while b'\n\n' in buffer:
+                    frame, buffer = buffer.split(b'\n\n', 1)
+                    self.handle_frame(frame.decode())
+        except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+            self.error = str(exc) or exc.__class__.__name__
+        finally:
+            self.closed = True
+            writer.close()
+
+    def handle_frame(self, frame):
+        for line in frame.splitlines():
+            if line.startswith(':'):
+                self.keepalives += 1
+            elif line.startswith('data:'):
+                message = json.loads(line[5:])
+                if message.get('type') == 'loadtest.ping':
+                    self.latencies.append((time.time() - message['sent_at']) * 1000)
+
+
+class Command(BaseCommand):
+    help = ("Open many idle Server-Sent Events connections to a running ASGI server, then "
+            "publish ping events and report connection and delivery latency. Pings reach the "
+            "server through LISTEN/NOTIFY, so the server must use the postgres LIVE_EVENTS backend.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/live/', help="SSE endpoint URL")
+        parser.add_argument('--username', required=True, help="User to open the connections as")
+        parser.add_argument('--connections', type=int, default=2000, help="Idle connections to hold")
+        parser.add_argument('--connect-concurrency', type=int, default=200,
+                            help="Connections being opened at the same time")
+        parser.add_argument('--hold', type=float, default=30, help="Seconds to stay idle before publishing")
+        parser.add_argument('--events', type=int, default=10, help="Ping events to publish")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between ping events")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError("Only plain http URLs are supported")
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = options['connections'] + 100
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+        session = create_login_session(user)
+        cookie = f'sessionid={session.session_key}'
+
+        try:
+            asyncio.run(self.run(url, cookie, options))
+        finally:
+            session.delete()
+
+    async def run(self, url, cookie, options):
+        clients = [
+            Client(url.hostname, url.port or 80, url.path or '/', cookie)
+            for _ in range(options['connections'])
+        ]
+        connected = asyncio.Semaphore(options['connect_concurrency'])
+
+        self.stdout.write(f"Opening {len(clients)} connections to {url.geturl()}...")
+        start = time.perf_counter()
+        tasks = []
+        for client in clients:
+            await connected.acquire()
+            tasks.append(asyncio.create_task(client.run(connected)))
+        # Wait for the last handshakes
+        for _ in range(options['connect_concurrency']):
+            await connected.acquire()
+        elapsed = time.perf_counter() - start
+
+        open_clients = [client for client in clients if client.connect_ms is not None]
+        connect_times = [client.connect_ms for client in open_clients]
+        self.stdout.write(f"  open      {len(open_clients)}/{len(clients)} in {elapsed:.1f} s")
+        self.stdout.write(f"  connect   p50 {percentile(connect_times, 0.5):7.1f} ms  "
+                          f"p99 {percentile(connect_times, 0.99):7.1f} ms")
+        errors = {client.error for client in clients if client.error}
+        for error in sorted(errors)[:5]:
+            self.stdout.write(self.style.WARNING(f"  error: {error}"))
+
+        self.stdout.write(f"Holding idle for {options['hold']:.0f} s...")
+        await asyncio.sleep(options['hold'])
+        dropped = sum(1 for client in open_clients if client.closed)
+        keepalives = sum(client.keepalives for client in open_clients)
+        self.stdout.write(f"  dropped while idle {dropped}, keepalives received {keepalives}")
+
+        self.stdout.write(f"Publishing {options['events']} ping events...")
+        for seq in range(options['events']):
+            await asyncio.to_thread(live.send, live.encode('loadtest.ping', {'seq': seq}))
+            await asyncio.sleep(options['interval'])
+        await asyncio.sleep(2)
+
+        latencies = [latency for client in open_clients for latency in client.latencies]
+        expected = len(open_clients) * options['events']
+        self.stdout.write(f"  delivered {len(latencies)}/{expected}")
+        if latencies:
+            self.stdout.write(f"  latency   p50 {statistics.median(latencies):7.1f} ms  "
+                              f"p99 {percentile(latencies, 0.99):7.1f} ms  max {max(latencies):7.1f} ms")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stdout.write(self.style.SUCCESS("Load test finished"))
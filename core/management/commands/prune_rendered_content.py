@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import RenderedContent
+from core.rendering import content_key
+from experiments.models import Experiment
+from protocols.models import Protocol
+
+
+class Command(BaseCommand):
+    help = "Delete rendered rich-text entries that no current experiment or protocol content uses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help="Keep entries created within this many days (default: 30)")
+        parser.add_argument('--dry-run', action='store_true', help="Only count entries to delete")
+
+    def handle(self, *args, **options):
+        live = set()
+        for model, queryset in (
+            (Experiment, Experiment.objects.all()),
+            # Compacted versions are rendered on demand and can be rebuilt cheaply
+            (Protocol, Protocol.objects.filter(content_compacted=False)),
+        ):
+            rows = queryset.values_list(*model.CONTENT_FIELDS)
+            for values in rows.iterator(chunk_size=500):
+                live.update(content_key(value) for value in values if value)
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        stale = RenderedContent.objects.filter(created_at__lt=cutoff)
+        to_delete = [pk for pk, sha256 in stale.values_list('pk', 'sha256').iterator() if sha256 not in live]
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Would delete {len(to_delete)} rendered entries"))
+            return
+
+        for start in range(0, len(to_delete), 1000):
+            RenderedContent.objects.filter(pk__in=to_delete[start:start + 1000]).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {len(to_delete)} rendered entries"))
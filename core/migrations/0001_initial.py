@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:06
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("image", models.FileField(upload_to=core.models.content_image_path)),
+                ("content_type", models.CharField(max_length=100)),
+                ("size", models.IntegerField(help_text="Image size in bytes")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenderedContent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "sha256",
+                    models.CharField(
+                        help_text="Hash of the renderer version and source HTML",
+                        max_length=64,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "html",
+                    models.TextField(
+                        blank=True, help_text="Sanitized HTML safe to insert into pages"
+                    ),
+                ),
+                (
+                    "text",
+                    models.TextField(
+                        blank=True, help_text="Plain text for search and previews"
+                    ),
+                ),
+                ("excerpt", models.CharField(blank=True, max_length=300)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_renderedcontent"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "occurred_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "verb",
+                    models.CharField(
+                        choices=[
+                            ("CREATED", "Created"),
+                            ("UPDATED", "Updated"),
+                            ("DELETED", "Deleted"),
+                            ("STATUS_CHANGED", "Status changed"),
+                            ("QUANTITY_CHANGED", "Quantity changed"),
+                            ("APPROVED", "Approved"),
+                            ("ARCHIVED", "Archived"),
+                            ("VERSION_CREATED", "Version created"),
+                            ("FILE_UPLOADED", "File uploaded"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "object_type",
+                    models.CharField(
+                        help_text="Model label, e.g. experiments.experiment",
+                        max_length=50,
+                    ),
+                ),
+                ("object_id", models.CharField(max_length=64)),
+                ("object_repr", models.CharField(max_length=200)),
+                (
+                    "data",
+                    models.JSONField(
+                        blank=True, default=dict, help_text="Verb-specific details"
+                    ),
+                ),
+                (
+                    "actor",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="activity_events",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-occurred_at", "-id"],
+                "indexes": [
+                    models.Index(
+                        fields=["-occurred_at", "-id"], name="activity_time_idx"
+                    ),
+                    models.Index(
+                        fields=["actor", "-occurred_at"], name="activity_actor_idx"
+                    ),
+                    models.Index(
+                        fields=["object_type", "object_id", "-occurred_at"],
+                        name="activity_object_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
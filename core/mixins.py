@@ -0,0 +1,86 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+
+
+@lru_cache(maxsize=None)
+def get_serializer_query_plan(serializer_class):
+    """
+    Work out which columns and relations a serializer reads
+
+    Returns (deferred, related): large text columns the serializer never
+    emits, and forward relations it reads through dotted sources or nested
+    serializers. SerializerMethodFields are opaque, so only columns that no
+    declared field names are deferred.
+    """
+    serializer = serializer_class()
+    model = serializer.Meta.model
+
+    used = set()
+    related = set()
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        root = field.source_attrs[0]
+        used.add(root)
+
+        try:
+            model_field = model._meta.get_field(root)
+        except FieldDoesNotExist:
+            continue
+        if model_field.many_to_one or model_field.one_to_one:
+            if len(field.source_attrs) > 1 or hasattr(field, 'fields'):
+                related.add(root)
+
+    deferred = tuple(
+        field.name for field in model._meta.concrete_fields
+        if isinstance(field, models.TextField) and field.name not in used
+    )
+    return deferred, tuple(sorted(related))
+
+
+def optimize_queryset_for_serializer(queryset, serializer_class):
+    """Defer unused text columns and join the relations the serializer reads"""
+    deferred, related = get_serializer_query_plan(serializer_class)
+    if deferred:
+        queryset = queryset.defer(*deferred)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset
+
+
+class DeferredListQuerysetMixin:
+    """
+    Viewset mixin that shapes the queryset of list-type actions to the
+    serializer used for them, so rich-text columns are not selected for
+    rows that never emit them
+    """
+    deferred_list_actions = ('list',)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.deferred_list_actions:
+            queryset = optimize_queryset_for_serializer(queryset, self.get_serializer_class())
+        return queryset
+
+
+class DeferredChangelistAdminMixin:
+    """
+    ModelAdmin mixin that defers text columns not shown in list_display on
+    the changelist. Change forms still load every column.
+    """
+
+    def get_changelist_deferred_fields(self, request):
+        list_display = set(self.get_list_display(request))
+        return [
+            field.name for field in self.model._meta.concrete_fields
+            if isinstance(field, models.TextField) and field.name not in list_display
+        ]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = getattr(request, 'resolver_match', None)
+        if match and match.url_name and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer(*self.get_changelist_deferred_fields(request))
+        return queryset
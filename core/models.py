@@ -1,3 +1,77 @@
 from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
+import os
 
-# Create your models here.
+
+def content_image_path(instance, filename):
+    """Store extracted images under their content hash"""
+    ext = os.path.splitext(filename)[1]
+    return os.path.join('content_images', instance.sha256[:2], f'{instance.sha256}{ext}')
+
+
+class ContentImage(models.Model):
+    """Image extracted from inline rich-text content, stored once per distinct image"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    image = models.FileField(upload_to=content_image_path)
+    content_type = models.CharField(max_length=100)
+    size = models.IntegerField(help_text="Image size in bytes")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.content_type}, {self.size} bytes)"
+
+
+class RenderedContent(models.Model):
+    """Sanitized HTML, plain text and excerpt derived from one distinct rich-text value"""
+    sha256 = models.CharField(max_length=64, unique=True, help_text="Hash of the renderer version and source HTML")
+    html = models.TextField(blank=True, help_text="Sanitized HTML safe to insert into pages")
+    text = models.TextField(blank=True, help_text="Plain text for search and previews")
+    excerpt = models.CharField(max_length=300, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]}: {self.excerpt[:50]}"
+
+
+class ActivityEvent(models.Model):
+    """
+    Append-only record of something that happened to a sample, experiment or
+    protocol. Rows are never updated; feeds read them newest first.
+    """
+    VERB_CHOICES = [
+        ('CREATED', 'Created'),
+        ('UPDATED', 'Updated'),
+        ('DELETED', 'Deleted'),
+        ('STATUS_CHANGED', 'Status changed'),
+        ('QUANTITY_CHANGED', 'Quantity changed'),
+        ('APPROVED', 'Approved'),
+        ('ARCHIVED', 'Archived'),
+        ('VERSION_CREATED', 'Version created'),
+        ('FILE_UPLOADED', 'File uploaded'),
+    ]
+    
+    occurred_at = models.DateTimeField(default=timezone.now)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='activity_events')
+    verb = models.CharField(max_length=20, choices=VERB_CHOICES)
+    object_type = models.CharField(max_length=50, help_text="Model label, e.g. experiments.experiment")
+    object_id = models.CharField(max_length=64)
+    object_repr = models.CharField(max_length=200)
+    data = models.JSONField(default=dict, blank=True, help_text="Verb-specific details")
+    
+    class Meta:
+        ordering = ['-occurred_at', '-id']
+        indexes = [
+            models.Index(fields=['-occurred_at', '-id'], name='activity_time_idx'),
+            models.Index(fields=['actor', '-occurred_at'], name='activity_actor_idx'),
+            models.Index(fields=['object_type', 'object_id', '-occurred_at'], name='activity_object_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.occurred_at:%Y-%m-%d %H:%M} {self.verb} {self.object_type} {self.object_repr}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Activity events are append-only")
+        super().save(*args, **kwargs)
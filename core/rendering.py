@@ -0,0 +1,202 @@
+"""
+Read-time derivatives of rich-text content.
+
+Each distinct HTML value is parsed once into sanitized HTML, plain text and
+a short excerpt. Results are stored in ``RenderedContent`` keyed by a hash
+of the renderer version and the source HTML, so identical content shared
+between rows, versions and requests is only ever parsed once. Bump
+``RENDERER_VERSION`` whenever the output for a given input changes.
+"""
+import hashlib
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from .models import RenderedContent
+
+RENDERER_VERSION = 1
+EXCERPT_LENGTH = 200
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'address', 'b', 'big', 'blockquote', 'br', 'caption', 'cite', 'code', 'col',
+    'colgroup', 'dd', 'del', 'div', 'dl', 'dt', 'em', 'figcaption', 'figure', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'kbd', 'li', 'ol', 'p', 'pre', 's', 'small',
+    'span', 'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead',
+    'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'col', 'hr', 'img'}
+# Dropped together with everything inside them
+DROP_CONTENT_TAGS = {
+    'embed', 'head', 'iframe', 'math', 'noscript', 'object', 'script', 'select', 'style',
+    'svg', 'template', 'textarea', 'title',
+}
+BLOCK_TAGS = {
+    'address', 'blockquote', 'br', 'caption', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'ol', 'p', 'pre', 'table', 'tr', 'ul',
+}
+CELL_TAGS = {'td', 'th'}
+
+GLOBAL_ATTRIBUTES = {'class', 'dir', 'lang', 'style', 'title'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'name', 'target'},
+    'col': {'span', 'width'},
+    'img': {'alt', 'height', 'src', 'width'},
+    'li': {'value'},
+    'ol': {'start', 'type'},
+    'table': {'align', 'border', 'cellpadding', 'cellspacing', 'summary', 'width'},
+    'td': {'align', 'colspan', 'rowspan', 'valign', 'width'},
+    'th': {'align', 'colspan', 'rowspan', 'scope', 'valign', 'width'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_URL_SCHEMES = {'http', 'https', 'mailto', 'tel', 'ftp'}
+
+URL_SCHEME_RE = re.compile(r'^([a-z][a-z0-9+.-]*):', re.IGNORECASE)
+UNSAFE_STYLE_RE = re.compile(r'expression|url\s*\(|javascript:|behavior|@import|\\', re.IGNORECASE)
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x20\x7f]+')
+
+
+def _safe_url(value, tag):
+    url = CONTROL_CHARS_RE.sub('', value)
+    match = URL_SCHEME_RE.match(url)
+    if not match:
+        return True
+    scheme = match.group(1).lower()
+    if scheme == 'data':
+        return tag == 'img' and url.lower().startswith('data:image/') and 'svg' not in url[:30].lower()
+    return scheme in ALLOWED_URL_SCHEMES
+
+
+class _Renderer(HTMLParser):
+    """Single pass that writes allow-listed markup and collects plain text"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.dropping:
+            if tag in DROP_CONTENT_TAGS:
+                self.dropping.append(tag)
+            return
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping.append(tag)
+            return
+
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        elif tag in CELL_TAGS:
+            self.text.append('\t')
+
+        if tag not in ALLOWED_TAGS:
+            return
+        self.html.append(self.render_tag(tag, attrs))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.dropping:
+            if tag == self.dropping[-1]:
+                self.dropping.pop()
+            return
+
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+
+        if tag not in self.open_tags:
+            return
+        # Close anything left open inside this element
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def render_tag(self, tag, attrs):
+        allowed = GLOBAL_ATTRIBUTES | ALLOWED_ATTRIBUTES.get(tag, set())
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value, tag):
+                continue
+            if name == 'style' and UNSAFE_STYLE_RE.search(value):
+                continue
+            parts.append(f'{name}="{escape(value, quote=True)}"')
+        if tag == 'a' and dict(attrs).get('target'):
+            parts.append('rel="noopener noreferrer"')
+        return f'<{" ".join(parts)}>'
+
+    def result(self):
+        self.close()
+        html = ''.join(self.html) + ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+
+        lines = (' '.join(line.split()) for line in ''.join(self.text).splitlines())
+        text = '\n'.join(line for line in lines if line)
+        return html, text
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """Collapse whitespace and cut at a word boundary"""
+    text = ' '.join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(' ', 1)[0] or text[:length]
+    return cut.rstrip(' .,;:') + '…'
+
+
+def render(html):
+    """Return sanitized HTML, plain text and an excerpt for one HTML value"""
+    renderer = _Renderer()
+    renderer.feed(html or '')
+    sanitized, text = renderer.result()
+    return {'html': sanitized, 'text': text, 'excerpt': make_excerpt(text)}
+
+
+def content_key(html):
+    return hashlib.sha256(f'{RENDERER_VERSION}:{html}'.encode()).hexdigest()
+
+
+def get_rendered(values):
+    """
+    Render many HTML values, returning a dict keyed by value
+
+    Looks every value up in one query and stores the ones not seen before.
+    """
+    keys = {content_key(value): value for value in set(values) if value}
+    rendered = {}
+    if keys:
+        for row in RenderedContent.objects.filter(sha256__in=keys).values('sha256', 'html', 'text', 'excerpt'):
+            rendered[keys[row.pop('sha256')]] = row
+
+        missing = [(key, value) for key, value in keys.items() if value not in rendered]
+        new_rows = []
+        for key, value in missing:
+            rendered[value] = render(value)
+            new_rows.append(RenderedContent(sha256=key, **rendered[value]))
+        if new_rows:
+            # A concurrent request may have stored the same content first
+            RenderedContent.objects.bulk_create(new_rows, ignore_conflicts=True)
+
+    empty = {'html': '', 'text': '', 'excerpt': ''}
+    return {value: rendered.get(value, empty) for value in values}
+
+
+def rendered_fields(instance, fields):
+    """Rendered output for each rich-text attribute of a model instance"""
+    values = {field: getattr(instance, field) or '' for field in fields}
+    rendered = get_rendered(values.values())
+    return {field: rendered[value] for field, value in values.items()}
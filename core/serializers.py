@@ -0,0 +1,20 @@
+from rest_framework import serializers
+from rest_framework.pagination import CursorPagination
+from .models import ActivityEvent
+
+
+class ActivityEventSerializer(serializers.ModelSerializer):
+    actor_name = serializers.CharField(source='actor.username', read_only=True, default=None)
+    
+    class Meta:
+        model = ActivityEvent
+        fields = ['id', 'occurred_at', 'verb', 'actor', 'actor_name', 'object_type',
+                  'object_id', 'object_repr', 'data']
+
+
+class ActivityCursorPagination(CursorPagination):
+    """Newest first; the cursor stays stable while new events are appended"""
+    ordering = ('-occurred_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
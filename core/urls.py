@@ -0,0 +1,11 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .views import ActivityEventViewSet, live_events
+
+router = DefaultRouter()
+router.register(r'activity', ActivityEventViewSet)
+
+urlpatterns = [
+    path('live/', live_events, name='live-events'),
+    path('', include(router.urls)),
+]
@@ -1,3 +1,73 @@
-from django.shortcuts import render
+import asyncio
 
-# Create your views here.
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+from django_filters.rest_framework import DjangoFilterBackend
+from .models import ActivityEvent
+from .serializers import ActivityEventSerializer, ActivityCursorPagination
+from . import live
+
+
+class ActivityEventViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Activity feed, newest first
+    
+    Filter with verb, actor, object_type (e.g. experiments.experiment) and
+    object_id for the timeline of one object, or occurred_at__gte /
+    occurred_at__lte for a time range.
+    """
+    queryset = ActivityEvent.objects.select_related('actor')
+    serializer_class = ActivityEventSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ActivityCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {
+        'verb': ['exact', 'in'],
+        'actor': ['exact'],
+        'object_type': ['exact'],
+        'object_id': ['exact'],
+        'occurred_at': ['gte', 'lte'],
+    }
+
+
+async def live_events(request):
+    """
+    Server-Sent Events stream of live deltas
+    
+    Optional ?types= is a comma-separated list of event types (sample.quantity,
+    sample.alert, storage.excursion, experiment.status, counts). Requires an ASGI server; under
+    WSGI the stream could never finish and would pin a worker thread, so
+    it is refused.
+    """
+    if not isinstance(request, ASGIRequest) or not live.is_enabled():
+        return JsonResponse({'error': 'Live events need LIVE_EVENTS enabled under an ASGI server'},
+                            status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    types = [name for name in request.GET.get('types', '').split(',') if name]
+    subscription = live.hub.subscribe(types)
+    heartbeat = live.get_config()['HEARTBEAT_SECONDS']
+    
+    async def stream():
+        try:
+            # Reconnect delay for EventSource clients, in milliseconds
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # Comment frame keeps proxies from closing idle connections
+                    yield ': keepalive\n\n'
+                    continue
+                yield live.format_sse(message)
+        finally:
+            subscription.close()
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,92 @@
+import http.client
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sessions import create_login_session
+
+ENDPOINTS = [
+    ('stats', '/api/dashboard/stats/', '/api/dashboard/async/stats/'),
+    ('activity', '/api/dashboard/activity/', '/api/dashboard/async/activity/'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Compare dashboard endpoint latency under concurrent load: the sync views on a "
+            "WSGI server, the same views on an ASGI server, and the async views on the ASGI "
+            "server. Start both servers first, e.g. `manage.py runserver 8000` and "
+            "`uvicorn lab_platform.asgi:application --port 8001 --workers 1`.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help="User to send requests as")
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000', help="Base URL of the WSGI server")
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001', help="Base URL of the ASGI server")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once")
+        parser.add_argument('--requests', type=int, default=400, help="Requests per measurement")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        session = create_login_session(user)
+        self.cookie = f'sessionid={session.session_key}'
+        try:
+            for label, sync_path, async_path in ENDPOINTS:
+                self.stdout.write(f"\n{label}: {options['requests']} requests, "
+                                  f"{options['concurrency']} concurrent")
+                for name, base, path in (
+                    ('WSGI sync ', options['wsgi_url'], sync_path),
+                    ('ASGI sync ', options['asgi_url'], sync_path),
+                    ('ASGI async', options['asgi_url'], async_path),
+                ):
+                    self.report(name, self.measure(base + path, options))
+        finally:
+            session.delete()
+
+    def report(self, name, result):
+        timings, errors, elapsed = result
+        if not timings:
+            self.stdout.write(self.style.WARNING(f"  {name}  all requests failed"))
+            return
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"  {name}  p50 {statistics.median(timings):7.1f} ms  p99 {p99:7.1f} ms  "
+            f"{len(timings) / elapsed:7.1f} req/s  errors {errors}"
+        )
+
+    def measure(self, url, options):
+        parts = urlsplit(url)
+
+        def request(_):
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            start = time.perf_counter()
+            try:
+                connection.request('GET', parts.path, headers={'Cookie': self.cookie})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    return None
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                return None
+            finally:
+                connection.close()
+
+        # Warm up connections and caches
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            list(pool.map(request, range(options['concurrency'])))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(request, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        timings = [result for result in results if result is not None]
+        return timings, len(results) - len(timings), elapsed
@@ -1,84 +1,134 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
 from django.db.models import Count, Sum
+from django.http import JsonResponse
 from django.utils import timezone
 from datetime import datetime, timedelta
 from samples.models import Sample, StorageLocation
 from experiments.models import Experiment
+from core import live
+from core.models import ActivityEvent
+from core.serializers import ActivityEventSerializer
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 
+def stats_queries():
+    """Independent aggregates behind dashboard_stats, keyed by result name"""
+    week_ago = timezone.now() - timedelta(days=7)
+    return {
+        # Basic counts
+        'total_samples': lambda: Sample.objects.count(),
+        'total_storage_locations': lambda: StorageLocation.objects.count(),
+        'total_experiments': lambda: Experiment.objects.count(),
+        # Samples by type
+        'samples_by_type': lambda: list(Sample.objects.values('sample_type').annotate(
+            count=Count('id')
+        ).order_by('-count')),
+        # Samples by storage location
+        'samples_by_location': lambda: list(Sample.objects.values(
+            'storage_location__name'
+        ).annotate(
+            count=Count('id')
+        ).order_by('-count')),
+        # Recent activity (last 7 days)
+        'recent_samples': lambda: Sample.objects.filter(created_at__gte=week_ago).count(),
+        'recent_experiments': lambda: Experiment.objects.filter(created_at__gte=week_ago).count(),
+    }
+
+
+def stats_response_data(results):
+    return {
+        'overview': {
+            'total_samples': results['total_samples'],
+            'total_storage_locations': results['total_storage_locations'],
+            'total_experiments': results['total_experiments'],
+        },
+        'samples_by_type': results['samples_by_type'],
+        'samples_by_location': results['samples_by_location'],
+        'recent_activity': {
+            'samples_last_7_days': results['recent_samples'],
+            'experiments_last_7_days': results['recent_experiments'],
+        }
+    }
+
+
+# Threads, and so database connections, shared by every concurrent dashboard
+# read in the process; requests queue for them instead of each opening its own
+QUERY_WORKERS = 3
+_query_pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='dashboard')
+
+
+async def run_concurrently(queries):
+    """
+    Run independent sync ORM callables at the same time
+    
+    The async ORM (acount(), async for) funnels every query through one
+    shared thread, so gathering them would still run them back to back.
+    The callables run on a small pool shared across requests, so a burst
+    of dashboard loads holds at most QUERY_WORKERS connections rather
+    than one per aggregate per request. Each pool thread hands its
+    connection back per CONN_MAX_AGE afterwards.
+    """
+    def isolated(query):
+        try:
+            return query()
+        finally:
+            close_old_connections()
+    
+    loop = asyncio.get_running_loop()
+    names = list(queries)
+    values = await asyncio.gather(*(loop.run_in_executor(_query_pool, isolated, queries[name]) for name in names))
+    return dict(zip(names, values))
+
+
+async def authenticated_user(request):
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_stats(request):
     """
     Return overall dashboard statistics
     """
-    # Basic counts
-    total_samples = Sample.objects.count()
-    total_storage_locations = StorageLocation.objects.count()
-    total_experiments = Experiment.objects.count()
-    
-    # Samples by type
-    samples_by_type = Sample.objects.values('sample_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Samples by storage location
-    samples_by_location = Sample.objects.values(
-        'storage_location__name'
-    ).annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Recent activity (last 7 days)
-    week_ago = timezone.now() - timedelta(days=7)
-    recent_samples = Sample.objects.filter(created_at__gte=week_ago).count()
-    recent_experiments = Experiment.objects.filter(created_at__gte=week_ago).count()
-    
-    return Response({
-        'overview': {
-            'total_samples': total_samples,
-            'total_storage_locations': total_storage_locations,
-            'total_experiments': total_experiments,
-        },
-        'samples_by_type': list(samples_by_type),
-        'samples_by_location': list(samples_by_location),
-        'recent_activity': {
-            'samples_last_7_days': recent_samples,
-            'experiments_last_7_days': recent_experiments,
-        }
-    })
+    results = {name: query() for name, query in stats_queries().items()}
+    return Response(stats_response_data(results))
+
+
+async def dashboard_stats_async(request):
+    """Same payload as dashboard_stats, with the aggregates run concurrently (ASGI)"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not await authenticated_user(request):
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+    results = await run_concurrently(stats_queries())
+    return JsonResponse(stats_response_data(results))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def storage_utilization(request):
     """
-    Return storage location utilization data
+    Return storage location utilization data in hierarchy order, read
+    from the counters samples.storage keeps on each location
     """
-    storage_stats = StorageLocation.objects.annotate(
-        sample_count=Count('sample')
-    ).values(
-        'id', 'name', 'location_type', 'sample_count'
-    ).order_by('-sample_count')
+    storage_stats = StorageLocation.objects.values(
+        'id', 'name', 'location_type', 'temperature', 'description', 'parent', 'path',
+        'sample_count', 'total_sample_count', 'capacity', 'total_capacity'
+    ).order_by('path')
     
     return Response({
         'storage_locations': list(storage_stats)
     })
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def recent_activity(request):
-    """
-    Return recent samples and experiments
-    """
-    # Get last 10 samples
+def recent_samples_data():
+    """Last 10 samples"""
     recent_samples = Sample.objects.select_related('created_by', 'storage_location').order_by('-created_at')[:10]
     
-    # Get last 10 experiments
-    recent_experiments = Experiment.objects.select_related('created_by').order_by('-created_at')[:10]
-    
     samples_data = []
     for sample in recent_samples:
         samples_data.append({
@@ -90,6 +140,14 @@ def recent_activity(request):
             'created_at': sample.created_at,
             'storage_location': sample.storage_location.name if sample.storage_location else None
         })
+    return samples_data
+
+
+def recent_experiments_data():
+    """Last 10 experiments"""
+    recent_experiments = Experiment.objects.select_related('created_by').annotate(
+        sample_count=Count('samples')
+    ).order_by('-created_at')[:10]
     
     experiments_data = []
     for experiment in recent_experiments:
@@ -98,13 +156,40 @@ def recent_activity(request):
             'title': experiment.title,
             'created_by': experiment.created_by.username,
             'created_at': experiment.created_at,
-            'sample_count': experiment.samples.count()
+            'sample_count': experiment.sample_count
         })
-    
-    return Response({
-        'recent_samples': samples_data,
-        'recent_experiments': experiments_data
-    })
+    return experiments_data
+
+
+def recent_events_data():
+    """Latest events of every kind, read from one index range"""
+    recent_events = ActivityEvent.objects.select_related('actor')[:20]
+    return ActivityEventSerializer(recent_events, many=True).data
+
+
+ACTIVITY_QUERIES = {
+    'recent_samples': recent_samples_data,
+    'recent_experiments': recent_experiments_data,
+    'recent_events': recent_events_data,
+}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def recent_activity(request):
+    """
+    Return recent samples and experiments
+    """
+    return Response({name: query() for name, query in ACTIVITY_QUERIES.items()})
+
+
+async def recent_activity_async(request):
+    """Same payload as recent_activity, with the three reads run concurrently (ASGI)"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not await authenticated_user(request):
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+    return JsonResponse(await run_concurrently(ACTIVITY_QUERIES))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -141,7 +226,7 @@ def sample_analytics(request):
 @login_required
 def dashboard_home(request):
     """Render the main dashboard page"""
-    return render(request, 'dashboard/home.html')
+    return render(request, 'dashboard/home.html', {'live_events': live.is_enabled()})
 
 @login_required
 def dashboard_samples(request):
@@ -156,7 +241,7 @@ def dashboard_storage(request):
 @login_required
 def dashboard_alerts(request):
     """Render the alerts page"""
-    return render(request, 'dashboard/alerts.html')
+    return render(request, 'dashboard/alerts.html', {'live_events': live.is_enabled()})
 
 @login_required
 def dashboard_lineage(request):
@@ -1,6 +1,7 @@
 from django.contrib import admin
+from core.mixins import DeferredChangelistAdminMixin
 from .models import Experiment
-from .file_models import FileAttachment
+from .file_models import FileAttachment, InstrumentFile
 
 class FileAttachmentInline(admin.TabularInline):
     model = FileAttachment
@@ -24,7 +25,7 @@ class FileAttachmentInline(admin.TabularInline):
         formset.save_m2m()
 
 @admin.register(Experiment)
-class ExperimentAdmin(admin.ModelAdmin):
+class ExperimentAdmin(DeferredChangelistAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'status', 'created_by', 'start_date', 'end_date', 'created_at', 'updated_at')
     list_filter = ('status', 'created_at', 'created_by', 'start_date')
     search_fields = ('title', 'description', 'objective', 'procedure')
@@ -64,10 +65,11 @@ class ExperimentAdmin(admin.ModelAdmin):
 
 @admin.register(FileAttachment)
 class FileAttachmentAdmin(admin.ModelAdmin):
-    list_display = ('file_name', 'experiment', 'file_type', 'file_size_display', 'uploaded_by', 'uploaded_at')
-    list_filter = ('file_type', 'uploaded_at', 'uploaded_by')
+    list_display = ('file_name', 'experiment', 'file_type', 'file_size_display', 'storage_tier',
+                    'uploaded_by', 'uploaded_at', 'last_accessed_at')
+    list_filter = ('file_type', 'storage_tier', 'uploaded_at', 'uploaded_by')
     search_fields = ('file_name', 'description', 'experiment__title')
-    readonly_fields = ('id', 'file_type', 'file_size', 'uploaded_at')
+    readonly_fields = ('id', 'file_type', 'file_size', 'uploaded_at', 'storage_tier', 'last_accessed_at')
     
     def file_size_display(self, obj):
         """Display file size in human-readable format"""
@@ -83,4 +85,16 @@ class FileAttachmentAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not obj.uploaded_by_id:
             obj.uploaded_by = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+@admin.register(InstrumentFile)
+class InstrumentFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'folder', 'status', 'experiment', 'size', 'discovered_at', 'processed_at')
+    list_filter = ('status', 'folder', 'discovered_at')
+    search_fields = ('path', 'error')
+    list_select_related = ('experiment',)
+    readonly_fields = ('folder', 'path', 'size', 'mtime_ns', 'experiment', 'attachment',
+                       'discovered_at', 'processed_at', 'error')
+    
+    def has_add_permission(self, request):
+        return False
@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import Experiment
+from .storage import get_attachment_storage
+import hashlib
 import os
 import uuid
 
@@ -23,19 +26,34 @@ class FileAttachment(models.Model):
         ('OTHER', 'Other'),
     ]
     
+    STORAGE_TIER_CHOICES = [
+        ('HOT', 'Local disk'),
+        ('COLD', 'Object storage'),
+    ]
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to=experiment_file_path)
+    file = models.FileField(upload_to=experiment_file_path, storage=get_attachment_storage)
     file_name = models.CharField(max_length=255)
     file_type = models.CharField(max_length=20, choices=FILE_TYPE_CHOICES)
     file_size = models.IntegerField(help_text="File size in bytes")
+    content_hash = models.CharField(max_length=64, blank=True,
+                                    help_text="SHA-256 of the file contents")
     description = models.TextField(blank=True)
     
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
+    # Storage tiering
+    storage_tier = models.CharField(max_length=10, choices=STORAGE_TIER_CHOICES, default='HOT')
+    last_accessed_at = models.DateTimeField(null=True, blank=True,
+                                            help_text="Last time the file was read")
+    
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['storage_tier', 'last_accessed_at']),
+        ]
     
     def __str__(self):
         return f"{self.file_name} - {self.experiment.title}"
@@ -57,7 +75,7 @@ class FileAttachment(models.Model):
             return 'EXCEL'
         elif ext in ['.doc', '.docx']:
             return 'WORD'
-        elif ext in ['.txt', '.json', '.xml', '.csv']:
+        elif ext in ['.txt', '.tsv', '.json', '.xml', '.csv']:
             return 'DATA'
         else:
             return 'OTHER'
@@ -70,4 +88,93 @@ class FileAttachment(models.Model):
         if self.file and not self.file_size:
             self.file_size = self.file.size
         
-        super().save(*args, **kwargs)
\ No newline at end of file
+        if self.file and not self.content_hash:
+            self.content_hash = self.calculate_hash()
+        
+        super().save(*args, **kwargs)
+    
+    def calculate_hash(self):
+        """Calculate the SHA-256 of the file contents"""
+        digest = hashlib.sha256()
+        committed = self.file._committed
+        self.file.open('rb')
+        try:
+            for chunk in self.file.chunks():
+                digest.update(chunk)
+        finally:
+            # Rewind pending uploads so the storage saves the whole file
+            if committed:
+                self.file.close()
+            else:
+                self.file.seek(0)
+        return digest.hexdigest()
+    
+    def mark_accessed(self):
+        """Record a read and the tier the file is now on"""
+        storage = self.file.storage
+        self.last_accessed_at = timezone.now()
+        self.storage_tier = 'HOT' if storage.is_hot(self.file.name) else 'COLD'
+        FileAttachment.objects.filter(pk=self.pk).update(
+            last_accessed_at=self.last_accessed_at,
+            storage_tier=self.storage_tier
+        )
+    
+    def move_to_cold_storage(self):
+        """Demote the file to the cold object-store tier"""
+        if self.storage_tier == 'COLD':
+            return
+        self.file.storage.demote(self.file.name)
+        self.storage_tier = 'COLD'
+        FileAttachment.objects.filter(pk=self.pk).update(storage_tier='COLD')
+    
+    def restore_to_hot_storage(self):
+        """Fault the file back in to local disk"""
+        if self.storage_tier == 'HOT':
+            return
+        self.file.storage.promote(self.file.name)
+        self.storage_tier = 'HOT'
+        FileAttachment.objects.filter(pk=self.pk).update(storage_tier='HOT')
+
+
+class InstrumentFile(models.Model):
+    """
+    Durable queue of files found in instrument watch folders
+
+    A file is identified by its folder, relative path, size and mtime, so a
+    restarted watcher neither ingests a file twice nor misses one, and a
+    file rewritten in place is picked up as a new version. Rows are worked
+    off by experiments.instrument_ingest.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('INGESTED', 'Ingested'),
+        ('UNMATCHED', 'No matching experiment'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    folder = models.CharField(max_length=255, help_text="Watch folder as configured")
+    path = models.CharField(max_length=1024, help_text="Path relative to the watch folder")
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    error = models.TextField(blank=True)
+    
+    experiment = models.ForeignKey(Experiment, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='instrument_files')
+    attachment = models.ForeignKey(FileAttachment, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='instrument_files')
+    
+    discovered_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['folder', 'path', 'size', 'mtime_ns'], name='one_instrument_file_version'),
+        ]
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(status='PENDING'), name='instrument_file_pending_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.folder}/{self.path} ({self.status})"
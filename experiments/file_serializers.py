@@ -9,7 +9,7 @@ class FileAttachmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileAttachment
         fields = '__all__'
-        read_only_fields = ('id', 'file_type', 'file_size', 'uploaded_at')
+        read_only_fields = ('id', 'file_type', 'file_size', 'uploaded_at', 'storage_tier', 'last_accessed_at')
     
     def get_file_url(self, obj):
         """Get full URL for file"""
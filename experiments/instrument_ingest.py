@@ -0,0 +1,415 @@
+"""
+Instrument watch-folder ingestion.
+
+Plate readers, qPCR machines and similar instruments write result files
+into folders listed in ``INSTRUMENT_INGEST['FOLDERS']``. The watcher polls
+those folders (inotify does not see changes made over NFS or SMB mounts),
+records every settled file in the ``InstrumentFile`` queue table in
+batches, and then works the queue off in batches: each file is matched to
+an experiment, placed in attachment storage and recorded as a
+``FileAttachment``. Folders in 'link' mode keep the instrument's file, so
+it is copied: a hardlink would share the inode, and an instrument
+rewriting the file in place would change the attachment under its
+content hash. 'move' folders hand the file over, so it is hardlinked and
+only copied when the watch folder is on a different filesystem from
+``MEDIA_ROOT``.
+
+A file is matched, in order, by a sidecar ``<file>.meta.json`` holding
+``{"experiment": ..., "description": ..., "user": ...}``, by the folder's
+``pattern`` (a regex whose ``experiment`` group is matched against
+experiment ids, then titles), or by the folder's fixed ``experiment``.
+"""
+import errno
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from core import activity
+from .file_models import FileAttachment, InstrumentFile, experiment_file_path
+from .integrity import hash_file
+from .models import Experiment
+from . import tabular
+
+DEFAULT_INGEST_CONFIG = {
+    'FOLDERS': [],
+    'POLL_SECONDS': 2,
+    # Files modified more recently than this may still be being written
+    'SETTLE_SECONDS': 10,
+    'BATCH_SIZE': 500,
+}
+DEFAULT_FOLDER_CONFIG = {
+    'pattern': None,
+    'experiment': None,
+    'user': None,
+    # 'link' copies and leaves the instrument's file in place, 'move' removes it once ingested
+    'mode': 'link',
+}
+SIDECAR_SUFFIX = '.meta.json'
+IGNORED_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', SIDECAR_SUFFIX)
+# FileAttachment.file_size is a 32-bit integer column
+MAX_FILE_SIZE = 2 ** 31 - 1
+
+
+class IngestConfigError(Exception):
+    pass
+
+
+def get_ingest_config():
+    config = dict(DEFAULT_INGEST_CONFIG)
+    config.update(getattr(settings, 'INSTRUMENT_INGEST', {}))
+
+    folders = []
+    for folder in config['FOLDERS']:
+        folder = {**DEFAULT_FOLDER_CONFIG, **folder}
+        if not folder.get('path'):
+            raise IngestConfigError('Every watch folder needs a path')
+        if folder['mode'] not in ('link', 'move'):
+            raise IngestConfigError(f"{folder['path']}: mode must be 'link' or 'move'")
+        folder['path'] = os.path.abspath(str(folder['path']))
+        folder['regex'] = re.compile(folder['pattern']) if folder['pattern'] else None
+        folders.append(folder)
+    config['FOLDERS'] = folders
+    return config
+
+
+# Discovery
+
+def is_ignored(name):
+    return name.startswith('.') or name.endswith(IGNORED_SUFFIXES)
+
+
+def scan_folder(root):
+    """Yield (relative path, stat result) for every file under root"""
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root, relative_dir)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if is_ignored(entry.name):
+                continue
+            relative = f'{relative_dir}/{entry.name}' if relative_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(relative)
+                elif entry.is_file(follow_symlinks=False):
+                    yield relative, entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+
+
+class FolderWatcher:
+    """
+    Polls the configured folders and queues settled files it has not seen.
+    Known file versions are kept in memory so a poll of an unchanged folder
+    costs one directory listing and no queries.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.known = {}
+        for folder in config['FOLDERS']:
+            self.known[folder['path']] = set(
+                InstrumentFile.objects.filter(folder=folder['path']).values_list('path', 'size', 'mtime_ns')
+                .iterator(chunk_size=10000)
+            )
+
+    def poll(self):
+        """Queue new files from every folder; returns how many were queued"""
+        settled_before = time.time_ns() - int(self.config['SETTLE_SECONDS'] * 1e9)
+        queued = 0
+        for folder in self.config['FOLDERS']:
+            known = self.known[folder['path']]
+            batch = []
+            for relative, stat in scan_folder(folder['path']):
+                key = (relative, stat.st_size, stat.st_mtime_ns)
+                if key in known or stat.st_mtime_ns > settled_before:
+                    continue
+                if not sidecar_settled(os.path.join(folder['path'], relative), settled_before):
+                    continue
+                batch.append(InstrumentFile(
+                    folder=folder['path'], path=relative, size=stat.st_size, mtime_ns=stat.st_mtime_ns
+                ))
+                known.add(key)
+                if len(batch) >= self.config['BATCH_SIZE']:
+                    queued += self.enqueue(batch)
+                    batch = []
+            queued += self.enqueue(batch)
+        return queued
+
+    def enqueue(self, batch):
+        # ignore_conflicts: another watcher may have queued the same version
+        InstrumentFile.objects.bulk_create(batch, batch_size=1000, ignore_conflicts=True)
+        return len(batch)
+
+
+def sidecar_settled(path, settled_before):
+    try:
+        return os.stat(path + SIDECAR_SUFFIX).st_mtime_ns <= settled_before
+    except FileNotFoundError:
+        return True
+
+
+# Matching
+
+def read_sidecar(path):
+    try:
+        with open(path + SIDECAR_SUFFIX, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f'{SIDECAR_SUFFIX} sidecar must hold a JSON object')
+    return data
+
+
+def experiment_reference(folder, relative, sidecar):
+    """The id or title the file names, or None"""
+    if sidecar.get('experiment'):
+        return str(sidecar['experiment'])
+    if folder['regex']:
+        match = folder['regex'].search(os.path.basename(relative))
+        if match and match.groupdict().get('experiment'):
+            return match.group('experiment')
+    return folder['experiment'] and str(folder['experiment'])
+
+
+def resolve_experiments(references):
+    """Map each reference to an Experiment, or to an error message"""
+    ids = {}
+    for reference in references:
+        try:
+            ids[reference] = uuid.UUID(reference)
+        except ValueError:
+            pass
+    by_id = Experiment.objects.select_related('created_by').in_bulk(list(ids.values()))
+    titles = [reference for reference in references if ids.get(reference) not in by_id]
+    by_title = {}
+    for experiment in Experiment.objects.select_related('created_by').filter(title__in=titles):
+        by_title.setdefault(experiment.title, []).append(experiment)
+
+    resolved = {}
+    for reference in references:
+        if ids.get(reference) in by_id:
+            resolved[reference] = by_id[ids[reference]]
+        elif len(by_title.get(reference, [])) == 1:
+            resolved[reference] = by_title[reference][0]
+        elif reference in by_title:
+            resolved[reference] = f'Several experiments are titled "{reference}"'
+        else:
+            resolved[reference] = f'No experiment matches "{reference}"'
+    return resolved
+
+
+# Placing files
+
+def place_file(source, target, size, mtime_ns, hash_contents=True, hardlink=False):
+    """
+    Copy source to target, or hardlink it when hardlink is set (falling
+    back to a copy across filesystems). Returns the SHA-256 of the
+    contents, or '' when hashing is skipped.
+    """
+    if not unchanged(source, size, mtime_ns):
+        raise ValueError('File changed or was replaced before it could be ingested')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if hardlink:
+        try:
+            os.link(source, target)
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK):
+                raise
+        else:
+            return hash_file(target)[0] if hash_contents else ''
+    tmp_path = f'{target}.tmp-{uuid.uuid4().hex}'
+    try:
+        shutil.copyfile(source, tmp_path)
+        if not unchanged(source, size, mtime_ns):
+            raise ValueError('File changed while it was being ingested')
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return hash_file(target)[0] if hash_contents else ''
+
+
+def unchanged(path, size, mtime_ns):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Processing
+
+def process_batch(config, pool, batch_size=None, hash_contents=True, build_tabular_cache=True):
+    """
+    Claim up to batch_size pending files and ingest them in one
+    transaction. Several workers can run side by side: claimed rows are
+    locked and skipped by the others. Returns {status: count}.
+    """
+    folders = {folder['path']: folder for folder in config['FOLDERS']}
+    storage = FileAttachment._meta.get_field('file').storage
+    now = timezone.now()
+    counts = {}
+
+    with transaction.atomic():
+        rows = list(
+            InstrumentFile.objects.select_for_update(skip_locked=True).filter(
+                status='PENDING', folder__in=list(folders)
+            ).order_by('id')[:batch_size or config['BATCH_SIZE']]
+        )
+        if not rows:
+            return counts
+
+        jobs = {}
+        for row in rows:
+            folder = folders[row.folder]
+            source = os.path.join(row.folder, row.path)
+            try:
+                sidecar = read_sidecar(source)
+            except (OSError, ValueError) as exc:
+                fail(row, 'FAILED', f'Invalid sidecar: {exc}', now)
+                continue
+            if row.size > MAX_FILE_SIZE:
+                fail(row, 'FAILED', 'File is too large for an attachment', now)
+                continue
+            reference = experiment_reference(folder, row.path, sidecar)
+            if not reference:
+                fail(row, 'UNMATCHED', 'No sidecar, pattern match or folder experiment', now)
+                continue
+            jobs[row.pk] = (row, folder, source, sidecar, reference)
+
+        experiments = resolve_experiments({job[4] for job in jobs.values()})
+        usernames = {job[3]['user'] for job in jobs.values() if job[3].get('user')}
+        usernames.update(folder['user'] for folder in folders.values() if folder['user'])
+        users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+        attachments = {}
+        placements = {}
+        for pk, (row, folder, source, sidecar, reference) in list(jobs.items()):
+            experiment = experiments[reference]
+            if isinstance(experiment, str):
+                fail(row, 'UNMATCHED', experiment, now)
+                del jobs[pk]
+                continue
+            username = sidecar.get('user') or folder['user']
+            user = users.get(username) if username else experiment.created_by
+            if user is None:
+                fail(row, 'FAILED', f'Unknown user "{username}"', now)
+                del jobs[pk]
+                continue
+            attachment = FileAttachment(
+                experiment=experiment, file_name=os.path.basename(row.path)[:255], file_size=row.size,
+                description=str(sidecar.get('description', '')), uploaded_by=user
+            )
+            attachment.file = experiment_file_path(attachment, attachment.file_name)
+            attachment.file_type = attachment.determine_file_type()
+            attachments[pk] = attachment
+            placements[pk] = pool.submit(
+                place_file, source, storage.path(attachment.file.name), row.size, row.mtime_ns, hash_contents,
+                folder['mode'] == 'move'
+            )
+
+        placed = []
+        try:
+            for pk, future in placements.items():
+                row, attachment = jobs[pk][0], attachments[pk]
+                try:
+                    attachment.content_hash = future.result()
+                except (OSError, ValueError) as exc:
+                    fail(row, 'FAILED', str(exc), now)
+                    remove_quietly(storage.path(attachment.file.name))
+                    del attachments[pk]
+                    continue
+                placed.append(storage.path(attachment.file.name))
+
+            FileAttachment.objects.bulk_create(attachments.values(), batch_size=500)
+            for pk, attachment in attachments.items():
+                row = jobs[pk][0]
+                row.status, row.error, row.processed_at = 'INGESTED', '', now
+                row.experiment_id, row.attachment_id = attachment.experiment_id, attachment.pk
+            InstrumentFile.objects.bulk_update(
+                rows, ['status', 'error', 'experiment', 'attachment', 'processed_at'], batch_size=500
+            )
+            # bulk_create skips the upload signal that records this
+            activity.record_many([
+                activity.build_event('FILE_UPLOADED', attachment.experiment, attachment.uploaded_by,
+                                     file_id=str(attachment.pk), file_name=attachment.file_name,
+                                     file_size=attachment.file_size, source='instrument')
+                for attachment in attachments.values()
+            ])
+        except BaseException:
+            # Nothing was recorded, so take the placed files back out
+            for path in placed:
+                remove_quietly(path)
+            raise
+
+        moved = [jobs[pk][2] for pk in attachments if jobs[pk][1]['mode'] == 'move']
+        tabular_attachments = [
+            attachment for attachment in attachments.values()
+            if build_tabular_cache and tabular.is_tabular(attachment)
+        ]
+        transaction.on_commit(lambda: finish_batch(pool, moved, tabular_attachments))
+
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    return counts
+
+
+def fail(row, status, error, now):
+    row.status, row.error, row.processed_at = status, error[:2000], now
+
+
+def finish_batch(pool, moved, tabular_attachments):
+    """After commit: drop moved originals and parse tabular files"""
+    for path in moved:
+        remove_quietly(path)
+        remove_quietly(path + SIDECAR_SUFFIX)
+    list(pool.map(tabular.build_cache_quietly, tabular_attachments))
+
+
+def remove_moved_leftovers(config):
+    """
+    Delete originals in 'move' folders whose ingest committed but whose
+    removal was cut short, e.g. by a crash right after the commit
+    """
+    removed = 0
+    for folder in config['FOLDERS']:
+        if folder['mode'] != 'move':
+            continue
+        rows = InstrumentFile.objects.filter(folder=folder['path'], status='INGESTED').values_list(
+            'path', 'size', 'mtime_ns'
+        )
+        for relative, size, mtime_ns in rows.iterator(chunk_size=5000):
+            path = os.path.join(folder['path'], relative)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                remove_quietly(path)
+                remove_quietly(path + SIDECAR_SUFFIX)
+                removed += 1
+    return removed
+
+
+def requeue(statuses):
+    """Put unmatched or failed files back in the queue, e.g. after adding sidecars"""
+    return InstrumentFile.objects.filter(status__in=statuses).update(
+        status='PENDING', error='', processed_at=None
+    )
@@ -0,0 +1,121 @@
+"""
+Helpers for the attachment integrity scanner.
+
+The scanner walks ``MEDIA_ROOT/experiments`` in a deterministic order so a
+checkpoint of the last processed path is enough to resume, hashes files in
+a thread pool, and throttles reads with a shared byte-rate limiter.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class RateLimiter:
+    """Token bucket shared by all hashing threads (bytes per second)"""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.allowance = bytes_per_second
+        self.last_check = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last_check) * self.rate)
+            self.last_check = now
+            self.allowance -= nbytes
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def hash_file(path, rate_limiter=None):
+    """Return (sha256 hex digest, size) of a file, throttled by rate_limiter"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            if rate_limiter:
+                rate_limiter.acquire(len(chunk))
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def walk_key(relative_path, is_file=True):
+    """
+    Sort key matching the order of ``iter_files``
+
+    Files in a directory come before its subdirectories, and names are
+    compared component by component.
+    """
+    parts = relative_path.split('/')
+    key = tuple((1, part) for part in parts[:-1])
+    return key + ((0 if is_file else 1, parts[-1]),)
+
+
+def iter_files(root, relative_to, after=None):
+    """
+    Yield storage-relative paths of files under root in walk_key order
+
+    Subtrees that sort entirely before ``after`` are pruned without being
+    listed, so resuming deep into a large tree is cheap.
+    """
+    after_key = walk_key(after) if after else None
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, relative_to).replace(os.sep, '/')
+
+        dirnames.sort()
+        if after_key:
+            dirnames[:] = [
+                d for d in dirnames
+                if walk_key(f'{rel_dir}/{d}', is_file=False) >= after_key[:len(rel_dir.split('/')) + 1]
+            ]
+
+        for filename in sorted(filenames):
+            rel_path = f'{rel_dir}/{filename}'
+            if after_key and walk_key(rel_path) <= after_key:
+                continue
+            yield rel_path
+
+
+class Checkpoint:
+    """Resumable scan state persisted as JSON after every batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+        return self.state
+
+    def save(self, **state):
+        self.state.update(state)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.state = {}
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
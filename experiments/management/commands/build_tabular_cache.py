@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from experiments.file_models import FileAttachment
+from experiments import tabular
+
+
+class Command(BaseCommand):
+    help = "Parse tabular DATA/EXCEL attachments into the columnar cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--experiment', help="Only process attachments of this experiment id")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Rebuild caches even if they are up to date")
+
+    def handle(self, *args, **options):
+        attachments = FileAttachment.objects.filter(file_type__in=['DATA', 'EXCEL'])
+        if options['experiment']:
+            attachments = attachments.filter(experiment_id=options['experiment'])
+
+        built = skipped = failed = 0
+        for attachment in attachments.iterator():
+            if not tabular.is_tabular(attachment):
+                continue
+
+            if not options['rebuild'] and tabular.load_manifest(attachment) is not None:
+                skipped += 1
+                continue
+
+            try:
+                manifest = tabular.build_cache(attachment)
+            except (tabular.TabularParseError, OSError) as e:
+                failed += 1
+                self.stderr.write(f"{attachment.id} ({attachment.file_name}): {e}")
+                continue
+
+            built += 1
+            self.stdout.write(
+                f"{attachment.file_name}: {manifest['row_count']} rows, "
+                f"{len(manifest['columns'])} columns"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {built} cache(s), {skipped} up to date, {failed} failed"
+        ))
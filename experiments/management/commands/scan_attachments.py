@@ -0,0 +1,185 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from experiments.file_models import FileAttachment
+from experiments.integrity import Checkpoint, RateLimiter, hash_file, iter_files
+
+
+class Command(BaseCommand):
+    help = ("Cross-check MEDIA_ROOT/experiments against FileAttachment rows and report "
+            "orphan files, missing files and hash mismatches")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help="Delete orphan files and rows whose file is missing, "
+                                 "and backfill empty hashes")
+        parser.add_argument('--skip-hash', action='store_true',
+                            help="Only compare sizes, do not read file contents")
+        parser.add_argument('--workers', type=int, default=4, help="Hashing threads")
+        parser.add_argument('--max-mb-per-sec', type=float, default=50,
+                            help="Read bandwidth cap across all threads (0 = unlimited)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Files or rows per batch between checkpoints")
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Never treat files younger than this as orphans (uploads in flight)")
+        parser.add_argument('--checkpoint',
+                            default=os.path.join(settings.MEDIA_ROOT, '.attachment_scan.json'),
+                            help="Checkpoint file used to resume an interrupted scan")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.storage = FileAttachment._meta.get_field('file').storage
+        self.rate_limiter = RateLimiter(options['max_mb_per_sec'] * 1024 * 1024)
+
+        self.checkpoint = Checkpoint(options['checkpoint'])
+        if options['restart']:
+            self.checkpoint.clear()
+        state = self.checkpoint.load()
+        if state:
+            self.stdout.write(f"Resuming scan from checkpoint ({state.get('phase')})")
+        else:
+            state = self.checkpoint.state
+            state.update({
+                'phase': 'files',
+                'last_path': None,
+                'last_id': None,
+                'started_at': datetime.now(dt_timezone.utc).isoformat(),
+                'counts': {'files': 0, 'rows': 0, 'orphan_files': 0, 'missing_files': 0,
+                           'hash_mismatches': 0, 'size_mismatches': 0, 'hashes_backfilled': 0,
+                           'fixed': 0},
+            })
+        self.counts = state['counts']
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            self.pool = pool
+            if state['phase'] == 'files':
+                self.scan_files(state['last_path'])
+                self.checkpoint.save(phase='rows', last_id=None)
+            self.scan_rows(self.checkpoint.state['last_id'])
+
+        self.checkpoint.clear()
+        summary = ', '.join(f"{key.replace('_', ' ')}: {value}" for key, value in self.counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Scan complete. {summary}"))
+
+    def report(self, kind, message):
+        self.stdout.write(f"{kind:<15} {message}")
+
+    # Phase 1: files on disk -> rows
+
+    def scan_files(self, after):
+        root = os.path.join(settings.MEDIA_ROOT, 'experiments')
+        if not os.path.isdir(root):
+            return
+
+        batch = []
+        for name in iter_files(root, settings.MEDIA_ROOT, after=after):
+            batch.append(name)
+            if len(batch) >= self.options['batch_size']:
+                self.check_file_batch(batch)
+                batch = []
+        if batch:
+            self.check_file_batch(batch)
+
+    def check_file_batch(self, names):
+        rows = {
+            row['file']: row
+            for row in FileAttachment.objects.filter(file__in=names).values(
+                'id', 'file', 'file_size', 'content_hash'
+            )
+        }
+        grace_cutoff = time.time() - self.options['grace_minutes'] * 60
+
+        to_hash = []
+        for name in names:
+            path = self.storage.path(name)
+            row = rows.get(name)
+            if row is None:
+                self.check_orphan(name, path, grace_cutoff)
+                continue
+
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue  # Deleted since listing; the row phase will catch it
+            if size != row['file_size']:
+                self.counts['size_mismatches'] += 1
+                self.report('SIZE_MISMATCH', f"{row['id']} {name} ({size} on disk, {row['file_size']} recorded)")
+            elif not self.options['skip_hash']:
+                to_hash.append((row, path))
+
+        for row, result in zip(
+            [row for row, _ in to_hash],
+            self.pool.map(self.hash_path, [path for _, path in to_hash])
+        ):
+            self.check_hash(row, result)
+
+        self.counts['files'] += len(names)
+        self.checkpoint.save(last_path=names[-1], counts=self.counts)
+
+    def check_orphan(self, name, path, grace_cutoff):
+        try:
+            if os.path.getmtime(path) > grace_cutoff:
+                return
+        except FileNotFoundError:
+            return
+
+        self.counts['orphan_files'] += 1
+        self.report('ORPHAN_FILE', name)
+        if self.options['fix']:
+            self.storage.delete(name)
+            self.counts['fixed'] += 1
+
+    def hash_path(self, path):
+        try:
+            return hash_file(path, self.rate_limiter)
+        except OSError:
+            return None
+
+    def check_hash(self, row, result):
+        if result is None:
+            return
+        digest, _ = result
+
+        if not row['content_hash']:
+            if self.options['fix']:
+                FileAttachment.objects.filter(id=row['id']).update(content_hash=digest)
+                self.counts['hashes_backfilled'] += 1
+        elif digest != row['content_hash']:
+            self.counts['hash_mismatches'] += 1
+            self.report('HASH_MISMATCH', f"{row['id']} {row['file']}")
+
+    # Phase 2: rows -> files (hot or cold tier)
+
+    def scan_rows(self, after_id):
+        while True:
+            rows = FileAttachment.objects.order_by('id')
+            if after_id:
+                rows = rows.filter(id__gt=after_id)
+            batch = list(rows.values('id', 'file', 'storage_tier')[:self.options['batch_size']])
+            if not batch:
+                return
+
+            missing = [row for row in batch if not self.file_exists(row)]
+            for row in missing:
+                self.counts['missing_files'] += 1
+                self.report('MISSING_FILE', f"{row['id']} {row['file']}")
+            if missing and self.options['fix']:
+                # Deleting rows of missing files is safe: the post_delete
+                # cleanup finds nothing to remove
+                deleted, _ = FileAttachment.objects.filter(id__in=[row['id'] for row in missing]).delete()
+                self.counts['fixed'] += deleted
+
+            self.counts['rows'] += len(batch)
+            after_id = str(batch[-1]['id'])
+            self.checkpoint.save(last_id=after_id, counts=self.counts)
+
+    def file_exists(self, row):
+        if row['storage_tier'] == 'HOT' and self.storage.is_hot(row['file']):
+            return True
+        return self.storage.exists(row['file'])
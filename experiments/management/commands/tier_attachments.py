@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from experiments.file_models import FileAttachment
+from experiments.storage import get_storage_config
+
+
+class Command(BaseCommand):
+    help = "Move attachments that have not been read for N days to cold object storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help="Idle days before demotion (default ATTACHMENT_STORAGE['TIER_AFTER_DAYS'])")
+        parser.add_argument('--limit', type=int, help="Maximum number of files to move")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = get_storage_config()['TIER_AFTER_DAYS']
+        cutoff = timezone.now() - timedelta(days=days)
+
+        # Files never read since upload age from their upload time
+        candidates = FileAttachment.objects.filter(storage_tier='HOT').filter(
+            Q(last_accessed_at__lt=cutoff) |
+            Q(last_accessed_at__isnull=True, uploaded_at__lt=cutoff)
+        ).order_by('uploaded_at')
+        if options['limit']:
+            candidates = candidates[:options['limit']]
+
+        moved = failed = 0
+        moved_bytes = 0
+        for attachment in candidates.iterator():
+            if options['dry_run']:
+                self.stdout.write(f"Would move {attachment.file.name} ({attachment.file_size} bytes)")
+                moved += 1
+                moved_bytes += attachment.file_size
+                continue
+
+            try:
+                attachment.move_to_cold_storage()
+            except Exception as e:
+                # e.g. an object store ClientError; the other files can still move
+                failed += 1
+                self.stderr.write(f"{attachment.file.name}: {e}")
+                continue
+
+            moved += 1
+            moved_bytes += attachment.file_size
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} file(s), {moved_bytes} bytes, idle for more than {days} days "
+            f"({failed} failed)"
+        ))
@@ -0,0 +1,94 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from experiments import instrument_ingest
+
+
+class Command(BaseCommand):
+    help = ("Watch the folders in INSTRUMENT_INGEST['FOLDERS'] and attach instrument result "
+            "files to experiments. New files are queued in the InstrumentFile table, so a "
+            "restarted watcher picks up where it left off. Runs until interrupted unless "
+            "--once is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Poll once, ingest everything queued and exit")
+        parser.add_argument('--batch-size', type=int, help="Files per transaction "
+                                                           "(default INSTRUMENT_INGEST['BATCH_SIZE'])")
+        parser.add_argument('--workers', type=int, default=8, help="Threads linking and hashing files")
+        parser.add_argument('--skip-hash', action='store_true',
+                            help="Leave content_hash empty (scan_attachments --fix backfills it)")
+        parser.add_argument('--skip-tabular-cache', action='store_true',
+                            help="Do not parse tabular files now (build_tabular_cache can do it later)")
+        parser.add_argument('--retry', action='store_true',
+                            help="Requeue files that were unmatched or failed before starting")
+
+    def handle(self, *args, **options):
+        try:
+            config = instrument_ingest.get_ingest_config()
+        except instrument_ingest.IngestConfigError as exc:
+            raise CommandError(str(exc))
+        if not config['FOLDERS']:
+            raise CommandError("No watch folders configured in INSTRUMENT_INGEST['FOLDERS']")
+        if options['batch_size']:
+            config['BATCH_SIZE'] = options['batch_size']
+
+        if options['retry']:
+            requeued = instrument_ingest.requeue(['UNMATCHED', 'FAILED'])
+            self.stdout.write(f"Requeued {requeued} files")
+        removed = instrument_ingest.remove_moved_leftovers(config)
+        if removed:
+            self.stdout.write(f"Removed {removed} originals left behind by an interrupted run")
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        watcher = instrument_ingest.FolderWatcher(config)
+        for folder in config['FOLDERS']:
+            self.stdout.write(f"Watching {folder['path']} ({folder['mode']})")
+
+        totals = {}
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            try:
+                while not self.stopping:
+                    queued = watcher.poll()
+                    processed = self.drain(config, pool, options, totals)
+                    if queued or processed:
+                        self.stdout.write(f"Queued {queued}, processed {processed}")
+                    if options['once']:
+                        break
+                    if not queued and not processed:
+                        time.sleep(config['POLL_SECONDS'])
+            except KeyboardInterrupt:
+                pass
+
+        summary = ', '.join(f"{status.lower()}: {count}" for status, count in sorted(totals.items()))
+        self.stdout.write(self.style.SUCCESS(f"Watcher stopped. {summary or 'no files processed'}"))
+
+    def drain(self, config, pool, options, totals):
+        """Work off the queue batch by batch; returns how many files were processed"""
+        processed = 0
+        while not self.stopping:
+            started = time.monotonic()
+            counts = instrument_ingest.process_batch(
+                config, pool, hash_contents=not options['skip_hash'],
+                build_tabular_cache=not options['skip_tabular_cache']
+            )
+            batch = sum(counts.values())
+            if not batch:
+                break
+            processed += batch
+            for status, count in counts.items():
+                totals[status] = totals.get(status, 0) + count
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"  {batch} files in {elapsed:.2f}s ({batch / elapsed if elapsed else 0:,.0f}/s): "
+                + ', '.join(f"{status.lower()} {count}" for status, count in sorted(counts.items()))
+            )
+        return processed
+
+    def stop(self, signum, frame):
+        # Finish the batch in progress, then exit
+        self.stopping = True
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:56
+
+import experiments.file_models
+import experiments.storage
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0004_experiment_protocol_template"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileattachment",
+            name="last_accessed_at",
+            field=models.DateTimeField(
+                blank=True, help_text="Last time the file was read", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileattachment",
+            name="storage_tier",
+            field=models.CharField(
+                choices=[("HOT", "Local disk"), ("COLD", "Object storage")],
+                default="HOT",
+                max_length=10,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="fileattachment",
+            name="file",
+            field=models.FileField(
+                storage=experiments.storage.get_attachment_storage,
+                upload_to=experiments.file_models.experiment_file_path,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="fileattachment",
+            index=models.Index(
+                fields=["storage_tier", "last_accessed_at"],
+                name="experiments_storage_3bdb43_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0005_fileattachment_storage_tier"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileattachment",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, help_text="SHA-256 of the file contents", max_length=64
+            ),
+        ),
+    ]
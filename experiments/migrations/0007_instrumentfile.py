@@ -0,0 +1,94 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("experiments", "0006_fileattachment_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InstrumentFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "folder",
+                    models.CharField(
+                        help_text="Watch folder as configured", max_length=255
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(
+                        help_text="Path relative to the watch folder", max_length=1024
+                    ),
+                ),
+                ("size", models.BigIntegerField()),
+                ("mtime_ns", models.BigIntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("INGESTED", "Ingested"),
+                            ("UNMATCHED", "No matching experiment"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="PENDING",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("discovered_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "attachment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="instrument_files",
+                        to="experiments.fileattachment",
+                    ),
+                ),
+                (
+                    "experiment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="instrument_files",
+                        to="experiments.experiment",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "PENDING")),
+                        fields=["id"],
+                        name="instrument_file_pending_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("folder", "path", "size", "mtime_ns"),
+                        name="one_instrument_file_version",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,9 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from samples.models import Sample
 from ckeditor.fields import RichTextField
 import uuid
 from protocols.models import Protocol
+from core.content import extract_inline_images_from
 
 class Experiment(models.Model):
     STATUS_CHOICES = [
@@ -14,6 +15,9 @@ class Experiment(models.Model):
         ('CANCELLED', 'Cancelled'),
     ]
     
+    # Rich-text documentation fields
+    CONTENT_FIELDS = ['objective', 'materials', 'procedure', 'results', 'conclusion', 'notes']
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -53,4 +57,41 @@ class Experiment(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+    
+    def save(self, *args, **kwargs):
+        """Move pasted base64 images out of the rich-text fields before saving"""
+        extract_inline_images_from(self, self.CONTENT_FIELDS)
+        super().save(*args, **kwargs)
+    
+    def add_samples(self, sample_ids):
+        """Link samples without loading the existing relation, returning how many were new"""
+        SampleLink = Experiment.samples.through
+        sample_ids = set(sample_ids)
+        existing = set(SampleLink.objects.filter(
+            experiment_id=self.pk, sample_id__in=sample_ids
+        ).values_list('sample_id', flat=True))
+        new_ids = sample_ids - existing
+        # ignore_conflicts covers links created concurrently since the check
+        SampleLink.objects.bulk_create(
+            [SampleLink(experiment_id=self.pk, sample_id=sample_id) for sample_id in new_ids],
+            batch_size=1000, ignore_conflicts=True
+        )
+        return len(new_ids)
+    
+    def remove_samples(self, sample_ids):
+        """Unlink samples with one set-based delete, returning how many were removed"""
+        removed, _ = Experiment.samples.through.objects.filter(
+            experiment_id=self.pk, sample_id__in=set(sample_ids)
+        ).delete()
+        return removed
+    
+    def replace_samples(self, sample_ids):
+        """Make sample_ids the exact linked set, returning (added, removed)"""
+        sample_ids = set(sample_ids)
+        with transaction.atomic():
+            removed, _ = Experiment.samples.through.objects.filter(
+                experiment_id=self.pk
+            ).exclude(sample_id__in=sample_ids).delete()
+            added = self.add_samples(sample_ids)
+        return added, removed
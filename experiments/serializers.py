@@ -1,7 +1,23 @@
 from rest_framework import serializers
+from django.db import transaction
 from .models import Experiment
 from .file_serializers import FileAttachmentSerializer
+from samples.models import Sample
 from samples.serializers import SampleSerializer
+from core.rendering import rendered_fields
+
+
+def validate_existing_samples(sample_ids):
+    """Reject ids of samples that do not exist, using a single query"""
+    requested = set(sample_ids)
+    found = Sample.objects.only('pk').in_bulk(requested)
+    missing = requested - set(found)
+    if missing:
+        raise serializers.ValidationError(
+            [f'Sample {sample_id} does not exist' for sample_id in sorted(map(str, missing))]
+        )
+    return list(dict.fromkeys(sample_ids))
+
 
 class ExperimentSerializer(serializers.ModelSerializer):
     samples = SampleSerializer(many=True, read_only=True)
@@ -13,6 +29,7 @@ class ExperimentSerializer(serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.username', read_only=True)
     attachments = FileAttachmentSerializer(many=True, read_only=True)
     attachment_count = serializers.SerializerMethodField()
+    rendered = serializers.SerializerMethodField()
 
     protocol_template_code = serializers.CharField(source='protocol_template.protocol_code', read_only=True)
     protocol_template_title = serializers.CharField(source='protocol_template.title', read_only=True)
@@ -27,13 +44,22 @@ class ExperimentSerializer(serializers.ModelSerializer):
         """Return count of file attachments"""
         return obj.attachments.count()
     
+    def get_rendered(self, obj):
+        """Sanitized HTML, plain text and excerpt for each rich-text field"""
+        return rendered_fields(obj, Experiment.CONTENT_FIELDS)
+    
+    def validate_sample_ids(self, value):
+        return validate_existing_samples(value)
+    
+    @transaction.atomic
     def create(self, validated_data):
         sample_ids = validated_data.pop('sample_ids', [])
         experiment = Experiment.objects.create(**validated_data)
         if sample_ids:
-            experiment.samples.set(sample_ids)
+            experiment.add_samples(sample_ids)
         return experiment
     
+    @transaction.atomic
     def update(self, instance, validated_data):
         sample_ids = validated_data.pop('sample_ids', None)
         
@@ -42,7 +68,7 @@ class ExperimentSerializer(serializers.ModelSerializer):
         instance.save()
         
         if sample_ids is not None:
-            instance.samples.set(sample_ids)
+            instance.replace_samples(sample_ids)
         
         return instance
 
@@ -60,10 +86,25 @@ class ExperimentListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Experiment
         fields = ['id', 'title', 'description', 'status', 'start_date', 'end_date', 
-                  'created_by_name', 'sample_count', 'attachment_count', 'created_at', 'updated_at']
+                  'created_by_name', 'sample_count', 'attachment_count', 
+                  'protocol_template_code', 'protocol_template_title', 'created_at', 'updated_at']
     
     def get_sample_count(self, obj):
         return obj.samples.count()
     
     def get_attachment_count(self, obj):
-        return obj.attachments.count()
\ No newline at end of file
+        return obj.attachments.count()
+
+class SampleLinkSerializer(serializers.Serializer):
+    """Sample ids for adding, removing or replacing experiment sample links"""
+    MAX_SAMPLES = 10000
+    
+    sample_ids = serializers.ListField(
+        child=serializers.UUIDField(), allow_empty=True, max_length=MAX_SAMPLES
+    )
+    
+    def validate_sample_ids(self, value):
+        # Unlinking a sample that no longer exists is harmless
+        if self.context.get('operation') == 'remove':
+            return list(dict.fromkeys(value))
+        return validate_existing_samples(value)
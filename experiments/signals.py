@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from core import activity, live
+from protocols.models import Protocol
+from .models import Experiment
+from .file_models import FileAttachment
+from . import tabular
+
+NOT_LOADED = object()
+TEMPLATE_FIELDS = {'protocol_template', 'protocol_template_id'}
+
+
+@receiver(post_delete, sender=FileAttachment)
+def delete_attachment_file(sender, instance, **kwargs):
+    """
+    Remove the stored file once the row deletion commits
+
+    Runs for direct deletes and for experiment cascade deletes, so blobs are
+    never left behind without a row. Deleting after commit means a rolled
+    back delete never loses the file.
+    """
+    if not instance.file:
+        return
+
+    storage = instance.file.storage
+    name = instance.file.name
+    # The deletion collector clears instance.pk before the commit
+    cache_dir = tabular.get_cache_dir(instance)
+
+    def _delete():
+        tabular.discard_cache(cache_dir)
+        storage.delete(name)
+
+    transaction.on_commit(_delete)
+
+
+@receiver(post_init, sender=Experiment)
+def remember_loaded_status(sender, instance, **kwargs):
+    """Keep the status and protocol template as loaded so saves can tell changes apart"""
+    instance._loaded_status = instance.__dict__.get('status')
+    # Deferred; the template cannot change through this instance
+    instance._loaded_protocol_template_id = instance.__dict__.get('protocol_template_id', NOT_LOADED)
+
+
+@receiver(post_save, sender=Experiment)
+def count_protocol_usage(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Keep Protocol.times_used in step with experiments saved through any path
+    (API, admin, ORM); bulk creates adjust the counter themselves
+    """
+    current = instance.protocol_template_id
+    if created:
+        Protocol.adjust_usage(current, 1)
+    elif update_fields is None or TEMPLATE_FIELDS & set(update_fields):
+        previous = instance._loaded_protocol_template_id
+        if previous is not NOT_LOADED and previous != current:
+            Protocol.adjust_usage(previous, -1)
+            Protocol.adjust_usage(current, 1)
+    else:
+        return
+    instance._loaded_protocol_template_id = current
+
+
+@receiver(post_delete, sender=Experiment)
+def release_protocol_usage(sender, instance, **kwargs):
+    """Stop counting a deleted experiment against its protocol template"""
+    Protocol.adjust_usage(instance.protocol_template_id, -1)
+
+
+@receiver(post_save, sender=Experiment)
+def record_experiment_saved(sender, instance, created, **kwargs):
+    if created:
+        activity.record('CREATED', instance, instance.created_by)
+        live.publish('counts', {'experiments': 1})
+    elif instance._loaded_status and instance._loaded_status != instance.status:
+        activity.record('STATUS_CHANGED', instance,
+                        previous_status=instance._loaded_status, status=instance.status)
+        live.publish('experiment.status', {
+            'id': str(instance.pk), 'title': instance.title,
+            'status': instance.status, 'previous_status': instance._loaded_status
+        })
+    else:
+        activity.record('UPDATED', instance)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Experiment)
+def record_experiment_deleted(sender, instance, **kwargs):
+    activity.record('DELETED', instance)
+    live.publish('counts', {'experiments': -1})
+
+
+@receiver(post_save, sender=FileAttachment)
+def record_file_uploaded(sender, instance, created, **kwargs):
+    """File uploads show up in the timeline of their experiment"""
+    if created:
+        activity.record('FILE_UPLOADED', instance.experiment, instance.uploaded_by,
+                        file_id=str(instance.pk), file_name=instance.file_name,
+                        file_size=instance.file_size)
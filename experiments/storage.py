@@ -0,0 +1,235 @@
+"""
+Tiered storage for experiment file attachments.
+
+Attachments live on a hot local tier (``MEDIA_ROOT``) and can be demoted to
+a cold object-store tier. The cold tier is anything that speaks the subset
+of the S3 client API used here (``put_object``, ``get_object``,
+``head_object``, ``delete_object``): a boto3 S3 client in production, or
+``LocalObjectStore``, a filesystem-backed stand-in for development and
+tests. Reads of cold files are faulted back in to the hot tier or streamed
+straight from the object store, depending on ``ATTACHMENT_STORAGE['FAULT_IN']``.
+"""
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import DatabaseError
+
+DEFAULT_STORAGE_CONFIG = {
+    'COLD_CLIENT': 'local',
+    'COLD_ROOT': None,
+    'COLD_BUCKET': 'lims-attachments',
+    'ENDPOINT_URL': None,
+    'FAULT_IN': True,
+    'TIER_AFTER_DAYS': 90,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def get_storage_config():
+    config = dict(DEFAULT_STORAGE_CONFIG)
+    config.update(getattr(settings, 'ATTACHMENT_STORAGE', {}))
+    if not config['COLD_ROOT']:
+        config['COLD_ROOT'] = os.path.join(settings.BASE_DIR, 'cold_storage')
+    return config
+
+
+def is_not_found(error):
+    """Check if an object-store error means the key does not exist"""
+    if isinstance(error, FileNotFoundError):
+        return True
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+class LocalObjectStore:
+    """
+    Filesystem-backed stand-in for an S3 client
+
+    Objects are stored as plain files under ``<root>/<bucket>/<key>``.
+    Missing keys raise ``FileNotFoundError``.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(os.path.normpath(self.root), bucket) + os.sep):
+            raise ValueError(f'Invalid object key: {key}')
+        return path
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                if isinstance(Body, bytes):
+                    f.write(Body)
+                else:
+                    shutil.copyfileobj(Body, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {}
+
+    def head_object(self, Bucket, Key):
+        stat = os.stat(self._path(Bucket, Key))
+        return {
+            'ContentLength': stat.st_size,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+        }
+
+    def get_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        body = open(path, 'rb')
+        return {'Body': body, 'ContentLength': os.fstat(body.fileno()).st_size}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+
+class TieredAttachmentStorage(FileSystemStorage):
+    """Local filesystem storage that can demote files to a cold object store"""
+
+    def __init__(self, cold_client, bucket, fault_in=True, **kwargs):
+        super().__init__(**kwargs)
+        self.cold_client = cold_client
+        self.bucket = bucket
+        self.fault_in = fault_in
+
+    def _cold_key(self, name):
+        return name.replace('\\', '/')
+
+    # Tier inspection
+
+    def is_hot(self, name):
+        return super().exists(name)
+
+    def is_cold(self, name):
+        try:
+            self.cold_client.head_object(Bucket=self.bucket, Key=self._cold_key(name))
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def exists(self, name):
+        return self.is_hot(name) or self.is_cold(name)
+
+    def size(self, name):
+        if self.is_hot(name):
+            return super().size(name)
+        head = self.cold_client.head_object(Bucket=self.bucket, Key=self._cold_key(name))
+        return head['ContentLength']
+
+    # Reads and deletes span both tiers
+
+    def _open(self, name, mode='rb'):
+        if 'r' not in mode or self.is_hot(name):
+            return super()._open(name, mode)
+
+        if self.fault_in:
+            self.promote(name)
+            return super()._open(name, mode)
+
+        obj = self.cold_client.get_object(Bucket=self.bucket, Key=self._cold_key(name))
+        return File(obj['Body'], name=name)
+
+    def delete(self, name):
+        super().delete(name)
+        try:
+            self.cold_client.delete_object(Bucket=self.bucket, Key=self._cold_key(name))
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+
+    # Tier transitions
+
+    def demote(self, name):
+        """Move a file from local disk to the cold object store"""
+        with super()._open(name, 'rb') as f:
+            self.cold_client.put_object(Bucket=self.bucket, Key=self._cold_key(name), Body=f)
+
+        local_size = super().size(name)
+        head = self.cold_client.head_object(Bucket=self.bucket, Key=self._cold_key(name))
+        if head['ContentLength'] != local_size:
+            raise IOError(f'Cold copy of {name} is incomplete '
+                          f'({head["ContentLength"]} of {local_size} bytes)')
+
+        super().delete(name)
+
+    def promote(self, name):
+        """
+        Fault a file back in from the cold object store to local disk.
+        Concurrent reads of the same cold file may race here; whoever loses
+        finds the cold object gone (or cut off mid-read) and the hot copy in
+        place, and returns quietly.
+        """
+        try:
+            obj = self.cold_client.get_object(Bucket=self.bucket, Key=self._cold_key(name))
+        except Exception as e:
+            if is_not_found(e) and self.is_hot(name):
+                return
+            raise
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+
+        body = obj['Body']
+        try:
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(body, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self.is_hot(name):
+                return
+            raise
+        finally:
+            body.close()
+
+        self.cold_client.delete_object(Bucket=self.bucket, Key=self._cold_key(name))
+        # Any read can fault a file in, not only downloads; keep the tier
+        # column tiering selects on in step with the disk. The read itself
+        # has succeeded, so a failed update must not fail it.
+        from .file_models import FileAttachment
+        try:
+            FileAttachment.objects.filter(file=name, storage_tier='COLD').update(storage_tier='HOT')
+        except DatabaseError as e:
+            logger.warning('Could not mark %s hot after fault-in: %s', name, e)
+
+
+def build_cold_client(config):
+    """Create the cold-tier client described by ``ATTACHMENT_STORAGE``"""
+    if config['COLD_CLIENT'] == 's3':
+        import boto3
+        return boto3.client('s3', endpoint_url=config['ENDPOINT_URL'])
+    return LocalObjectStore(config['COLD_ROOT'])
+
+
+@lru_cache(maxsize=None)
+def get_attachment_storage():
+    """Storage used by ``FileAttachment.file``"""
+    config = get_storage_config()
+    return TieredAttachmentStorage(
+        cold_client=build_cold_client(config),
+        bucket=config['COLD_BUCKET'],
+        fault_in=config['FAULT_IN'],
+    )
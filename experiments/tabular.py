@@ -0,0 +1,412 @@
+"""
+Columnar cache for tabular experiment attachments.
+
+CSV, TSV, TXT, JSON and XLSX attachments are parsed once into one NumPy
+``.npy`` file per column under ``TABULAR_CACHE_ROOT/<attachment id>/``.
+Reads memory-map the column files, so column subsets, row ranges and
+summary statistics never reparse the original upload. Text columns are
+stored as one UTF-8 blob plus row offsets, so a single long cell does not
+widen every row of its column.
+
+Uploads are parsed after commit on a small background pool; reads of a
+table that is not cached yet build it on demand.
+"""
+import csv
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+TABULAR_EXTENSIONS = ['.csv', '.tsv', '.txt', '.json', '.xlsx']
+MANIFEST_NAME = 'manifest.json'
+MAX_ROWS_PER_REQUEST = 5000
+# Bumped when the on-disk layout or cell parsing changes; older caches are rebuilt
+CACHE_VERSION = 3
+BACKGROUND_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+_background = None
+
+
+class TabularParseError(ValueError):
+    """Raised when an attachment cannot be parsed as a table"""
+
+
+def get_cache_root():
+    """Root directory that holds one cache directory per attachment"""
+    return getattr(settings, 'TABULAR_CACHE_ROOT',
+                   os.path.join(settings.MEDIA_ROOT, 'tabular_cache'))
+
+
+def get_cache_dir(attachment):
+    return os.path.join(get_cache_root(), str(attachment.id))
+
+
+def is_tabular(attachment):
+    """Check if an attachment can be ingested into the columnar cache"""
+    return (attachment.file_type in ('DATA', 'EXCEL')
+            and attachment.get_file_extension() in TABULAR_EXTENSIONS)
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+def _read_delimited(handle, extension):
+    """Read a delimited text file into (header, rows)"""
+    text = io.TextIOWrapper(handle, encoding='utf-8-sig', errors='replace', newline='')
+    sample = text.read(64 * 1024)
+    text.seek(0)
+
+    if extension == '.tsv':
+        delimiter = '\t'
+    else:
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',\t;').delimiter
+        except csv.Error:
+            delimiter = ','
+
+    reader = csv.reader(text, delimiter=delimiter)
+    try:
+        header = next(reader)
+    except StopIteration:
+        raise TabularParseError('File is empty')
+    return header, reader
+
+
+def _read_json(handle):
+    """Read a JSON list of records or a mapping of column -> values"""
+    try:
+        data = json.load(handle)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise TabularParseError(f'Invalid JSON: {e}')
+
+    if isinstance(data, dict) and all(isinstance(v, list) for v in data.values()):
+        header = list(data.keys())
+        length = max((len(v) for v in data.values()), default=0)
+        rows = (
+            [data[col][i] if i < len(data[col]) else None for col in header]
+            for i in range(length)
+        )
+        return header, rows
+
+    if isinstance(data, list) and all(isinstance(r, dict) for r in data):
+        header = []
+        for record in data:
+            for key in record:
+                if key not in header:
+                    header.append(key)
+        rows = ([record.get(col) for col in header] for record in data)
+        return header, rows
+
+    raise TabularParseError('JSON must be a list of records or an object of column arrays')
+
+
+def _read_xlsx(handle):
+    """Read the first worksheet of an XLSX workbook"""
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(handle, read_only=True, data_only=True)
+    except Exception as e:
+        raise TabularParseError(f'Invalid workbook: {e}')
+
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise TabularParseError('Worksheet is empty')
+    return list(header), rows
+
+
+def _normalise_header(header):
+    """Give every column a unique, non-empty name"""
+    names = []
+    for index, name in enumerate(header):
+        name = str(name).strip() if name is not None else ''
+        if not name:
+            name = f'column_{index + 1}'
+        candidate = name
+        suffix = 2
+        while candidate in names:
+            candidate = f'{name}_{suffix}'
+            suffix += 1
+        names.append(candidate)
+    return names
+
+
+def _to_float(value):
+    """
+    Convert a cell to float, returning None when it is not numeric.
+    Empty and non-finite cells (nan, inf) are missing, since JSON has no
+    value for them.
+    """
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value) if isinstance(value, (int, float)) else float(str(value).strip())
+    except (ValueError, OverflowError):
+        return None
+    return number if math.isfinite(number) else np.nan
+
+
+def _build_column(values):
+    """Turn a list of raw cells into a numeric or text NumPy array"""
+    numeric = []
+    for value in values:
+        converted = _to_float(value)
+        if converted is None:
+            break
+        numeric.append(converted)
+    else:
+        return 'number', np.asarray(numeric, dtype=np.float64)
+
+    encoded = [b'' if v is None else str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(cell) for cell in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    # Row i is blob[offsets[i]:offsets[i + 1]]
+    return 'text', (offsets, blob)
+
+
+def _column_length(kind, data):
+    return len(data[0]) - 1 if kind == 'text' else len(data)
+
+
+def parse_attachment(attachment):
+    """Parse an attachment into an ordered list of (name, kind, array)"""
+    extension = attachment.get_file_extension()
+    if extension not in TABULAR_EXTENSIONS:
+        raise TabularParseError(f'Unsupported file extension: {extension}')
+
+    with attachment.file.open('rb') as handle:
+        if extension == '.json':
+            header, rows = _read_json(handle)
+        elif extension == '.xlsx':
+            header, rows = _read_xlsx(handle)
+        else:
+            header, rows = _read_delimited(handle, extension)
+
+        names = _normalise_header(header)
+        columns = [[] for _ in names]
+        line_number = 1
+        try:
+            for line_number, row in enumerate(rows, start=2):
+                row = list(row)
+                while row and row[-1] in (None, ''):
+                    row.pop()
+                if not row:
+                    continue
+                if len(row) > len(columns):
+                    raise TabularParseError(f'Row {line_number} has more cells than the header')
+                row.extend([None] * (len(columns) - len(row)))
+                for column, cell in zip(columns, row):
+                    column.append(cell)
+        except csv.Error as e:
+            # e.g. a field over csv.field_size_limit()
+            raise TabularParseError(f'Row {line_number + 1}: {e}')
+
+    return [(name, *_build_column(values)) for name, values in zip(names, columns)]
+
+
+# ---------------------------------------------------------------------------
+# Cache management
+# ---------------------------------------------------------------------------
+
+def _source_signature(attachment):
+    return {'file': attachment.file.name, 'size': attachment.file_size}
+
+
+def load_manifest(attachment):
+    """Return the cache manifest, or None if the cache is missing or stale"""
+    path = os.path.join(get_cache_dir(attachment), MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != CACHE_VERSION or manifest.get('source') != _source_signature(attachment):
+        return None
+    return manifest
+
+
+def build_cache(attachment):
+    """
+    Parse an attachment and write its columnar cache
+
+    The cache is written to a temporary directory and swapped into place so
+    readers never observe a half-written cache.
+    """
+    columns = parse_attachment(attachment)
+    row_count = _column_length(*columns[0][1:]) if columns else 0
+
+    cache_dir = get_cache_dir(attachment)
+    tmp_dir = f'{cache_dir}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_dir)
+
+    try:
+        manifest_columns = []
+        for index, (name, kind, data) in enumerate(columns):
+            entry = {'name': name, 'type': kind, 'file': f'{index}.npy'}
+            if kind == 'text':
+                offsets, data = data
+                entry['offsets'] = f'{index}.offsets.npy'
+                np.save(os.path.join(tmp_dir, entry['offsets']), offsets, allow_pickle=False)
+            np.save(os.path.join(tmp_dir, entry['file']), data, allow_pickle=False)
+            manifest_columns.append(entry)
+
+        manifest = {
+            'version': CACHE_VERSION,
+            'source': _source_signature(attachment),
+            'row_count': row_count,
+            'columns': manifest_columns,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, cache_dir)
+        except OSError:
+            # A concurrent build (background or on first read) got there first
+            current = load_manifest(attachment)
+            if current is None:
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return current
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    return manifest
+
+
+def build_cache_quietly(attachment):
+    """Build the cache, logging files that cannot be parsed"""
+    try:
+        build_cache(attachment)
+    except (TabularParseError, OSError) as e:
+        logger.info('Tabular cache not built for attachment %s: %s', attachment.id, e)
+
+
+def schedule_build(attachment):
+    """Build the cache in the background once the current transaction commits"""
+    def submit():
+        global _background
+        if _background is None:
+            _background = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='tabular')
+        _background.submit(build_cache_quietly, attachment)
+    transaction.on_commit(submit)
+
+
+def ensure_cache(attachment):
+    """Return a valid manifest, building the cache on first access"""
+    manifest = load_manifest(attachment)
+    if manifest is None:
+        manifest = build_cache(attachment)
+    return manifest
+
+
+def discard_cache(cache_dir):
+    """Remove the cached columns in a directory from get_cache_dir()"""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def _select_columns(manifest, names):
+    if not names:
+        return manifest['columns']
+
+    by_name = {column['name']: column for column in manifest['columns']}
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise KeyError(', '.join(missing))
+    return [by_name[name] for name in names]
+
+
+def _open_column(attachment, column, key='file'):
+    path = os.path.join(get_cache_dir(attachment), column[key])
+    return np.load(path, mmap_mode='r', allow_pickle=False)
+
+
+def _read_column(attachment, column, start, end):
+    """Cells start:end of a column as JSON-ready values"""
+    if column['type'] == 'number':
+        values = _open_column(attachment, column)[start:end]
+        return [v if math.isfinite(v) else None for v in values.tolist()]
+
+    bounds = _open_column(attachment, column, 'offsets')[start:end + 1].tolist()
+    if not bounds:
+        return []
+    base = bounds[0]
+    text = _open_column(attachment, column)[base:bounds[-1]].tobytes()
+    return [text[a - base:b - base].decode('utf-8') for a, b in zip(bounds, bounds[1:])]
+
+
+def read_rows(attachment, columns=None, offset=0, limit=100):
+    """Return a row range for a subset of columns"""
+    manifest = ensure_cache(attachment)
+    selected = _select_columns(manifest, columns)
+
+    offset = max(offset, 0)
+    limit = max(min(limit, MAX_ROWS_PER_REQUEST), 0)
+    end = min(offset + limit, manifest['row_count'])
+
+    data = {}
+    for column in selected:
+        data[column['name']] = _read_column(attachment, column, offset, end)
+
+    return {
+        'row_count': manifest['row_count'],
+        'offset': offset,
+        'limit': limit,
+        'columns': [{'name': c['name'], 'type': c['type']} for c in selected],
+        'data': data,
+    }
+
+
+def column_stats(attachment, columns=None):
+    """Return vectorized summary statistics for a subset of columns"""
+    manifest = ensure_cache(attachment)
+    selected = _select_columns(manifest, columns)
+
+    stats = []
+    for column in selected:
+        entry = {'name': column['name'], 'type': column['type']}
+
+        if column['type'] == 'number':
+            values = _open_column(attachment, column)
+            present = values[np.isfinite(values)]
+            count = int(present.shape[0])
+            entry['count'] = count
+            entry['null_count'] = int(values.shape[0] - count)
+            if count:
+                entry['min'] = float(present.min())
+                entry['max'] = float(present.max())
+                entry['mean'] = float(present.mean())
+            else:
+                entry['min'] = entry['max'] = entry['mean'] = None
+        else:
+            lengths = np.diff(_open_column(attachment, column, 'offsets'))
+            empty = int(np.count_nonzero(lengths == 0))
+            entry['count'] = int(lengths.shape[0] - empty)
+            entry['null_count'] = empty
+
+        stats.append(entry)
+
+    return {'row_count': manifest['row_count'], 'columns': stats}
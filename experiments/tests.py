@@ -1,3 +1,206 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import tabular
+from .file_models import FileAttachment
+from .models import Experiment
+from .storage import LocalObjectStore, get_attachment_storage
+
+
+class TieredAttachmentStorageTests(TestCase):
+    """Demotion, fault-in and streaming against the filesystem S3 stand-in"""
+
+    CONTENT = b'well,od\nA1,0.5\nA2,0.7\n'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.cold_root, ignore_errors=True)
+
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, TABULAR_CACHE_ROOT=os.path.join(self.media_root, 'tabular_cache')
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.storage = get_attachment_storage()
+        previous = (self.storage.cold_client, self.storage.fault_in)
+        self.storage.cold_client = LocalObjectStore(self.cold_root)
+        self.storage.fault_in = True
+        self.addCleanup(self.restore_storage, previous)
+
+        self.user = User.objects.create_user('analyst', password='secret')
+        self.experiment = Experiment.objects.create(title='Plate read', created_by=self.user)
+        self.attachment = FileAttachment.objects.create(
+            experiment=self.experiment, file=ContentFile(self.CONTENT, name='plate.csv'),
+            file_name='plate.csv', uploaded_by=self.user
+        )
+        self.name = self.attachment.file.name
+
+    def restore_storage(self, previous):
+        self.storage.cold_client, self.storage.fault_in = previous
+
+    def read(self, attachment):
+        with attachment.file.storage.open(attachment.file.name, 'rb') as f:
+            return f.read()
+
+    def test_demote_moves_file_to_cold_tier(self):
+        self.attachment.move_to_cold_storage()
+
+        self.assertFalse(self.storage.is_hot(self.name))
+        self.assertTrue(self.storage.is_cold(self.name))
+        self.assertEqual(self.storage.size(self.name), len(self.CONTENT))
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.storage_tier, 'COLD')
+
+    def test_read_faults_cold_file_back_in(self):
+        self.attachment.move_to_cold_storage()
+
+        self.assertEqual(self.read(self.attachment), self.CONTENT)
+        self.assertTrue(self.storage.is_hot(self.name))
+        self.assertFalse(self.storage.is_cold(self.name))
+        self.attachment.mark_accessed()
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.storage_tier, 'HOT')
+
+    def test_fault_in_outside_downloads_marks_row_hot(self):
+        self.attachment.move_to_cold_storage()
+
+        self.attachment.calculate_hash()
+
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.storage_tier, 'HOT')
+
+    def test_read_streams_from_cold_tier_without_fault_in(self):
+        self.storage.fault_in = False
+        self.attachment.move_to_cold_storage()
+
+        self.assertEqual(self.read(self.attachment), self.CONTENT)
+        self.assertFalse(self.storage.is_hot(self.name))
+        self.assertTrue(self.storage.is_cold(self.name))
+
+    def test_promote_after_concurrent_promote_is_a_no_op(self):
+        self.attachment.move_to_cold_storage()
+
+        self.storage.promote(self.name)
+        # The cold object is gone; a second reader that also saw the file cold must not fail
+        self.storage.promote(self.name)
+        self.assertEqual(self.read(self.attachment), self.CONTENT)
+
+    def test_concurrent_reads_of_cold_file(self):
+        self.attachment.move_to_cold_storage()
+        results, errors = [], []
+
+        def read():
+            try:
+                results.append(self.storage.open(self.name, 'rb').read())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [self.CONTENT] * 8)
+        self.assertTrue(self.storage.is_hot(self.name))
+
+    def test_download_of_cold_file(self):
+        self.attachment.move_to_cold_storage()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(f'/api/experiments/download_file/?file_id={self.attachment.id}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+
+    def test_restore_to_hot_storage(self):
+        self.attachment.move_to_cold_storage()
+        self.attachment.restore_to_hot_storage()
+
+        self.assertTrue(self.storage.is_hot(self.name))
+        self.assertFalse(self.storage.is_cold(self.name))
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.storage_tier, 'HOT')
+
+    def test_delete_removes_cold_copy(self):
+        self.attachment.move_to_cold_storage()
+        self.storage.delete(self.name)
+
+        self.assertFalse(self.storage.exists(self.name))
+
+    def test_delete_in_outer_transaction_removes_tabular_cache(self):
+        tabular.build_cache(self.attachment)
+        cache_dir = tabular.get_cache_dir(self.attachment)
+        self.assertTrue(os.path.isdir(cache_dir))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.experiment.delete()
+
+        self.assertFalse(os.path.exists(cache_dir))
+        self.assertFalse(self.storage.exists(self.name))
+
+    def test_tier_attachments_demotes_idle_files(self):
+        recent = FileAttachment.objects.create(
+            experiment=self.experiment, file=ContentFile(b'fresh', name='fresh.txt'),
+            file_name='fresh.txt', uploaded_by=self.user
+        )
+        FileAttachment.objects.filter(pk=self.attachment.pk).update(
+            uploaded_at=timezone.now() - timedelta(days=120)
+        )
+
+        call_command('tier_attachments', '--days', '90', '--dry-run', stdout=StringIO())
+        self.assertTrue(self.storage.is_hot(self.name))
+
+        out = StringIO()
+        call_command('tier_attachments', '--days', '90', stdout=out)
+
+        self.assertIn('Moved 1 file(s)', out.getvalue())
+        self.assertTrue(self.storage.is_cold(self.name))
+        self.assertFalse(self.storage.is_hot(self.name))
+        self.assertTrue(self.storage.is_hot(recent.file.name))
+        self.assertEqual(
+            dict(FileAttachment.objects.values_list('file_name', 'storage_tier')),
+            {'plate.csv': 'COLD', 'fresh.txt': 'HOT'}
+        )
+
+    def test_tier_attachments_continues_after_object_store_error(self):
+        second = FileAttachment.objects.create(
+            experiment=self.experiment, file=ContentFile(b'second', name='second.txt'),
+            file_name='second.txt', uploaded_by=self.user
+        )
+        FileAttachment.objects.update(uploaded_at=timezone.now() - timedelta(days=120))
+        cold_client = self.storage.cold_client
+        put_object = cold_client.put_object
+
+        def flaky_put_object(**kwargs):
+            if kwargs['Key'] == self.storage._cold_key(self.name):
+                raise RuntimeError('ClientError: SlowDown')
+            return put_object(**kwargs)
+
+        cold_client.put_object = flaky_put_object
+        out, err = StringIO(), StringIO()
+        call_command('tier_attachments', '--days', '90', stdout=out, stderr=err)
+
+        self.assertIn('Moved 1 file(s)', out.getvalue())
+        self.assertIn('(1 failed)', out.getvalue())
+        self.assertIn('SlowDown', err.getvalue())
+        self.assertTrue(self.storage.is_hot(self.name))
+        self.assertTrue(self.storage.is_cold(second.file.name))
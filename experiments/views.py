@@ -6,12 +6,16 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.http import FileResponse, Http404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
+from core.mixins import DeferredListQuerysetMixin
+from core.models import ActivityEvent
+from core.serializers import ActivityEventSerializer, ActivityCursorPagination
 from .models import Experiment
 from .file_models import FileAttachment
-from .serializers import ExperimentSerializer, ExperimentListSerializer
+from .serializers import ExperimentSerializer, ExperimentListSerializer, SampleLinkSerializer
 from .file_serializers import FileAttachmentSerializer
+from . import tabular
 
-class ExperimentViewSet(viewsets.ModelViewSet):
+class ExperimentViewSet(DeferredListQuerysetMixin, viewsets.ModelViewSet):
     queryset = Experiment.objects.all()
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser, JSONParser)
@@ -30,6 +34,56 @@ class ExperimentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
+    def _change_sample_links(self, request, operation):
+        experiment = self.get_object()
+        serializer = SampleLinkSerializer(data=request.data, context={'operation': operation})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        sample_ids = serializer.validated_data['sample_ids']
+        
+        added = removed = 0
+        if operation == 'add':
+            added = experiment.add_samples(sample_ids)
+        elif operation == 'remove':
+            removed = experiment.remove_samples(sample_ids)
+        else:
+            added, removed = experiment.replace_samples(sample_ids)
+        
+        return Response({
+            'experiment_id': str(experiment.id),
+            'added': added,
+            'removed': removed,
+            'sample_count': experiment.samples.count()
+        })
+    
+    @action(detail=True, methods=['post'], url_path='samples/add')
+    def add_samples(self, request, pk=None):
+        """Link samples to an experiment, ignoring ones already linked"""
+        return self._change_sample_links(request, 'add')
+    
+    @action(detail=True, methods=['post'], url_path='samples/remove')
+    def remove_samples(self, request, pk=None):
+        """Unlink samples from an experiment"""
+        return self._change_sample_links(request, 'remove')
+    
+    @action(detail=True, methods=['post'], url_path='samples/replace')
+    def replace_samples(self, request, pk=None):
+        """Replace the full set of samples linked to an experiment"""
+        return self._change_sample_links(request, 'replace')
+    
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """Activity events for an experiment, newest first, cursor paginated"""
+        experiment = self.get_object()
+        events = ActivityEvent.objects.filter(
+            object_type=Experiment._meta.label_lower, object_id=str(experiment.pk)
+        ).select_related('actor')
+        
+        paginator = ActivityCursorPagination()
+        page = paginator.paginate_queryset(events, request)
+        serializer = ActivityEventSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
     @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def upload_file(self, request, pk=None):
         """Upload a file attachment to an experiment"""
@@ -52,6 +106,10 @@ class ExperimentViewSet(viewsets.ModelViewSet):
             uploaded_by=request.user
         )
         
+        # Parse tabular data files once, off the request, so later reads hit the columnar cache
+        if tabular.is_tabular(attachment):
+            tabular.schedule_build(attachment)
+        
         serializer = FileAttachmentSerializer(attachment, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -76,8 +134,8 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         try:
             attachment = FileAttachment.objects.get(id=file_id, experiment=experiment)
             file_name = attachment.file_name
-            attachment.file.delete()  # Delete actual file
-            attachment.delete()  # Delete database record
+            # Deleting the record removes the file and cached columns on commit
+            attachment.delete()
             
             return Response({
                 'message': f'File "{file_name}" deleted successfully'
@@ -85,6 +143,77 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         except FileAttachment.DoesNotExist:
             return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    def _get_tabular_attachment(self, file_id):
+        """Fetch an attachment of this experiment that can be read as a table"""
+        experiment = self.get_object()
+        try:
+            attachment = FileAttachment.objects.get(id=file_id, experiment=experiment)
+        except FileAttachment.DoesNotExist:
+            raise Http404("File not found")
+        
+        if not tabular.is_tabular(attachment):
+            return attachment, Response(
+                {'error': 'File is not a tabular data file'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return attachment, None
+    
+    def _get_requested_columns(self, request):
+        columns = request.query_params.get('columns')
+        if not columns:
+            return None
+        return [name.strip() for name in columns.split(',') if name.strip()]
+    
+    @action(detail=True, methods=['get'], url_path='files/(?P<file_id>[^/.]+)/table')
+    def file_table(self, request, pk=None, file_id=None):
+        """
+        Read a row range of a tabular attachment from the columnar cache
+        
+        Query params: columns (comma separated), offset, limit
+        """
+        attachment, error = self._get_tabular_attachment(file_id)
+        if error:
+            return error
+        
+        try:
+            offset = int(request.query_params.get('offset', 0))
+            limit = int(request.query_params.get('limit', 100))
+        except ValueError:
+            return Response({'error': 'offset and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            table = tabular.read_rows(attachment, self._get_requested_columns(request), offset, limit)
+        except KeyError as e:
+            return Response({'error': f'Unknown column(s): {e.args[0]}'}, status=status.HTTP_400_BAD_REQUEST)
+        except tabular.TabularParseError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        table['file_id'] = str(attachment.id)
+        table['file_name'] = attachment.file_name
+        return Response(table)
+    
+    @action(detail=True, methods=['get'], url_path='files/(?P<file_id>[^/.]+)/stats')
+    def file_stats(self, request, pk=None, file_id=None):
+        """
+        Summary statistics (count, min, max, mean) for columns of a tabular attachment
+        
+        Query params: columns (comma separated)
+        """
+        attachment, error = self._get_tabular_attachment(file_id)
+        if error:
+            return error
+        
+        try:
+            stats = tabular.column_stats(attachment, self._get_requested_columns(request))
+        except KeyError as e:
+            return Response({'error': f'Unknown column(s): {e.args[0]}'}, status=status.HTTP_400_BAD_REQUEST)
+        except tabular.TabularParseError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        stats['file_id'] = str(attachment.id)
+        stats['file_name'] = attachment.file_name
+        return Response(stats)
+    
     @action(detail=False, methods=['get'])
     def download_file(self, request):
         """Download a specific file by ID"""
@@ -96,8 +225,9 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         try:
             attachment = FileAttachment.objects.get(id=file_id)
             
-            # Open file for download
+            # Open file for download (cold files are faulted in or streamed)
             file_handle = attachment.file.open('rb')
+            attachment.mark_accessed()
             response = FileResponse(file_handle, content_type='application/octet-stream')
             response['Content-Disposition'] = f'attachment; filename="{attachment.file_name}"'
             
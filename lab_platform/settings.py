@@ -55,6 +55,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.activity.CurrentRequestMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -97,6 +98,20 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Subtree aggregates are invalidated by whichever process changes a
+    # sample, so they need a cache every worker and management command
+    # shares. The table is created by the core migrations; a Redis or
+    # Memcached backend can be swapped in here.
+    'lineage': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'lims_cache',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -160,6 +175,37 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Columnar cache for parsed tabular attachments (CSV, TSV, JSON, XLSX)
+TABULAR_CACHE_ROOT = MEDIA_ROOT / 'tabular_cache'
+
+# Attachment storage tiering
+# COLD_CLIENT 'local' uses a filesystem-backed S3 stand-in under COLD_ROOT;
+# 's3' uses boto3 against ENDPOINT_URL (None for AWS).
+ATTACHMENT_STORAGE = {
+    'COLD_CLIENT': 'local',
+    'COLD_ROOT': BASE_DIR / 'cold_storage',
+    'COLD_BUCKET': 'lims-attachments',
+    'ENDPOINT_URL': None,
+    'FAULT_IN': True,  # False streams cold files without restoring them
+    'TIER_AFTER_DAYS': 90,
+}
+
+# Instrument watch folders ingested by `manage.py watch_instrument_folders`.
+# Each folder: path, and optionally pattern (regex with an `experiment` group
+# matched against experiment ids, then titles), experiment (fixed id), user
+# (username recorded as uploader; default the experiment's creator) and mode
+# ('link' keeps the instrument's file, 'move' removes it once attached).
+# A <file>.meta.json sidecar with experiment/description/user overrides these.
+INSTRUMENT_INGEST = {
+    'FOLDERS': [
+        # {'path': '/mnt/instruments/plate-reader', 'pattern': r'^(?P<experiment>[0-9a-f-]{36})_',
+        #  'user': 'plate-reader', 'mode': 'move'},
+    ],
+    'POLL_SECONDS': 2,
+    'SETTLE_SECONDS': 10,  # files modified more recently may still be being written
+    'BATCH_SIZE': 500,
+}
+
 # CKEditor Configuration
 CKEDITOR_JQUERY_URL = 'https://ajax.googleapis.com/ajax/libs/jquery/2.2.4/jquery.min.js'
 
@@ -182,4 +228,19 @@ CKEDITOR_CONFIGS = {
 }
 
 # CSRF Configuration
-CSRF_TRUSTED_ORIGINS = ['http://localhost:8000', 'http://127.0.0.1:8000']
\ No newline at end of file
+CSRF_TRUSTED_ORIGINS = ['http://localhost:8000', 'http://127.0.0.1:8000']
+
+# Live event push (Server-Sent Events at /api/live/). Only enable when serving
+# with an ASGI server (e.g. uvicorn lab_platform.asgi:application); under
+# WSGI the dashboard pages poll instead.
+LIVE_EVENTS = {
+    'ENABLED': False,
+    'BACKEND': 'postgres',  # LISTEN/NOTIFY across workers; any other value fans out in-process only
+    'CHANNEL': 'lims_live',
+    'HEARTBEAT_SECONDS': 15,
+    'QUEUE_SIZE': 100,
+}
+
+# Days of raw temperature readings kept by prune_temperature_readings;
+# probes cannot post readings older than this
+TEMPERATURE_RAW_RETENTION_DAYS = 90
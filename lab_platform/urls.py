@@ -9,10 +9,13 @@ urlpatterns = [
     path('api/', include('samples.urls')),
     path('api/', include('experiments.urls')),
     path('api/', include('protocols.urls')),
+    path('api/', include('core.urls')),
     path('api/dashboard/stats/', dashboard_views.dashboard_stats),
     path('api/dashboard/storage/', dashboard_views.storage_utilization),
     path('api/dashboard/activity/', dashboard_views.recent_activity),
     path('api/dashboard/analytics/', dashboard_views.sample_analytics),
+    path('api/dashboard/async/stats/', dashboard_views.dashboard_stats_async),
+    path('api/dashboard/async/activity/', dashboard_views.recent_activity_async),
     path('dashboard/', include('dashboard.urls')),
     path('api-auth/', include('rest_framework.urls')),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from core.mixins import DeferredChangelistAdminMixin
 from .models import Protocol, ProtocolCategory
 
 @admin.register(ProtocolCategory)
@@ -27,13 +28,13 @@ class ProtocolCategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Protocol)
-class ProtocolAdmin(admin.ModelAdmin):
+class ProtocolAdmin(DeferredChangelistAdminMixin, admin.ModelAdmin):
     list_display = ('protocol_code', 'title', 'version', 'status', 'category', 
                     'is_active', 'times_used', 'created_by', 'approved_by', 'created_at')
     list_filter = ('status', 'is_active', 'category', 'created_at', 'approved_at')
     search_fields = ('title', 'protocol_code', 'description', 'procedure')
     readonly_fields = ('id', 'protocol_code', 'created_at', 'updated_at', 
-                       'times_used', 'approved_at', 'version_history_display')
+                       'times_used', 'approved_at', 'content_compacted', 'version_history_display')
     
     fieldsets = (
         ('Basic Information', {
@@ -45,7 +46,7 @@ class ProtocolAdmin(admin.ModelAdmin):
             'classes': ('wide',)
         }),
         ('Versioning', {
-            'fields': ('version', 'is_active', 'parent_protocol', 'version_history_display')
+            'fields': ('version', 'is_active', 'parent_protocol', 'content_compacted', 'version_history_display')
         }),
         ('Approval', {
             'fields': ('status', 'approved_by', 'approved_at')
@@ -61,9 +62,9 @@ class ProtocolAdmin(admin.ModelAdmin):
         if not obj.id:
             return "Save to see version history"
         
-        versions = obj.get_all_versions()
+        versions = list(obj.get_all_versions().only('id', 'version', 'is_active', 'status', 'created_at'))
         
-        if versions.count() == 1:
+        if len(versions) == 1:
             return format_html('<span style="color: #999;">No other versions</span>')
         
         version_html = []
@@ -89,6 +90,21 @@ class ProtocolAdmin(admin.ModelAdmin):
     
     version_history_display.short_description = "Version History"
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('family', 'category', 'created_by', 'approved_by')
+    
+    def get_object(self, request, object_id, from_field=None):
+        """Rebuild the content of compacted historical versions"""
+        obj = super().get_object(request, object_id, from_field)
+        return obj.load_content() if obj else obj
+    
+    def get_readonly_fields(self, request, obj=None):
+        """Content of compacted historical versions is read-only"""
+        readonly = super().get_readonly_fields(request, obj)
+        if obj and obj.content_compacted:
+            return tuple(readonly) + tuple(Protocol.CONTENT_FIELDS)
+        return readonly
+    
     actions = ['approve_protocols', 'archive_protocols', 'create_new_version']
     
     def approve_protocols(self, request, queryset):
@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class ProtocolsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = "protocols"
\ No newline at end of file
+    name = "protocols"
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,85 @@
+"""
+Compact deltas between versions of protocol rich-text content.
+
+HTML is split into tokens that end at a tag boundary or a newline, so an
+edited paragraph or table row only costs the changed tokens. A delta is a
+list of operations applied to the base tokens in order:
+
+* positive int ``n`` -- copy the next ``n`` base tokens
+* negative int ``-n`` -- skip the next ``n`` base tokens
+* str -- insert the text
+"""
+import difflib
+import re
+
+TOKEN_RE = re.compile(r'[^>\n]*[>\n]|[^>\n]+')
+
+
+def tokenize(html):
+    return TOKEN_RE.findall(html or '')
+
+
+def make_delta(old, new):
+    """Return the operations that turn old into new"""
+    a, b = tokenize(old), tokenize(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    """Rebuild new content from old content and a delta"""
+    a = tokenize(old)
+    out = []
+    position = 0
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(a[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(out)
+
+
+def make_content_delta(old_content, new_content):
+    """Per-field deltas; unchanged fields are omitted"""
+    return {
+        field: make_delta(old_content.get(field, ''), value)
+        for field, value in new_content.items()
+        if value != old_content.get(field, '')
+    }
+
+
+def apply_content_delta(old_content, delta):
+    content = dict(old_content)
+    for field, ops in delta.items():
+        content[field] = apply_delta(old_content.get(field, ''), ops)
+    return content
+
+
+def diff_content(old_content, new_content, old_label, new_label, context=3):
+    """Unified diffs for every field that differs between two contents"""
+    diffs = {}
+    for field in new_content:
+        old = old_content.get(field, '')
+        new = new_content.get(field, '')
+        if old == new:
+            continue
+        diffs[field] = list(difflib.unified_diff(
+            [token.rstrip('\n') for token in tokenize(old)],
+            [token.rstrip('\n') for token in tokenize(new)],
+            fromfile=old_label,
+            tofile=new_label,
+            n=context,
+            lineterm=''
+        ))
+    return diffs
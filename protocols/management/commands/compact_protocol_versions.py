@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from protocols.models import ProtocolFamily
+
+
+class Command(BaseCommand):
+    help = ("Move the content of historical protocol versions into delta revisions, "
+            "keeping full content only on the newest version of each family")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be compacted")
+
+    def handle(self, *args, **options):
+        compacted = 0
+        for family in ProtocolFamily.objects.iterator():
+            candidates = family.members.filter(
+                content_compacted=False, version__lt=family.latest_version
+            ).order_by('version')
+
+            for protocol in candidates:
+                if not options['dry_run']:
+                    protocol.compact_content()
+                compacted += 1
+                self.stdout.write(f"{protocol.protocol_code} v{protocol.version}")
+
+        verb = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {compacted} protocol version(s)"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+from protocols.models import Protocol
+
+
+class Command(BaseCommand):
+    help = "Recompute Protocol.times_used from the experiments that use each protocol"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted counters")
+
+    def handle(self, *args, **options):
+        # One grouped query finds every protocol whose counter has drifted
+        drifted = list(
+            Protocol.objects.annotate(actual=Count('experiments_using'))
+            .exclude(times_used=F('actual'))
+            .only('id', 'protocol_code', 'version', 'times_used')
+        )
+
+        for protocol in drifted:
+            self.stdout.write(
+                f"{protocol.protocol_code} v{protocol.version}: "
+                f"{protocol.times_used} -> {protocol.actual}"
+            )
+            protocol.times_used = protocol.actual
+
+        if not options['dry_run'] and drifted:
+            Protocol.objects.bulk_update(drifted, ['times_used'], batch_size=1000)
+
+        verb = 'Would fix' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drifted)} protocol usage counter(s)"))
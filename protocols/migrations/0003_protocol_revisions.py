@@ -0,0 +1,94 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("protocols", "0002_alter_protocol_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="protocol",
+            name="content_compacted",
+            field=models.BooleanField(
+                default=False,
+                help_text="Content is stored as a revision delta, not in the columns",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ProtocolRevision",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "family_id",
+                    models.UUIDField(
+                        db_index=True,
+                        help_text="Id of the root protocol of the version family",
+                    ),
+                ),
+                ("version", models.IntegerField()),
+                ("is_snapshot", models.BooleanField(default=False)),
+                (
+                    "chain_start",
+                    models.IntegerField(
+                        help_text="Version of the snapshot this revision is rebuilt from"
+                    ),
+                ),
+                (
+                    "chain_length",
+                    models.IntegerField(
+                        default=0, help_text="Deltas applied on top of the snapshot"
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        help_text="Full content for snapshots, per-field deltas otherwise"
+                    ),
+                ),
+                ("content_hash", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "base",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="dependents",
+                        to="protocols.protocolrevision",
+                    ),
+                ),
+                (
+                    "protocol",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="revision",
+                        to="protocols.protocol",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["family_id", "version"],
+                "indexes": [
+                    models.Index(
+                        fields=["family_id", "version"],
+                        name="protocols_p_family__2a5151_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:01
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def assign_families(apps, schema_editor):
+    """Group existing versions by their root protocol"""
+    Protocol = apps.get_model("protocols", "Protocol")
+    ProtocolFamily = apps.get_model("protocols", "ProtocolFamily")
+
+    for root in Protocol.objects.filter(parent_protocol__isnull=True).iterator():
+        ProtocolFamily.objects.create(id=root.id, protocol_code=root.protocol_code)
+        Protocol.objects.filter(Q(id=root.id) | Q(parent_protocol_id=root.id)).update(
+            family_id=root.id
+        )
+
+    # Versions whose parent is itself a version join the parent's family
+    while True:
+        pending = list(
+            Protocol.objects.filter(
+                family__isnull=True, parent_protocol__family__isnull=False
+            ).values_list("id", "parent_protocol__family_id")
+        )
+        if not pending:
+            break
+        for protocol_id, family_id in pending:
+            Protocol.objects.filter(id=protocol_id).update(family_id=family_id)
+
+    for family in ProtocolFamily.objects.all().iterator():
+        stats = Protocol.objects.filter(family_id=family.id).aggregate(
+            count=Count("id"), latest=Max("version")
+        )
+        family.version_count = stats["count"]
+        family.latest_version = stats["latest"] or 0
+        family.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("protocols", "0003_protocol_revisions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProtocolFamily",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("protocol_code", models.CharField(blank=True, max_length=50)),
+                ("version_count", models.IntegerField(default=0)),
+                ("latest_version", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name_plural": "Protocol Families",
+            },
+        ),
+        migrations.AlterField(
+            model_name="protocolrevision",
+            name="family_id",
+            field=models.UUIDField(
+                db_index=True,
+                help_text="Id of the ProtocolFamily this version belongs to",
+            ),
+        ),
+        migrations.AddField(
+            model_name="protocol",
+            name="family",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                help_text="Version family this protocol belongs to",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="members",
+                to="protocols.protocolfamily",
+            ),
+        ),
+        migrations.RunPython(assign_families, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="protocol",
+            index=models.Index(
+                fields=["family", "version"], name="protocols_p_family__5505b7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="protocol",
+            index=models.Index(
+                fields=["family", "is_active"], name="protocols_p_family__ec1e94_idx"
+            ),
+        ),
+    ]
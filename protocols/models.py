@@ -1,7 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.functions import Greatest
 from ckeditor.fields import RichTextField
+from core import activity, live
+from core.content import extract_inline_images_from
+import hashlib
+import json
 import uuid
+from . import deltas
 
 class ProtocolCategory(models.Model):
     """Categories for organizing protocols (e.g., DNA Extraction, Cell Culture, etc.)"""
@@ -18,6 +25,37 @@ class ProtocolCategory(models.Model):
         return self.name
 
 
+class ProtocolFamily(models.Model):
+    """
+    All versions of one protocol
+    
+    The id is the id of the first protocol in the family. version_count and
+    latest_version are maintained transactionally as versions are added and
+    deleted, so listings never need to count rows.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    protocol_code = models.CharField(max_length=50, blank=True)
+    version_count = models.IntegerField(default=0)
+    latest_version = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name_plural = "Protocol Families"
+    
+    def __str__(self):
+        return f"{self.protocol_code} ({self.version_count} versions)"
+    
+    def refresh_counters(self):
+        """Recompute the denormalized counters from the family members"""
+        stats = self.members.aggregate(count=models.Count('id'), latest=models.Max('version'))
+        self.version_count = stats['count']
+        self.latest_version = stats['latest'] or 0
+        ProtocolFamily.objects.filter(pk=self.pk).update(
+            version_count=self.version_count,
+            latest_version=self.latest_version
+        )
+
+
 class Protocol(models.Model):
     """Standard Operating Procedures and Protocol Templates"""
     
@@ -28,6 +66,10 @@ class Protocol(models.Model):
         ('ARCHIVED', 'Archived'),
     ]
     
+    # Rich-text fields that make up the versioned protocol content
+    CONTENT_FIELDS = ['objective', 'materials', 'procedure', 'safety_notes',
+                      'troubleshooting', 'references', 'notes']
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
     # Basic Information
@@ -53,6 +95,11 @@ class Protocol(models.Model):
     parent_protocol = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, 
                                         blank=True, related_name='versions',
                                         help_text="Original protocol if this is a version")
+    family = models.ForeignKey(ProtocolFamily, on_delete=models.PROTECT, null=True, blank=True,
+                               editable=False, related_name='members',
+                               help_text="Version family this protocol belongs to")
+    content_compacted = models.BooleanField(default=False,
+                                            help_text="Content is stored as a revision delta, not in the columns")
     
     # Approval Workflow
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='DRAFT')
@@ -71,6 +118,10 @@ class Protocol(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['family', 'version']),
+            models.Index(fields=['family', 'is_active']),
+        ]
     
     def __str__(self):
         return f"{self.protocol_code} v{self.version} - {self.title}"
@@ -106,59 +157,97 @@ class Protocol(models.Model):
             else:
                 raise ValueError("Could not generate unique protocol code")
         
-        super().save(*args, **kwargs)
+        # Move pasted base64 images out of the rich-text fields
+        if not self.content_compacted:
+            extract_inline_images_from(self, self.CONTENT_FIELDS)
+        
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # times_used is only changed atomically by adjust_usage, and a
+            # compacted version must never write reconstructed content back
+            excluded = {'times_used'}
+            if self.content_compacted:
+                excluded.update(self.CONTENT_FIELDS)
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded
+            ]
+        
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        
+        # New rows join their parent's family, or start one of their own
+        with transaction.atomic():
+            if self.family_id is None:
+                if self.parent_protocol_id:
+                    self.family_id = Protocol.objects.values_list(
+                        'family_id', flat=True
+                    ).get(pk=self.parent_protocol_id)
+                if self.family_id is None:
+                    self.family = ProtocolFamily.objects.create(
+                        id=self.id, protocol_code=self.protocol_code
+                    )
+            
+            super().save(*args, **kwargs)
+            
+            ProtocolFamily.objects.filter(pk=self.family_id).update(
+                version_count=models.F('version_count') + 1,
+                latest_version=Greatest('latest_version', models.Value(self.version))
+            )
     
     def create_new_version(self, updated_by):
         """Create a new version of this protocol"""
         # Find the root protocol
         root_protocol = self.parent_protocol if self.parent_protocol else self
+        content = self.get_content()
         
-        # Get the latest version number
-        latest_version = Protocol.objects.filter(
-            protocol_code=root_protocol.protocol_code
-        ).order_by('-version').first()
-        
-        new_version_number = (latest_version.version if latest_version else 0) + 1
-        
-        # Deactivate all previous versions
-        Protocol.objects.filter(protocol_code=root_protocol.protocol_code).update(is_active=False)
-        
-        # Create new version
-        new_protocol = Protocol.objects.create(
-            title=self.title,
-            protocol_code=self.protocol_code,
-            category=self.category,
-            description=self.description,
-            objective=self.objective,
-            materials=self.materials,
-            procedure=self.procedure,
-            safety_notes=self.safety_notes,
-            troubleshooting=self.troubleshooting,
-            references=self.references,
-            notes=self.notes,
-            version=new_version_number,
-            is_active=True,
-            parent_protocol=root_protocol,
-            status='DRAFT',
-            created_by=updated_by
-        )
+        with transaction.atomic():
+            # Lock the family so concurrent requests get distinct version numbers
+            family = ProtocolFamily.objects.select_for_update().get(pk=self.family_id)
+            new_version_number = family.latest_version + 1
+            
+            # Deactivate all previous versions
+            Protocol.objects.filter(family_id=family.id).update(is_active=False)
+            
+            # Create new version
+            new_protocol = Protocol.objects.create(
+                title=self.title,
+                protocol_code=self.protocol_code,
+                category=self.category,
+                description=self.description,
+                version=new_version_number,
+                is_active=True,
+                parent_protocol=root_protocol,
+                family=family,
+                status='DRAFT',
+                created_by=updated_by,
+                **content
+            )
+            
+            # Only the newest version keeps its content in the columns
+            older_versions = self.get_all_versions().filter(
+                content_compacted=False
+            ).exclude(id=new_protocol.id)
+            for version in older_versions:
+                version.compact_content()
         
         return new_protocol
     
     def clone_for_new_protocol(self, new_title, created_by):
         """Clone this protocol as a new independent protocol"""
+        content = self.get_content()
         new_protocol = Protocol.objects.create(
             title=new_title,
             # protocol_code will be auto-generated
             category=self.category,
             description=self.description,
-            objective=self.objective,
-            materials=self.materials,
-            procedure=self.procedure,
-            safety_notes=self.safety_notes,
-            troubleshooting=self.troubleshooting,
-            references=self.references,
-            notes=f"Cloned from {self.protocol_code} v{self.version}\n\n{self.notes}",
+            objective=content['objective'],
+            materials=content['materials'],
+            procedure=content['procedure'],
+            safety_notes=content['safety_notes'],
+            troubleshooting=content['troubleshooting'],
+            references=content['references'],
+            notes=f"Cloned from {self.protocol_code} v{self.version}\n\n{content['notes']}",
             version=1,
             is_active=True,
             status='DRAFT',
@@ -174,30 +263,230 @@ class Protocol(models.Model):
         self.status = 'APPROVED'
         self.approved_by = approved_by
         self.approved_at = timezone.now()
-        self.save()
+        self.save(update_fields=['status', 'approved_by', 'approved_at', 'updated_at'])
+        activity.record('APPROVED', self, approved_by, version=self.version)
     
     def archive(self):
         """Archive this protocol"""
         self.status = 'ARCHIVED'
         self.is_active = False
-        self.save()
+        self.save(update_fields=['status', 'is_active', 'updated_at'])
+        activity.record('ARCHIVED', self, version=self.version)
     
-    def increment_usage(self):
+    def increment_usage(self, count=1):
         """Increment usage counter when protocol is used in experiment"""
-        self.times_used += 1
-        self.save()
+        Protocol.adjust_usage(self.pk, count)
+        self.refresh_from_db(fields=['times_used'])
     
+    @classmethod
+    def adjust_usage(cls, protocol_id, delta):
+        """Atomically add delta to times_used without touching other columns"""
+        if protocol_id is None or not delta:
+            return
+        cls.objects.filter(pk=protocol_id).update(times_used=models.F('times_used') + delta)
+
+    def instantiate_experiments(self, created_by, runs):
+        """
+        Create one experiment per run from this protocol version
+
+        Each run is a dict with title and sample_ids, plus optional
+        description, status and start_date. Experiments, their sample links
+        and the usage counter are written in one transaction with bulk
+        inserts, so no per-row save() or signal runs.
+        """
+        from experiments.models import Experiment
+
+        content = self.get_content()
+        experiments = [
+            Experiment(
+                title=run['title'],
+                description=run.get('description', ''),
+                status=run.get('status', 'PLANNING'),
+                start_date=run.get('start_date'),
+                protocol_template=self,
+                created_by=created_by,
+                objective=content['objective'],
+                materials=content['materials'],
+                procedure=content['procedure'],
+            )
+            for run in runs
+        ]
+
+        SampleLink = Experiment.samples.through
+        links = [
+            SampleLink(experiment_id=experiment.id, sample_id=sample_id)
+            for experiment, run in zip(experiments, runs)
+            for sample_id in dict.fromkeys(run.get('sample_ids', []))
+        ]
+
+        with transaction.atomic():
+            Experiment.objects.bulk_create(experiments, batch_size=500)
+            SampleLink.objects.bulk_create(links, batch_size=1000)
+            Protocol.adjust_usage(self.pk, len(experiments))
+            activity.record_many([
+                activity.build_event('CREATED', experiment, created_by,
+                                     protocol_id=str(self.pk), protocol_version=self.version)
+                for experiment in experiments
+            ])
+            live.publish('counts', {'experiments': len(experiments)})
+        return experiments, len(links)
+
     def get_all_versions(self):
         """Get all versions of this protocol"""
-        root = self.parent_protocol if self.parent_protocol else self
-        return Protocol.objects.filter(
-            models.Q(id=root.id) | models.Q(parent_protocol=root)
-        ).order_by('version')
+        return Protocol.objects.filter(family_id=self.family_id).order_by('version')
     
     def get_active_version(self):
         """Get the currently active version"""
-        root = self.parent_protocol if self.parent_protocol else self
         return Protocol.objects.filter(
-            protocol_code=root.protocol_code,
+            family_id=self.family_id,
             is_active=True
-        ).first()
\ No newline at end of file
+        ).order_by('-version').first()
+    
+    # Content storage
+    def get_content(self):
+        """Return the rich-text content, rebuilding it from revisions if compacted"""
+        if self.content_compacted:
+            return self.revision.get_content()
+        return {field: getattr(self, field) for field in self.CONTENT_FIELDS}
+    
+    def load_content(self):
+        """Populate the rich-text attributes of a compacted version for display"""
+        if self.content_compacted:
+            for field, value in self.get_content().items():
+                setattr(self, field, value)
+        return self
+    
+    def compact_content(self):
+        """
+        Move this version's content out of the columns into a revision
+        
+        The revision is a delta against the previous revision of the family,
+        or a full snapshot every SNAPSHOT_INTERVAL revisions to bound the
+        cost of rebuilding any version.
+        """
+        if self.content_compacted:
+            return self.revision
+        
+        content = {field: getattr(self, field) for field in self.CONTENT_FIELDS}
+        
+        with transaction.atomic():
+            base = ProtocolRevision.objects.filter(
+                family_id=self.family_id, version__lte=self.version
+            ).order_by('-version', '-created_at').first()
+            
+            revision = ProtocolRevision(
+                protocol=self,
+                family_id=self.family_id,
+                version=self.version,
+                content_hash=ProtocolRevision.hash_content(content)
+            )
+            if base is None or base.chain_length + 1 >= ProtocolRevision.SNAPSHOT_INTERVAL:
+                revision.is_snapshot = True
+                revision.chain_start = self.version
+                revision.chain_length = 0
+                revision.data = content
+            else:
+                revision.base = base
+                revision.chain_start = base.chain_start
+                revision.chain_length = base.chain_length + 1
+                revision.data = deltas.make_content_delta(base.get_content(), content)
+            revision.save()
+            
+            Protocol.objects.filter(pk=self.pk).update(
+                content_compacted=True,
+                **{field: '' for field in self.CONTENT_FIELDS}
+            )
+            self.content_compacted = True
+        
+        cache.set(revision.cache_key, content, ProtocolRevision.CACHE_TIMEOUT)
+        return revision
+    
+    def diff(self, other):
+        """Server-side unified diff of the content of two protocol versions"""
+        return deltas.diff_content(
+            other.get_content(),
+            self.get_content(),
+            f'{other.protocol_code} v{other.version}',
+            f'{self.protocol_code} v{self.version}'
+        )
+
+
+class ProtocolRevision(models.Model):
+    """
+    Immutable content of a historical protocol version
+    
+    Stored either as a full snapshot or as a delta against an earlier
+    revision of the same family. Revisions outlive their protocol row so
+    later deltas can always be rebuilt.
+    """
+    SNAPSHOT_INTERVAL = 10
+    CACHE_TIMEOUT = 60 * 60 * 24
+    
+    protocol = models.OneToOneField(Protocol, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='revision')
+    family_id = models.UUIDField(db_index=True, help_text="Id of the ProtocolFamily this version belongs to")
+    version = models.IntegerField()
+    base = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True,
+                             related_name='dependents')
+    is_snapshot = models.BooleanField(default=False)
+    chain_start = models.IntegerField(help_text="Version of the snapshot this revision is rebuilt from")
+    chain_length = models.IntegerField(default=0, help_text="Deltas applied on top of the snapshot")
+    data = models.JSONField(help_text="Full content for snapshots, per-field deltas otherwise")
+    content_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['family_id', 'version']
+        indexes = [
+            models.Index(fields=['family_id', 'version']),
+        ]
+    
+    def __str__(self):
+        kind = 'snapshot' if self.is_snapshot else 'delta'
+        return f"{self.family_id} v{self.version} ({kind})"
+    
+    @staticmethod
+    def hash_content(content):
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    
+    @property
+    def cache_key(self):
+        return f'protocol-revision:{self.pk}:{self.content_hash}'
+    
+    def get_content(self):
+        """Rebuild the content, caching it and every revision on the way"""
+        content = cache.get(self.cache_key)
+        if content is not None:
+            return content
+        
+        # Fetch the whole chain back to its snapshot in one query
+        chain_members = {
+            revision.pk: revision
+            for revision in ProtocolRevision.objects.filter(
+                family_id=self.family_id,
+                version__gte=self.chain_start,
+                version__lte=self.version
+            )
+        }
+        chain = []
+        revision = self
+        while True:
+            revision = chain_members.get(revision.pk, revision)
+            cached = cache.get(revision.cache_key)
+            if cached is not None:
+                content = cached
+                break
+            chain.append(revision)
+            if revision.is_snapshot:
+                content = None
+                break
+            revision = chain_members.get(revision.base_id) or revision.base
+        
+        for revision in reversed(chain):
+            if revision.is_snapshot:
+                content = dict(revision.data)
+            else:
+                content = deltas.apply_content_delta(content, revision.data)
+            cache.set(revision.cache_key, content, self.CACHE_TIMEOUT)
+        
+        return content
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Protocol, ProtocolCategory
+from core.rendering import rendered_fields
 
 class ProtocolCategorySerializer(serializers.ModelSerializer):
     protocol_count = serializers.SerializerMethodField()
@@ -34,16 +35,19 @@ class ProtocolDetailSerializer(serializers.ModelSerializer):
     created_by_name = serializers.CharField(source='created_by.username', read_only=True)
     approved_by_name = serializers.CharField(source='approved_by.username', read_only=True)
     parent_protocol_code = serializers.CharField(source='parent_protocol.protocol_code', read_only=True)
-    version_count = serializers.SerializerMethodField()
+    version_count = serializers.IntegerField(source='family.version_count', read_only=True)
+    latest_version = serializers.IntegerField(source='family.latest_version', read_only=True)
+    rendered = serializers.SerializerMethodField()
     
     class Meta:
         model = Protocol
         fields = '__all__'
-        read_only_fields = ('protocol_code', 'created_at', 'updated_at', 'times_used', 'approved_at')
+        read_only_fields = ('protocol_code', 'created_at', 'updated_at', 'times_used', 'approved_at',
+                            'content_compacted')
     
-    def get_version_count(self, obj):
-        """Return total number of versions"""
-        return obj.get_all_versions().count()
+    def get_rendered(self, obj):
+        """Sanitized HTML, plain text and excerpt for each rich-text field"""
+        return rendered_fields(obj, Protocol.CONTENT_FIELDS)
 
 
 class ProtocolCreateSerializer(serializers.ModelSerializer):
@@ -71,4 +75,73 @@ class ProtocolVersionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Protocol
         fields = ['id', 'protocol_code', 'version', 'status', 'is_active', 
-                  'created_by_name', 'approved_by_name', 'created_at', 'updated_at']
\ No newline at end of file
+                  'created_by_name', 'approved_by_name', 'created_at', 'updated_at']
+
+class ProtocolInstantiateSerializer(serializers.Serializer):
+    """Input for creating a batch of experiments from a protocol version"""
+    MAX_RUNS = 1000
+    MAX_LINKS = 100000
+    
+    count = serializers.IntegerField(min_value=1, max_value=MAX_RUNS, required=False)
+    title_prefix = serializers.CharField(max_length=180, required=False)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    status = serializers.ChoiceField(choices=['PLANNING', 'IN_PROGRESS', 'ON_HOLD'], default='PLANNING')
+    start_date = serializers.DateField(required=False, allow_null=True, default=None)
+    sample_ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, default=list,
+        help_text="Samples linked to every experiment"
+    )
+    sample_sets = serializers.ListField(
+        child=serializers.ListField(child=serializers.UUIDField()),
+        required=False, max_length=MAX_RUNS,
+        help_text="One list of samples per experiment; sets the count when given"
+    )
+    
+    def validate(self, attrs):
+        sample_sets = attrs.get('sample_sets')
+        count = attrs.get('count')
+        if sample_sets is None and count is None:
+            raise serializers.ValidationError('count or sample_sets is required')
+        if sample_sets is not None:
+            if count is not None and count != len(sample_sets):
+                raise serializers.ValidationError('count must match the number of sample_sets')
+            if not sample_sets:
+                raise serializers.ValidationError({'sample_sets': 'At least one sample set is required'})
+            count = len(sample_sets)
+        else:
+            sample_sets = [[] for _ in range(count)]
+        
+        shared = attrs['sample_ids']
+        sample_sets = [shared + list(samples) for samples in sample_sets]
+        if sum(len(samples) for samples in sample_sets) > self.MAX_LINKS:
+            raise serializers.ValidationError(f'At most {self.MAX_LINKS} sample links per request')
+        
+        # One query validates every referenced sample
+        from samples.models import Sample
+        requested = {sample_id for samples in sample_sets for sample_id in samples}
+        found = Sample.objects.only('pk').in_bulk(requested)
+        missing = requested - set(found)
+        if missing:
+            raise serializers.ValidationError(
+                {'sample_ids': [f'Sample {sample_id} does not exist' for sample_id in sorted(map(str, missing))]}
+            )
+        
+        attrs['count'] = count
+        attrs['sample_sets'] = sample_sets
+        return attrs
+    
+    def get_runs(self, protocol):
+        """Expand validated input into one run dict per experiment"""
+        data = self.validated_data
+        prefix = data.get('title_prefix') or f'{protocol.title} v{protocol.version}'[:180]
+        width = len(str(data['count']))
+        return [
+            {
+                'title': f'{prefix} - Run {index:0{width}d}',
+                'description': data['description'],
+                'status': data['status'],
+                'start_date': data['start_date'],
+                'sample_ids': samples,
+            }
+            for index, samples in enumerate(data['sample_sets'], start=1)
+        ]
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import activity
+from .models import Protocol, ProtocolFamily
+
+
+@receiver(post_delete, sender=Protocol)
+def update_family_counters(sender, instance, **kwargs):
+    """Keep version_count and latest_version in step when a version is deleted"""
+    if instance.family_id is None:
+        return
+    try:
+        family = ProtocolFamily.objects.get(pk=instance.family_id)
+    except ProtocolFamily.DoesNotExist:
+        return
+    family.refresh_counters()
+
+
+# Saves made by approve() and archive() record their own events
+WORKFLOW_FIELDS = {'status', 'is_active', 'approved_by', 'approved_at', 'updated_at'}
+
+
+@receiver(post_save, sender=Protocol)
+def record_protocol_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        if instance.parent_protocol_id:
+            activity.record('VERSION_CREATED', instance, instance.created_by,
+                            parent_id=str(instance.parent_protocol_id), version=instance.version)
+        else:
+            activity.record('CREATED', instance, instance.created_by)
+    elif update_fields is None or not set(update_fields) <= WORKFLOW_FIELDS:
+        activity.record('UPDATED', instance)
+
+
+@receiver(post_delete, sender=Protocol)
+def record_protocol_deleted(sender, instance, **kwargs):
+    activity.record('DELETED', instance)
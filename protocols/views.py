@@ -4,13 +4,16 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
+from django.core.exceptions import ValidationError
+from core.mixins import DeferredListQuerysetMixin
 from .models import Protocol, ProtocolCategory
 from .serializers import (
     ProtocolCategorySerializer,
     ProtocolListSerializer,
     ProtocolDetailSerializer,
     ProtocolCreateSerializer,
-    ProtocolVersionSerializer
+    ProtocolVersionSerializer,
+    ProtocolInstantiateSerializer
 )
 
 class ProtocolCategoryViewSet(viewsets.ModelViewSet):
@@ -23,28 +26,43 @@ class ProtocolCategoryViewSet(viewsets.ModelViewSet):
     ordering = ['name']
 
 
-class ProtocolViewSet(viewsets.ModelViewSet):
-    queryset = Protocol.objects.all()
+class ProtocolViewSet(DeferredListQuerysetMixin, viewsets.ModelViewSet):
+    queryset = Protocol.objects.select_related('family', 'category', 'created_by', 'approved_by')
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['status', 'category', 'is_active', 'created_by']
     search_fields = ['title', 'protocol_code', 'description', 'procedure']
     ordering_fields = ['created_at', 'updated_at', 'protocol_code', 'title', 'times_used']
     ordering = ['-created_at']
+    deferred_list_actions = ('list', 'active', 'approved')
     
     def get_serializer_class(self):
         """Use different serializers for different actions"""
-        if self.action == 'list':
+        if self.action in ['list', 'active', 'approved']:
             return ProtocolListSerializer
         elif self.action in ['create', 'update', 'partial_update']:
             return ProtocolCreateSerializer
         else:
             return ProtocolDetailSerializer
     
+    def get_object(self):
+        """Rebuild the content of compacted historical versions"""
+        return super().get_object().load_content()
+    
     def perform_create(self, serializer):
         """Set created_by to current user"""
         serializer.save(created_by=self.request.user)
     
+    def update(self, request, *args, **kwargs):
+        """Historical versions are immutable; their content cannot be edited"""
+        protocol = self.get_object()
+        if protocol.content_compacted and any(field in request.data for field in Protocol.CONTENT_FIELDS):
+            return Response(
+                {'error': 'Content of a historical version cannot be edited. Create a new version instead.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return super().update(request, *args, **kwargs)
+    
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve a protocol"""
@@ -116,23 +134,86 @@ class ProtocolViewSet(viewsets.ModelViewSet):
             'protocol': serializer.data
         }, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['post'])
+    def instantiate(self, request, pk=None):
+        """
+        Create a batch of experiments from this protocol version
+        
+        Body: count and/or sample_sets (one list of sample ids per experiment),
+        plus optional title_prefix, description, status, start_date and
+        sample_ids linked to every experiment
+        """
+        protocol = self.get_object()
+        if protocol.status == 'ARCHIVED':
+            return Response(
+                {'error': 'Archived protocols cannot be instantiated'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = ProtocolInstantiateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        experiments, link_count = protocol.instantiate_experiments(
+            request.user, serializer.get_runs(protocol)
+        )
+        return Response({
+            'message': f'Created {len(experiments)} experiments from {protocol.protocol_code} v{protocol.version}',
+            'experiment_count': len(experiments),
+            'sample_link_count': link_count,
+            'experiment_ids': [str(experiment.id) for experiment in experiments]
+        }, status=status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['get'])
     def versions(self, request, pk=None):
         """Get all versions of this protocol"""
         protocol = self.get_object()
-        versions = protocol.get_all_versions()
+        versions = protocol.get_all_versions().select_related('created_by', 'approved_by')
         
         serializer = ProtocolVersionSerializer(versions, many=True)
         return Response({
             'protocol_code': protocol.protocol_code,
-            'version_count': versions.count(),
+            'version_count': protocol.family.version_count,
+            'latest_version': protocol.family.latest_version,
             'versions': serializer.data
         })
     
+    @action(detail=True, methods=['get'])
+    def diff(self, request, pk=None):
+        """
+        Diff this protocol's content against another version
+        
+        Query params: other (protocol id) or version (version number in this family)
+        """
+        protocol = self.get_object()
+        other_id = request.query_params.get('other')
+        version = request.query_params.get('version')
+        
+        try:
+            if other_id:
+                other = Protocol.objects.get(id=other_id)
+            elif version:
+                other = protocol.get_all_versions().get(version=int(version))
+            else:
+                return Response(
+                    {'error': 'other or version parameter required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        except (Protocol.DoesNotExist, Protocol.MultipleObjectsReturned, ValueError, ValidationError):
+            return Response({'error': 'Version to compare not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        diffs = protocol.diff(other)
+        return Response({
+            'from': {'id': str(other.id), 'protocol_code': other.protocol_code, 'version': other.version},
+            'to': {'id': str(protocol.id), 'protocol_code': protocol.protocol_code, 'version': protocol.version},
+            'changed_fields': list(diffs.keys()),
+            'diffs': diffs
+        })
+    
     @action(detail=False, methods=['get'])
     def active(self, request):
         """Get only active protocols"""
-        active_protocols = Protocol.objects.filter(is_active=True)
+        active_protocols = self.get_queryset().filter(is_active=True)
         
         # Apply filters
         filtered = self.filter_queryset(active_protocols)
@@ -148,7 +229,7 @@ class ProtocolViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def approved(self, request):
         """Get only approved protocols"""
-        approved_protocols = Protocol.objects.filter(status='APPROVED', is_active=True)
+        approved_protocols = self.get_queryset().filter(status='APPROVED', is_active=True)
         
         # Apply filters
         filtered = self.filter_queryset(approved_protocols)
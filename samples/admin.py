@@ -1,12 +1,16 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Sample, StorageLocation, QuantityLog
+from .models import Sample, SampleAlert, SampleAttributeSchema, StorageLocation, QuantityLog, TemperatureExcursion
 
 @admin.register(StorageLocation)
 class StorageLocationAdmin(admin.ModelAdmin):
-    list_display = ('name', 'location_type', 'temperature', 'created_at')
+    list_display = ('name', 'location_type', 'parent', 'temperature', 'last_temperature', 'capacity',
+                    'total_sample_count', 'total_capacity', 'created_at')
     list_filter = ('location_type',)
     search_fields = ('name', 'location_type')
+    readonly_fields = ('path', 'capacity', 'occupied_count', 'sample_count', 'total_sample_count', 'total_capacity',
+                       'last_temperature', 'last_reading_at')
+    ordering = ('path',)
 
 class QuantityLogInline(admin.TabularInline):
     model = QuantityLog
@@ -55,6 +59,9 @@ class SampleAdmin(admin.ModelAdmin):
                 ('Expiration', {
                     'fields': ('expiration_date',)
                 }),
+                ('Attributes', {
+                    'fields': ('attributes',)
+                }),
                 ('System Information', {
                     'fields': ('id', 'created_at', 'updated_at', 'barcode_preview', 'alert_status_display'),
                     'classes': ('collapse',)
@@ -75,6 +82,9 @@ class SampleAdmin(admin.ModelAdmin):
                 ('Expiration', {
                     'fields': ('expiration_date',)
                 }),
+                ('Attributes', {
+                    'fields': ('attributes',)
+                }),
             )
     
     def parent_link(self, obj):
@@ -206,4 +216,34 @@ class QuantityLogAdmin(admin.ModelAdmin):
         return False
     
     def has_delete_permission(self, request, obj=None):
-        return False
\ No newline at end of file
+        return False
+
+@admin.register(SampleAlert)
+class SampleAlertAdmin(admin.ModelAdmin):
+    list_display = ('sample', 'alert_type', 'severity', 'days_until_expiry', 'first_seen_at', 'resolved_at')
+    list_filter = ('alert_type', 'severity', 'resolved_at')
+    search_fields = ('sample__sample_id', 'sample__name')
+    list_select_related = ('sample',)
+    readonly_fields = ('sample', 'alert_type', 'severity', 'message', 'days_until_expiry',
+                       'first_seen_at', 'evaluated_on', 'resolved_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(TemperatureExcursion)
+class TemperatureExcursionAdmin(admin.ModelAdmin):
+    list_display = ('location', 'started_at', 'ended_at', 'peak_temperature', 'reading_count')
+    list_filter = ('location', 'ended_at')
+    list_select_related = ('location',)
+    readonly_fields = ('location', 'started_at', 'ended_at', 'min_temperature', 'max_temperature',
+                       'peak_temperature', 'reading_count')
+    exclude = ('samples',)
+    date_hierarchy = 'started_at'
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(SampleAttributeSchema)
+class SampleAttributeSchemaAdmin(admin.ModelAdmin):
+    list_display = ('sample_type', 'allow_other', 'updated_at')
+    search_fields = ('sample_type',)
@@ -0,0 +1,121 @@
+"""
+Materialized sample alerts.
+
+``Sample.get_alert_status`` stays the single definition of what an alert
+is; this module stores its result in ``SampleAlert`` so alert endpoints
+read an indexed table instead of evaluating every sample per request.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Sample, SampleAlert
+
+# Matches the default window of Sample.is_expiring_soon
+EXPIRING_SOON_DAYS = 30
+# Fields get_alert_status reads
+ALERT_SOURCE_FIELDS = ('id', 'sample_id', 'quantity', 'min_quantity', 'unit', 'expiration_date')
+
+
+def days_until_expiry(sample, today):
+    if sample.expiration_date is None:
+        return None
+    return (sample.expiration_date - today).days
+
+
+def sync_sample_alerts(samples, now=None):
+    """
+    Bring the open SampleAlert rows of these samples in line with their
+    current state. Returns (opened, resolved) counts.
+    """
+    samples = list(samples)
+    if not samples:
+        return 0, 0
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+
+    desired = {}
+    for sample in samples:
+        days = days_until_expiry(sample, today)
+        for alert in sample.get_alert_status():
+            desired[(sample.pk, alert['type'])] = (alert, days)
+
+    with transaction.atomic():
+        open_alerts = {
+            (alert.sample_id, alert.alert_type): alert
+            for alert in SampleAlert.objects.select_for_update().filter(
+                sample_id__in=[sample.pk for sample in samples], resolved_at__isnull=True
+            )
+        }
+
+        new_alerts = [
+            SampleAlert(
+                sample_id=sample_id, alert_type=alert_type, severity=alert['severity'],
+                message=alert['message'][:255], days_until_expiry=days,
+                first_seen_at=now, evaluated_on=today
+            )
+            for (sample_id, alert_type), (alert, days) in desired.items()
+            if (sample_id, alert_type) not in open_alerts
+        ]
+        resolved = [alert.pk for key, alert in open_alerts.items() if key not in desired]
+
+        changed = []
+        for key, alert in open_alerts.items():
+            if key not in desired:
+                continue
+            current, days = desired[key]
+            if alert.message != current['message'][:255] or alert.days_until_expiry != days:
+                alert.severity = current['severity']
+                alert.message = current['message'][:255]
+                alert.days_until_expiry = days
+                alert.evaluated_on = today
+                changed.append(alert)
+
+        # ignore_conflicts: a concurrent sync may have opened the same alert
+        SampleAlert.objects.bulk_create(new_alerts, batch_size=1000, ignore_conflicts=True)
+        if resolved:
+            SampleAlert.objects.filter(pk__in=resolved).update(resolved_at=now)
+        if changed:
+            SampleAlert.objects.bulk_update(
+                changed, ['severity', 'message', 'days_until_expiry', 'evaluated_on'], batch_size=1000
+            )
+        if new_alerts or resolved:
+            from .lineage import invalidate_subtree_aggregates
+            invalidate_subtree_aggregates({
+                alert.sample_id for alert in new_alerts
+            } | {sample_id for (sample_id, _), alert in open_alerts.items() if alert.pk in resolved})
+    return len(new_alerts), len(resolved)
+
+
+def alert_candidates(today):
+    """Samples that have, or may need, an open alert"""
+    # Exists rather than a join: a LEFT JOIN's NULL resolved_at would also
+    # match every sample without alert rows
+    has_open_alert = Exists(SampleAlert.objects.filter(sample=OuterRef('pk'), resolved_at__isnull=True))
+    return Sample.objects.filter(
+        Q(expiration_date__lte=today + timedelta(days=EXPIRING_SOON_DAYS))
+        | Q(min_quantity__isnull=False, quantity__lte=F('min_quantity'))
+        | Q(quantity=0)
+        | has_open_alert
+    )
+
+
+def refresh_all_alerts(batch_size=2000, now=None):
+    """Re-evaluate every candidate sample; returns (evaluated, opened, resolved)"""
+    now = now or timezone.now()
+    candidates = alert_candidates(timezone.localdate(now)).only(*ALERT_SOURCE_FIELDS).order_by('pk')
+
+    evaluated = opened = resolved = 0
+    batch = []
+    for sample in candidates.iterator(chunk_size=batch_size):
+        batch.append(sample)
+        if len(batch) >= batch_size:
+            counts = sync_sample_alerts(batch, now)
+            evaluated, opened, resolved = evaluated + len(batch), opened + counts[0], resolved + counts[1]
+            batch = []
+    if batch:
+        counts = sync_sample_alerts(batch, now)
+        evaluated, opened, resolved = evaluated + len(batch), opened + counts[0], resolved + counts[1]
+    return evaluated, opened, resolved
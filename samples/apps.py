@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SamplesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "samples"
+
+    def ready(self):
+        from . import signals
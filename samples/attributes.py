@@ -0,0 +1,340 @@
+"""
+Custom sample attributes.
+
+Samples keep lab-specific values (concentration, species, passage number,
+plate well...) in the ``attributes`` JSONB column. A
+``SampleAttributeSchema`` per sample type declares the attributes and
+their types. Definitions are read once per process and compiled into
+plain validator functions; each lookup only checks a version of the
+schema table (latest ``updated_at`` and row count), so every worker and
+management command sees an edit as soon as it commits. Sample types
+without a schema accept any flat attributes.
+
+Attribute equality filters compile to one ``attributes @> {...}``
+containment test, which the GIN index on the column serves. Range filters
+compare ``NumericAttribute(key)``; attributes declared ``"indexed": true``
+get a matching expression index from ``manage.py sync_attribute_indexes``.
+"""
+import json
+import re
+from datetime import date
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import Count, F, FloatField, Func, Index, Max
+from django.db.models.fields.json import compile_json_path
+
+from .models import Sample, SampleAttributeSchema
+
+# Names double as query parameter and index name parts
+ATTRIBUTE_KEY = re.compile(r'^[a-z][a-z0-9_]{0,39}$')
+ATTRIBUTE_TYPES = ('string', 'number', 'integer', 'boolean', 'date')
+NUMERIC_TYPES = ('number', 'integer')
+SPEC_KEYS = {'type', 'required', 'minimum', 'maximum', 'choices', 'pattern', 'max_length', 'unit',
+             'indexed', 'description'}
+FILTER_PREFIX = 'attributes__'
+RANGE_LOOKUPS = ('gt', 'gte', 'lt', 'lte')
+INDEX_PREFIX = 'sample_attr_'
+
+
+# Definitions
+
+def check_definition(definition):
+    """Raise ValueError if a schema definition is malformed"""
+    if not isinstance(definition, dict):
+        raise ValueError('The definition must be an object of attribute specs')
+    for key, spec in definition.items():
+        if not ATTRIBUTE_KEY.match(key):
+            raise ValueError(f'"{key}": names are lowercase letters, digits and underscores, up to 40 long')
+        if not isinstance(spec, dict):
+            raise ValueError(f'"{key}": the spec must be an object')
+        unknown = set(spec) - SPEC_KEYS
+        if unknown:
+            raise ValueError(f'"{key}": unknown spec keys {", ".join(sorted(unknown))}')
+        if spec.get('type') not in ATTRIBUTE_TYPES:
+            raise ValueError(f'"{key}": type must be one of {", ".join(ATTRIBUTE_TYPES)}')
+        for bound in ('minimum', 'maximum'):
+            if bound in spec and (spec['type'] not in NUMERIC_TYPES or not is_number(spec[bound])):
+                raise ValueError(f'"{key}": {bound} needs a numeric type and value')
+        if 'choices' in spec:
+            if not isinstance(spec['choices'], list) or not spec['choices']:
+                raise ValueError(f'"{key}": choices must be a non-empty list')
+            check = compile_type(spec['type'])
+            if any(check(choice) for choice in spec['choices']):
+                raise ValueError(f'"{key}": every choice must be a {spec["type"]}')
+        if 'pattern' in spec:
+            if spec['type'] != 'string':
+                raise ValueError(f'"{key}": pattern only applies to strings')
+            try:
+                re.compile(spec['pattern'])
+            except (re.error, TypeError) as e:
+                raise ValueError(f'"{key}": invalid pattern ({e})')
+        if 'max_length' in spec and (spec['type'] != 'string' or not isinstance(spec['max_length'], int)):
+            raise ValueError(f'"{key}": max_length needs a string type and an integer')
+        if spec.get('indexed') and spec['type'] not in NUMERIC_TYPES:
+            raise ValueError(f'"{key}": only numeric attributes can be indexed for range filters')
+
+
+# (version, schemas) as last read by this process
+_schemas = (None, {})
+
+
+def schemas_version():
+    """Changes whenever a schema is saved or deleted"""
+    version = SampleAttributeSchema.objects.aggregate(updated=Max('updated_at'), count=Count('pk'))
+    return version['updated'], version['count']
+
+
+def get_schemas():
+    """{sample_type: (definition as canonical JSON, allow_other)}, re-read only when the table changed"""
+    global _schemas
+    version = schemas_version()
+    if _schemas[0] != version:
+        _schemas = (version, {
+            sample_type: (json.dumps(definition, sort_keys=True), allow_other)
+            for sample_type, definition, allow_other in SampleAttributeSchema.objects.values_list(
+                'sample_type', 'definition', 'allow_other'
+            )
+        })
+    return _schemas[1]
+
+
+# Validation
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_date(value):
+    try:
+        date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+TYPE_CHECKS = {
+    'string': (lambda value: isinstance(value, str), 'Must be text'),
+    'number': (is_number, 'Must be a number'),
+    'integer': (lambda value: isinstance(value, int) and not isinstance(value, bool), 'Must be a whole number'),
+    'boolean': (lambda value: isinstance(value, bool), 'Must be true or false'),
+    'date': (lambda value: isinstance(value, str) and is_date(value), 'Must be a YYYY-MM-DD date'),
+}
+
+
+def compile_type(type_name):
+    check, message = TYPE_CHECKS[type_name]
+    return lambda value: None if check(value) else message
+
+
+def check_scalar(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return None
+    return 'Must be text, a number or true/false'
+
+
+def compile_spec(spec):
+    """One function returning the error for a value, or None"""
+    rules = [compile_type(spec['type'])]
+    if 'minimum' in spec:
+        minimum = spec['minimum']
+        rules.append(lambda value: f'Must be at least {minimum}' if value < minimum else None)
+    if 'maximum' in spec:
+        maximum = spec['maximum']
+        rules.append(lambda value: f'Must be at most {maximum}' if value > maximum else None)
+    if 'choices' in spec:
+        choices = frozenset(spec['choices'])
+        listed = ', '.join(map(str, spec['choices']))
+        rules.append(lambda value: None if value in choices else f'Must be one of {listed}')
+    if 'max_length' in spec:
+        max_length = spec['max_length']
+        rules.append(lambda value: f'At most {max_length} characters' if len(value) > max_length else None)
+    if 'pattern' in spec:
+        pattern = re.compile(spec['pattern'])
+        rules.append(lambda value: None if pattern.fullmatch(value) else f'Must match {pattern.pattern}')
+
+    def check(value):
+        for rule in rules:
+            error = rule(value)
+            if error:
+                # Later checks assume the type check passed
+                return error
+        return None
+    return check
+
+
+@lru_cache(maxsize=256)
+def compile_schema(definition_json, allow_other):
+    """Validator taking an attributes dict and returning {name: error}"""
+    definition = json.loads(definition_json)
+    checks = {key: compile_spec(spec) for key, spec in definition.items()}
+    required = [key for key, spec in definition.items() if spec.get('required')]
+
+    def validate(attributes):
+        if not isinstance(attributes, dict):
+            return {'attributes': 'Must be an object of name to value'}
+        errors = {}
+        for key in required:
+            if attributes.get(key) is None:
+                errors[key] = 'This attribute is required'
+        for key, value in attributes.items():
+            check = checks.get(key)
+            if check is None:
+                if not allow_other:
+                    errors[key] = 'Not an attribute of this sample type'
+                    continue
+                if not ATTRIBUTE_KEY.match(key):
+                    errors[key] = 'Names are lowercase letters, digits and underscores, up to 40 long'
+                    continue
+                check = check_scalar
+            if value is not None:
+                error = check(value)
+                if error:
+                    errors[key] = error
+        return errors
+    return validate
+
+
+def validate_attributes(sample_type, attributes):
+    """Errors in a sample's attributes as {name: message}; empty when valid"""
+    definition_json, allow_other = get_schemas().get(sample_type, ('{}', True))
+    return compile_schema(definition_json, allow_other)(attributes)
+
+
+# Filtering
+
+class NumericAttribute(Func):
+    """An attribute as a number; NULL when it is missing or not a number, so the cast cannot fail"""
+    output_field = FloatField()
+
+    def __init__(self, key):
+        self.key = key
+        super().__init__(F('attributes'))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        path = compile_json_path([self.key])
+        sql = (f"CASE WHEN JSON_TYPE({column}, %s) IN ('integer', 'real') "
+               f"THEN JSON_EXTRACT({column}, %s) END")
+        return sql, (*params, path, *params, path)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        # Expression indexes on this must be built from the same SQL
+        sql = f"CASE WHEN jsonb_typeof({column} -> %s) = 'number' THEN ({column} -> %s)::double precision END"
+        return sql, (*params, self.key, *params, self.key)
+
+
+@lru_cache(maxsize=64)
+def definition_types(definition_json):
+    return {key: spec['type'] for key, spec in json.loads(definition_json).items()}
+
+
+def declared_types(key):
+    """Types the schemas give an attribute, across every sample type"""
+    return {
+        definition_types(definition_json).get(key)
+        for definition_json, _ in get_schemas().values()
+    } - {None}
+
+
+def parse_number(raw):
+    try:
+        return int(raw)
+    except ValueError:
+        pass
+    try:
+        number = float(raw)
+    except ValueError:
+        raise ValueError(f'"{raw}" is not a number')
+    if number != number or number in (float('inf'), float('-inf')):
+        raise ValueError(f'"{raw}" is not a number')
+    return number
+
+
+def parse_value(key, raw, types):
+    """A query parameter as the JSON value the attribute is stored as"""
+    if len(types) == 1:
+        type_name = next(iter(types))
+        if type_name in NUMERIC_TYPES:
+            return parse_number(raw)
+        if type_name == 'boolean':
+            if raw.lower() not in ('true', 'false'):
+                raise ValueError(f'{key} is true or false')
+            return raw.lower() == 'true'
+        return raw
+    # Undeclared, or typed differently by different schemas
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return raw
+    return value if isinstance(value, (int, float, bool)) else raw
+
+
+def filter_samples(queryset, params):
+    """
+    Apply attributes__<name>=value (equality) and
+    attributes__<name>__gt|gte|lt|lte=number query parameters.
+    Raises ValueError for malformed filters.
+    """
+    equal = {}
+    for param, raw in params.items():
+        if not param.startswith(FILTER_PREFIX):
+            continue
+        key, _, lookup = param[len(FILTER_PREFIX):].partition('__')
+        if not ATTRIBUTE_KEY.match(key):
+            raise ValueError(f'"{key}" is not a valid attribute name')
+        if not lookup:
+            equal[key] = parse_value(key, raw, declared_types(key))
+        elif lookup in RANGE_LOOKUPS:
+            alias = f'attribute_{key}'
+            queryset = queryset.alias(**{alias: NumericAttribute(key)}).filter(
+                **{f'{alias}__{lookup}': parse_number(raw)}
+            )
+        else:
+            raise ValueError(f'Unsupported attribute filter "{lookup}"; use gt, gte, lt or lte')
+
+    if equal:
+        if connection.features.supports_json_field_contains:
+            queryset = queryset.filter(attributes__contains=equal)
+        else:
+            queryset = queryset.filter(**{f'attributes__{key}': value for key, value in equal.items()})
+    return queryset
+
+
+# Expression indexes
+
+def index_name(key):
+    return f'{INDEX_PREFIX}{key}_idx'
+
+
+def wanted_indexes():
+    """Expression indexes for every attribute a schema marks indexed"""
+    keys = set()
+    for definition_json, _ in get_schemas().values():
+        keys.update(key for key, spec in json.loads(definition_json).items() if spec.get('indexed'))
+    return {index_name(key): Index(NumericAttribute(key), name=index_name(key)) for key in sorted(keys)}
+
+
+def sync_indexes(drop_stale=True):
+    """
+    Create missing attribute indexes and drop ones no schema asks for.
+    On PostgreSQL this runs CONCURRENTLY, so samples stay writable.
+    Returns (created, dropped) index names.
+    """
+    wanted = wanted_indexes()
+    with connection.cursor() as cursor:
+        existing = {
+            name for name in connection.introspection.get_constraints(cursor, Sample._meta.db_table)
+            if name.startswith(INDEX_PREFIX)
+        }
+    created = [name for name in wanted if name not in existing]
+    dropped = sorted(existing - set(wanted)) if drop_stale else []
+
+    options = {'concurrently': True} if connection.vendor == 'postgresql' else {}
+    with connection.schema_editor(atomic=False) as editor:
+        for name in created:
+            editor.add_index(Sample, wanted[name], **options)
+        for name in dropped:
+            editor.remove_index(Sample, Index(fields=['attributes'], name=name), **options)
+    return created, dropped
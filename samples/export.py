@@ -0,0 +1,341 @@
+"""
+Streaming inventory exports.
+
+Rows are read with ``QuerySet.iterator()``, which uses a server-side cursor
+on PostgreSQL, and encoded chunk by chunk into CSV, JSON Lines or Parquet,
+so memory use does not grow with the size of the export. On PostgreSQL,
+CSV exports skip Python row handling altogether and stream the output of
+``COPY (query) TO STDOUT``.
+
+Parquet needs the optional ``pyarrow`` package.
+"""
+import csv
+import io
+import json
+import queue
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, connections
+from django.db.models import Exists, F, OuterRef
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .models import SampleAlert
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+CHUNK_SIZE = 2000
+# Chunks buffered between the COPY thread and the response
+COPY_QUEUE_SIZE = 64
+ALERT_TYPES = ('EXPIRED', 'EXPIRING_SOON', 'LOW_QUANTITY', 'OUT_OF_STOCK')
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+# Each column is (name, field path or expression, type)
+SAMPLE_COLUMNS = [
+    ('id', 'id', 'uuid'),
+    ('sample_id', 'sample_id', 'string'),
+    ('name', 'name', 'string'),
+    ('sample_type', 'sample_type', 'string'),
+    ('quantity', 'quantity', 'decimal'),
+    ('unit', 'unit', 'string'),
+    ('min_quantity', 'min_quantity', 'decimal'),
+    ('expiration_date', 'expiration_date', 'date'),
+    ('storage_location_id', 'storage_location_id', 'int'),
+    ('storage_location_name', F('storage_location__name'), 'string'),
+    ('parent_id', F('parent_sample_id'), 'uuid'),
+    ('parent_sample_code', F('parent_sample__sample_id'), 'string'),
+    ('relationship_type', 'relationship_type', 'string'),
+    ('attributes', 'attributes', 'json'),
+    ('created_by_name', F('created_by__username'), 'string'),
+    ('created_at', 'created_at', 'timestamp'),
+    ('updated_at', 'updated_at', 'timestamp'),
+] + [
+    (
+        f'alert_{alert_type.lower()}',
+        Exists(SampleAlert.objects.filter(
+            sample_id=OuterRef('pk'), alert_type=alert_type, resolved_at__isnull=True
+        )),
+        'bool'
+    )
+    for alert_type in ALERT_TYPES
+]
+
+QUANTITY_LOG_COLUMNS = [
+    ('id', 'id', 'int'),
+    ('sample_uuid', F('sample_id'), 'uuid'),
+    ('sample_code', F('sample__sample_id'), 'string'),
+    ('change_type', 'change_type', 'string'),
+    ('quantity_change', 'quantity_change', 'decimal'),
+    ('quantity_after', 'quantity_after', 'decimal'),
+    ('unit', F('sample__unit'), 'string'),
+    ('reason', 'reason', 'string'),
+    ('changed_by_name', F('changed_by__username'), 'string'),
+    ('changed_at', 'changed_at', 'timestamp'),
+]
+
+
+def export_rows(queryset, columns):
+    """values_list queryset yielding one tuple per row in column order"""
+    annotations = {
+        name: source for name, source, _ in columns if not isinstance(source, str)
+    }
+    return queryset.annotate(**annotations).values_list(
+        *[name if name in annotations else source for name, source, _ in columns]
+    )
+
+
+def csv_value(value):
+    # Matches how PostgreSQL's COPY writes the same values
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        # COPY writes whole-hour UTC offsets as +00, not +00:00
+        text = str(value)
+        return text[:-3] if value.utcoffset() is not None and text.endswith(':00') else text
+    return value
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def csv_header(columns):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow([name for name, _, _ in columns])
+    return buffer.getvalue()
+
+
+def iter_chunks(rows):
+    chunk = []
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_csv(rows, columns):
+    yield csv_header(columns)
+    buffer = io.StringIO()
+    # COPY ends rows with \n
+    writer = csv.writer(buffer, lineterminator='\n')
+    for chunk in iter_chunks(rows):
+        writer.writerows([csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_jsonl(rows, columns):
+    names = [name for name, _, _ in columns]
+    for chunk in iter_chunks(rows):
+        yield ''.join(
+            json.dumps(dict(zip(names, map(json_value, row)))) + '\n' for row in chunk
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes to whoever drains it"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(columns):
+    import pyarrow as pa
+    types = {
+        'string': pa.string(),
+        'uuid': pa.string(),
+        'int': pa.int64(),
+        'bool': pa.bool_(),
+        'json': pa.string(),
+        'decimal': pa.decimal128(10, 3),
+        'date': pa.date32(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema([(name, types[kind]) for name, _, kind in columns])
+
+
+def stream_parquet(rows, columns):
+    """One Parquet row group per chunk, written as it is produced"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema(columns)
+    uuid_columns = [index for index, (_, _, kind) in enumerate(columns) if kind == 'uuid']
+    json_columns = [index for index, (_, _, kind) in enumerate(columns) if kind == 'json']
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    try:
+        for chunk in iter_chunks(rows):
+            values = list(zip(*chunk))
+            for index in uuid_columns:
+                values[index] = [str(value) if value is not None else None for value in values[index]]
+            for index in json_columns:
+                values[index] = [json.dumps(value) if value is not None else None for value in values[index]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_copy(rows, columns):
+    """
+    CSV straight from PostgreSQL's COPY TO STDOUT, header included, so
+    every line ends the same way. COPY runs on its own connection in a
+    worker thread and hands output over a bounded queue.
+    """
+    sql, params = rows.query.sql_with_params()
+    names = ', '.join(connection.ops.quote_name(name) for name, _, _ in columns)
+    chunks = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+    cancelled = threading.Event()
+    done = object()
+
+    class QueueFile:
+        def write(self, data):
+            if cancelled.is_set():
+                raise IOError('Export cancelled')
+            chunks.put(data)
+
+    def run_copy():
+        db = connections.create_connection('default')
+        try:
+            with db.cursor() as cursor:
+                raw = cursor.cursor
+                query = raw.mogrify(sql, params).decode()
+                raw.copy_expert(
+                    f'COPY (SELECT * FROM ({query}) export ({names})) TO STDOUT WITH (FORMAT csv, HEADER true)',
+                    QueueFile()
+                )
+            chunks.put(done)
+        except Exception as exc:
+            chunks.put(exc)
+        finally:
+            db.close()
+
+    worker = threading.Thread(target=run_copy, daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Unblock and stop the worker if the client went away
+        cancelled.set()
+        while worker.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def stream_export(queryset, columns, file_format):
+    """Iterator of encoded chunks for the rows of queryset"""
+    rows = export_rows(queryset, columns)
+    if file_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportUnavailable('Parquet export requires the pyarrow package')
+        return stream_parquet(rows, columns)
+    if file_format == 'jsonl':
+        return stream_jsonl(rows, columns)
+    if connection.vendor == 'postgresql':
+        return stream_copy(rows, columns)
+    return stream_csv(rows, columns)
+
+
+async def _aiter(chunks):
+    # The database cursor must stay on the thread that opened it
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    end = object()
+    while True:
+        chunk = await next_chunk(chunks, end)
+        if chunk is end:
+            break
+        yield chunk
+
+
+def export_response(request, queryset, columns, file_format, filename):
+    """
+    StreamingHttpResponse for an export. Under ASGI the chunks are pulled
+    through an async iterator, since Django buffers sync iterators there.
+    """
+    chunks = stream_export(queryset, columns, file_format)
+    if isinstance(request, ASGIRequest):
+        chunks = _aiter(chunks)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+class ExportMixin:
+    """
+    Viewset mixin adding GET .../export/?file_format=csv|jsonl|parquet,
+    filtered, searched and ordered like the list endpoint
+    """
+    export_columns = None
+    export_filename = 'export'
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"file_format must be one of: {', '.join(EXPORT_FORMATS)}"}, status=400
+            )
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            return export_response(request._request, queryset, self.export_columns, file_format,
+                                   self.export_filename)
+        except ExportUnavailable as exc:
+            return Response({'error': str(exc)}, status=400)
@@ -0,0 +1,448 @@
+"""
+Bulk import of legacy LIMS exports (PostgreSQL only).
+
+CSV files are loaded with ``COPY FROM STDIN`` into staging tables whose
+columns are all text. Every check after that is one set-based statement
+that writes a rejection reason into the row's ``error`` column, and new
+primary keys are assigned to the surviving rows in bulk. Rows then move
+to the real tables in chunks, each chunk one transaction that also marks
+its staging rows ``imported``. Sample IDs are numbered inside each
+sample chunk's transaction, after the highest ID in use at that moment,
+so samples the application creates while an import is paused or running
+never collide with the import.
+
+Staging tables and the ``legacy_import_state`` checkpoint table persist
+between runs, so an interrupted import resumes where it stopped: finished
+steps are skipped and chunked inserts continue with the rows not yet
+imported. Nothing here goes through ``save()`` or model signals.
+"""
+import time
+
+from django.db import connection, transaction
+
+from .models import QuantityLog, Sample, StorageLocation
+
+STATE_TABLE = 'legacy_import_state'
+FUNCTIONS = {
+    'legacy_import_is_date': 'date',
+    'legacy_import_is_timestamp': 'timestamptz',
+}
+# Fits DecimalField(max_digits=10, decimal_places=3)
+QUANTITY_PATTERN = r'^[0-9]{1,7}(\.[0-9]{1,3})?$'
+SIGNED_QUANTITY_PATTERN = r'^-?[0-9]{1,7}(\.[0-9]{1,3})?$'
+
+
+class Stage:
+    """One staging table and the CSV columns it accepts"""
+
+    def __init__(self, name, table, columns, required, extra_columns):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.required = required
+        self.extra_columns = extra_columns
+
+    def create_sql(self):
+        columns = ',\n'.join(
+            [f'{column} text' for column in self.columns] + self.extra_columns
+        )
+        return f"""
+            CREATE UNLOGGED TABLE IF NOT EXISTS {self.table} (
+                row_no bigserial PRIMARY KEY,
+                {columns},
+                error text,
+                imported boolean NOT NULL DEFAULT false
+            )
+        """
+
+
+LOCATIONS = Stage(
+    'locations', 'legacy_stage_locations',
+    ['legacy_id', 'name', 'location_type', 'temperature', 'description'],
+    ['legacy_id', 'name', 'location_type'],
+    ['new_id integer'],
+)
+SAMPLES = Stage(
+    'samples', 'legacy_stage_samples',
+    ['legacy_id', 'name', 'sample_type', 'quantity', 'unit', 'min_quantity', 'expiration_date',
+     'location_legacy_id', 'parent_legacy_id', 'relationship_type', 'derivation_notes',
+     'created_by', 'created_at'],
+    ['legacy_id', 'name', 'sample_type', 'quantity', 'unit'],
+    ['new_id uuid', 'new_sample_id text', 'location_id integer', 'parent_id uuid',
+     'created_by_id integer', 'depth integer'],
+)
+QUANTITY_LOGS = Stage(
+    'quantity_logs', 'legacy_stage_quantity_logs',
+    ['sample_legacy_id', 'change_type', 'quantity_change', 'quantity_after', 'reason',
+     'changed_by', 'changed_at'],
+    ['sample_legacy_id', 'change_type', 'quantity_change', 'quantity_after'],
+    ['sample_uuid uuid', 'changed_by_id integer'],
+)
+STAGES = [LOCATIONS, SAMPLES, QUANTITY_LOGS]
+
+
+class LegacyImportError(Exception):
+    pass
+
+
+def execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def fetchall(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def setup():
+    """Create staging tables, the checkpoint table and helper functions"""
+    if connection.vendor != 'postgresql':
+        raise LegacyImportError('The legacy import needs PostgreSQL (COPY FROM STDIN)')
+    with transaction.atomic():
+        execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} "
+                f"(step text PRIMARY KEY, done_at timestamptz NOT NULL DEFAULT now())")
+        for stage in STAGES:
+            execute(stage.create_sql())
+        # Casts that fail return false instead of aborting the statement
+        for name, type_name in FUNCTIONS.items():
+            execute(f"""
+                CREATE OR REPLACE FUNCTION {name}(value text) RETURNS boolean AS $$
+                BEGIN
+                    PERFORM value::{type_name};
+                    RETURN true;
+                EXCEPTION WHEN others THEN
+                    RETURN false;
+                END
+                $$ LANGUAGE plpgsql IMMUTABLE
+            """)
+
+
+def drop():
+    """Remove every staging artifact"""
+    with transaction.atomic():
+        for stage in STAGES:
+            execute(f'DROP TABLE IF EXISTS {stage.table}')
+        execute(f'DROP TABLE IF EXISTS {STATE_TABLE}')
+        for name in FUNCTIONS:
+            execute(f'DROP FUNCTION IF EXISTS {name}(text)')
+
+
+def step_done(step):
+    return bool(fetchall(f'SELECT 1 FROM {STATE_TABLE} WHERE step = %s', [step]))
+
+
+def mark_done(step):
+    execute(f'INSERT INTO {STATE_TABLE} (step) VALUES (%s) ON CONFLICT DO NOTHING', [step])
+
+
+# Loading
+
+def csv_columns(stage, path):
+    """Columns named by the CSV header, checked against the stage"""
+    import csv
+    with open(path, newline='', encoding='utf-8') as handle:
+        header = next(csv.reader(handle), None)
+    if not header:
+        raise LegacyImportError(f'{path} is empty')
+    header = [column.strip().lower() for column in header]
+    unknown = set(header) - set(stage.columns)
+    missing = set(stage.required) - set(header)
+    if unknown:
+        raise LegacyImportError(f"{path}: unknown columns {', '.join(sorted(unknown))}")
+    if missing:
+        raise LegacyImportError(f"{path}: missing columns {', '.join(sorted(missing))}")
+    return header
+
+
+def load(stage, path):
+    """COPY one CSV file into its staging table; returns the rows loaded"""
+    columns = csv_columns(stage, path)
+    column_list = ', '.join(columns)
+    # FORCE_NULL: quoted empty strings load as NULL, like unquoted ones
+    with transaction.atomic(), connection.cursor() as cursor:
+        with open(path, encoding='utf-8') as handle:
+            cursor.cursor.copy_expert(
+                f"COPY {stage.table} ({column_list}) FROM STDIN "
+                f"WITH (FORMAT csv, HEADER true, FORCE_NULL ({column_list}))",
+                handle
+            )
+    return fetchall(f'SELECT count(*) FROM {stage.table}')[0][0]
+
+
+# Validation; each rule rejects rows that are still valid
+
+def reject(stage, reason, condition, params=None):
+    return execute(
+        f"UPDATE {stage.table} s SET error = %s WHERE s.error IS NULL AND ({condition})",
+        [reason] + list(params or [])
+    )
+
+
+def reject_duplicates(stage, column):
+    reject(stage, f'duplicate {column}', f"""
+        s.{column} IN (SELECT {column} FROM {stage.table} GROUP BY {column} HAVING count(*) > 1)
+    """)
+
+
+def reject_too_long(stage, model, columns):
+    for column, field_name in columns:
+        max_length = model._meta.get_field(field_name).max_length
+        reject(stage, f'{column} longer than {max_length} characters',
+               f'length(s.{column}) > {max_length}')
+
+
+def reject_missing(stage):
+    for column in stage.required:
+        reject(stage, f'missing {column}', f's.{column} IS NULL')
+
+
+def resolve_users(stage, column, target, default_user_id):
+    execute(f"""
+        UPDATE {stage.table} s SET {target} = u.id
+        FROM auth_user u WHERE u.username = s.{column} AND s.error IS NULL
+    """)
+    if default_user_id is not None:
+        execute(f'UPDATE {stage.table} SET {target} = %s WHERE error IS NULL AND {target} IS NULL',
+                [default_user_id])
+    reject(stage, f'unknown user in {column}', f's.{target} IS NULL')
+
+
+def prepare_locations():
+    reject_missing(LOCATIONS)
+    reject_duplicates(LOCATIONS, 'legacy_id')
+    reject_too_long(LOCATIONS, StorageLocation, [
+        ('name', 'name'), ('location_type', 'location_type'), ('temperature', 'temperature')
+    ])
+    # Take ids from the table's own sequence so samples can reference them
+    execute(f"""
+        UPDATE {LOCATIONS.table} SET new_id = nextval(pg_get_serial_sequence(%s, 'id'))
+        WHERE error IS NULL AND new_id IS NULL
+    """, [StorageLocation._meta.db_table])
+
+
+def prepare_samples(default_user_id):
+    stage = SAMPLES
+    reject_missing(stage)
+    reject_duplicates(stage, 'legacy_id')
+    reject_too_long(stage, Sample, [('name', 'name'), ('sample_type', 'sample_type'), ('unit', 'unit')])
+    reject(stage, 'invalid quantity', 's.quantity !~ %s', [QUANTITY_PATTERN])
+    reject(stage, 'invalid min_quantity', 's.min_quantity !~ %s', [QUANTITY_PATTERN])
+    reject(stage, 'invalid expiration_date', 'NOT legacy_import_is_date(s.expiration_date)')
+    reject(stage, 'invalid created_at', 'NOT legacy_import_is_timestamp(s.created_at)')
+    reject(stage, 'invalid relationship_type',
+           "s.relationship_type NOT IN ('ALIQUOT', 'DERIVATIVE', 'SPLIT')")
+    resolve_users(stage, 'created_by', 'created_by_id', default_user_id)
+
+    execute(f"""
+        UPDATE {stage.table} s SET location_id = l.new_id
+        FROM {LOCATIONS.table} l
+        WHERE l.legacy_id = s.location_legacy_id AND l.error IS NULL AND s.error IS NULL
+    """)
+    reject(stage, 'unknown or rejected location',
+           's.location_legacy_id IS NOT NULL AND s.location_id IS NULL')
+
+    # A rejected parent rejects its whole subtree, one generation per pass
+    while reject(stage, 'unknown or rejected parent', f"""
+        s.parent_legacy_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM {stage.table} p WHERE p.legacy_id = s.parent_legacy_id AND p.error IS NULL
+        )
+    """):
+        pass
+
+    # Generation depth orders the inserts so parents land before children
+    execute(f"""
+        WITH RECURSIVE tree (row_no, legacy_id, depth) AS (
+            SELECT row_no, legacy_id, 0 FROM {stage.table}
+            WHERE error IS NULL AND parent_legacy_id IS NULL
+            UNION ALL
+            SELECT c.row_no, c.legacy_id, tree.depth + 1
+            FROM {stage.table} c JOIN tree ON c.parent_legacy_id = tree.legacy_id
+            WHERE c.error IS NULL
+        )
+        UPDATE {stage.table} s SET depth = tree.depth FROM tree WHERE s.row_no = tree.row_no
+    """)
+    reject(stage, 'parent cycle', 's.depth IS NULL')
+
+    execute(f"UPDATE {stage.table} SET new_id = gen_random_uuid() WHERE error IS NULL AND new_id IS NULL")
+    execute(f"""
+        UPDATE {stage.table} s SET parent_id = p.new_id
+        FROM {stage.table} p
+        WHERE p.legacy_id = s.parent_legacy_id AND s.error IS NULL
+    """)
+
+
+def prepare_quantity_logs(default_user_id):
+    stage = QUANTITY_LOGS
+    reject_missing(stage)
+    reject(stage, 'invalid change_type', 's.change_type NOT IN %s',
+           [tuple(code for code, _ in QuantityLog.CHANGE_TYPES)])
+    reject(stage, 'invalid quantity_change', 's.quantity_change !~ %s', [SIGNED_QUANTITY_PATTERN])
+    reject(stage, 'invalid quantity_after', 's.quantity_after !~ %s', [QUANTITY_PATTERN])
+    reject(stage, 'invalid changed_at', 'NOT legacy_import_is_timestamp(s.changed_at)')
+    resolve_users(stage, 'changed_by', 'changed_by_id', default_user_id)
+    execute(f"""
+        UPDATE {stage.table} q SET sample_uuid = s.new_id
+        FROM {SAMPLES.table} s
+        WHERE s.legacy_id = q.sample_legacy_id AND s.error IS NULL AND q.error IS NULL
+    """)
+    reject(stage, 'unknown or rejected sample', 's.sample_uuid IS NULL')
+
+
+def prepare(default_user_id):
+    """Validate every staged row and assign primary keys, all in one transaction"""
+    with transaction.atomic():
+        prepare_locations()
+        prepare_samples(default_user_id)
+        prepare_quantity_logs(default_user_id)
+
+
+def error_summary():
+    """(stage name, reason, rows) for every rejection reason"""
+    summary = []
+    for stage in STAGES:
+        for reason, count in fetchall(
+            f'SELECT error, count(*) FROM {stage.table} WHERE error IS NOT NULL GROUP BY error ORDER BY 2 DESC'
+        ):
+            summary.append((stage.name, reason, count))
+    return summary
+
+
+def write_error_report(path):
+    """CSV of every rejected row with its stage, row number and reason"""
+    query = ' UNION ALL '.join(
+        f"SELECT '{stage.name}' AS stage, row_no, "
+        f"{'sample_legacy_id' if stage is QUANTITY_LOGS else 'legacy_id'} AS legacy_id, error "
+        f"FROM {stage.table} WHERE error IS NOT NULL"
+        for stage in STAGES
+    )
+    with connection.cursor() as cursor, open(path, 'w', encoding='utf-8') as handle:
+        cursor.cursor.copy_expert(f'COPY ({query} ORDER BY 1, 2) TO STDOUT WITH (FORMAT csv, HEADER true)', handle)
+
+
+# Inserting
+
+def number_samples(order_by, chunk_size):
+    """
+    Give the next chunk of samples the sample IDs following the highest
+    one in use now. Runs in the chunk's transaction, so a chunk that fails
+    is renumbered from scratch when the import resumes.
+    """
+    year, first_number = Sample.allocate_sample_ids(1)[0].rsplit('-', 2)[1:]
+    execute(f"""
+        UPDATE {SAMPLES.table} s
+        SET new_sample_id = %s || lpad(numbered.number::text, greatest(3, length(numbered.number::text)), '0')
+        FROM (
+            SELECT row_no, %s + row_number() OVER (ORDER BY {order_by}) - 1 AS number
+            FROM (
+                SELECT s.row_no, s.depth FROM {SAMPLES.table} s
+                WHERE s.error IS NULL AND NOT s.imported
+                ORDER BY {order_by}
+                LIMIT %s
+            ) s
+        ) numbered
+        WHERE s.row_no = numbered.row_no
+    """, [f'SAMP-{year}-', int(first_number), chunk_size])
+
+
+INSERTS = [
+    (LOCATIONS, StorageLocation._meta.db_table, 's.row_no', None, {
+        'id': 's.new_id',
+        'name': 's.name',
+        'location_type': 's.location_type',
+        'temperature': "coalesce(s.temperature, '')",
+        'description': "coalesce(s.description, '')",
+        'created_at': 'now()',
+        # Top-level and gridless; storage.rebuild_index() sets the counters afterwards
+        'path': "'/' || s.new_id || '/'",
+        'occupancy': "''::bytea",
+        'occupied_count': '0',
+        'sample_count': '0',
+        'total_sample_count': '0',
+        'total_capacity': '0',
+    }),
+    (SAMPLES, Sample._meta.db_table, 's.depth, s.row_no', number_samples, {
+        'id': 's.new_id',
+        'sample_id': 's.new_sample_id',
+        'name': 's.name',
+        'sample_type': 's.sample_type',
+        'created_by_id': 's.created_by_id',
+        'storage_location_id': 's.location_id',
+        'quantity': 's.quantity::numeric',
+        'unit': 's.unit',
+        'parent_sample_id': 's.parent_id',
+        'relationship_type': 's.relationship_type',
+        'derivation_notes': "coalesce(s.derivation_notes, '')",
+        'min_quantity': 's.min_quantity::numeric',
+        'expiration_date': 's.expiration_date::date',
+        'attributes': "'{}'::jsonb",
+        'created_at': 'coalesce(s.created_at::timestamptz, now())',
+        'updated_at': 'now()',
+    }),
+    (QUANTITY_LOGS, QuantityLog._meta.db_table, 's.row_no', None, {
+        'sample_id': 's.sample_uuid',
+        'change_type': 's.change_type',
+        'quantity_change': 's.quantity_change::numeric',
+        'quantity_after': 's.quantity_after::numeric',
+        'reason': "coalesce(s.reason, '')",
+        'changed_by_id': 's.changed_by_id',
+        'changed_at': 'coalesce(s.changed_at::timestamptz, now())',
+    }),
+]
+
+
+def insert_chunks(stage, target, order_by, before_chunk, values, chunk_size, progress=None):
+    """
+    Move valid, not yet imported rows into target, chunk_size rows per
+    transaction; the staging rows are flagged in the same statement.
+    before_chunk(order_by, chunk_size), when given, runs first in each
+    chunk's transaction.
+    """
+    sql = f"""
+        WITH batch AS (
+            SELECT row_no FROM {stage.table} s
+            WHERE s.error IS NULL AND NOT s.imported
+            ORDER BY {order_by}
+            LIMIT %s
+        ), inserted AS (
+            INSERT INTO {target} ({', '.join(values)})
+            SELECT {', '.join(values.values())}
+            FROM {stage.table} s JOIN batch ON batch.row_no = s.row_no
+        )
+        UPDATE {stage.table} SET imported = true
+        FROM batch WHERE {stage.table}.row_no = batch.row_no
+    """
+    total = fetchall(f'SELECT count(*) FROM {stage.table} WHERE error IS NULL AND NOT imported')[0][0]
+    done = 0
+    start = time.perf_counter()
+    while True:
+        with transaction.atomic():
+            if before_chunk:
+                before_chunk(order_by, chunk_size)
+            count = execute(sql, [chunk_size])
+        if not count:
+            break
+        done += count
+        if progress:
+            progress(stage.name, done, total, time.perf_counter() - start)
+    return done
+
+
+def insert_all(chunk_size, progress=None):
+    """Insert every stage in dependency order; returns rows inserted per stage"""
+    return {
+        stage.name: insert_chunks(stage, target, order_by, before_chunk, values, chunk_size, progress)
+        for stage, target, order_by, before_chunk, values in INSERTS
+    }
+
+
+def stage_counts():
+    """(stage name, rows, rejected, imported) per stage"""
+    return [
+        (stage.name, *fetchall(
+            f'SELECT count(*), count(error), count(*) FILTER (WHERE imported) FROM {stage.table}'
+        )[0])
+        for stage in STAGES
+    ]
@@ -0,0 +1,297 @@
+"""
+Lineage queries over the ``parent_sample`` hierarchy.
+
+The graph traversal only reads (id, parent) pairs, one query per
+generation, and the fields drawn for each node are fetched afterwards in a
+single ``in_bulk``. Descendants are walked breadth first in id order within
+each generation, so a traversal cut off by the node budget can resume
+exactly where it stopped from a small signed cursor.
+
+Whole-subtree questions use a recursive CTE instead: aggregates are
+answered in one statement and cached per root in the shared ``lineage``
+cache until a sample below it changes, and impact analysis joins the CTE to
+experiment links.
+"""
+from django.core import signing
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.expressions import RawSQL
+
+from .models import Sample, SampleAlert
+
+NODE_FIELDS = ('id', 'sample_id', 'name', 'sample_type', 'relationship_type', 'quantity', 'unit')
+MAX_ANCESTORS = 100
+CURSOR_SALT = 'samples.lineage.graph'
+# Guards the recursive queries against cycles in bad data
+MAX_TREE_DEPTH = 1000
+AGGREGATES_CACHE = 'lineage'
+AGGREGATES_CACHE_TIMEOUT = 60 * 60
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def make_cursor(root_id, level, after):
+    return signing.dumps({'root': str(root_id), 'level': level, 'after': after and str(after)},
+                         salt=CURSOR_SALT, compress=True)
+
+
+def read_cursor(cursor, root_id):
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor('Invalid expand cursor')
+    if data.get('root') != str(root_id):
+        raise InvalidCursor('Cursor belongs to a different sample')
+    return data['level'], data['after']
+
+
+def ancestor_edges(sample_id):
+    """(parent, child) pairs from sample_id up to its root"""
+    edges = []
+    seen = {sample_id}
+    current = sample_id
+    for _ in range(MAX_ANCESTORS):
+        parent = Sample.objects.filter(pk=current).values_list('parent_sample_id', flat=True).first()
+        if parent is None or parent in seen:
+            break
+        edges.append((parent, current))
+        seen.add(parent)
+        current = parent
+    return edges
+
+
+def children_of(frontier):
+    return Sample.objects.filter(parent_sample_id__in=frontier).order_by('id')
+
+
+def descendant_edges(root_id, depth, budget, start_level=1, after=None):
+    """
+    Walk up to depth generations below root_id, starting at start_level
+    (1 = children) after the given id. Returns (edges, last_level, cursor);
+    cursor is None when the walk was not cut short by the budget.
+    """
+    # Generations before the starting one are only needed as parents
+    frontier = [root_id]
+    for _ in range(start_level - 1):
+        frontier = list(children_of(frontier).values_list('id', flat=True))
+        if not frontier:
+            return [], start_level - 1, None
+
+    edges = []
+    level = start_level - 1
+    for level in range(start_level, start_level + depth):
+        rows = children_of(frontier)
+        if after is not None and level == start_level:
+            rows = rows.filter(id__gt=after)
+        remaining = budget - len(edges)
+        rows = list(rows.values_list('parent_sample_id', 'id')[:remaining + 1])
+        if len(rows) > remaining:
+            edges.extend(rows[:remaining])
+            last = rows[remaining - 1][1] if remaining else (after if level == start_level else None)
+            return edges, level, make_cursor(root_id, level, last)
+        edges.extend(rows)
+        if after is not None and level == start_level:
+            # The next generation descends from the whole resumed one
+            frontier = list(children_of(frontier).values_list('id', flat=True))
+        else:
+            frontier = [child for _, child in rows]
+        if not frontier:
+            break
+    return edges, level, None
+
+
+def build_graph(sample, depth=1, budget=500, cursor=None, include_ancestors=True):
+    """Nodes and edges around sample, with node fields fetched in one query"""
+    if cursor:
+        start_level, after = read_cursor(cursor, sample.pk)
+        include_ancestors = False
+    else:
+        start_level, after = 1, None
+
+    up = ancestor_edges(sample.pk) if include_ancestors else []
+    down, last_level, next_cursor = descendant_edges(sample.pk, depth, budget, start_level, after)
+
+    node_ids = {sample.pk}
+    for parent, child in up + down:
+        node_ids.update((parent, child))
+    nodes = Sample.objects.only(*NODE_FIELDS).in_bulk(node_ids)
+    child_counts = dict(
+        Sample.objects.filter(parent_sample_id__in=node_ids).values('parent_sample_id').annotate(
+            count=Count('id')
+        ).values_list('parent_sample_id', 'count')
+    )
+
+    return {
+        'root': str(sample.pk),
+        'ancestor_ids': [str(parent) for parent, _ in reversed(up)],
+        'nodes': [
+            {
+                'id': str(node.pk),
+                'sample_id': node.sample_id,
+                'name': node.name,
+                'sample_type': node.sample_type,
+                'relationship_type': node.relationship_type,
+                'quantity': float(node.quantity),
+                'unit': node.unit,
+                'child_count': child_counts.get(node.pk, 0),
+            }
+            for node in nodes.values()
+        ],
+        'edges': [[str(parent), str(child)] for parent, child in up + down],
+        'levels_loaded': last_level,
+        'next': next_cursor,
+    }
+
+
+def subtree_cte(root_id):
+    """
+    SQL and params for a ``subtree(id, depth)`` CTE holding root_id (depth 0)
+    and every sample derived from it
+    """
+    sql = f"""
+        WITH RECURSIVE subtree (id, depth) AS (
+            SELECT id, 0 FROM {Sample._meta.db_table} WHERE id = %s
+            UNION ALL
+            SELECT child.id, subtree.depth + 1
+            FROM {Sample._meta.db_table} child
+            JOIN subtree ON child.parent_sample_id = subtree.id
+            WHERE subtree.depth < {MAX_TREE_DEPTH}
+        )
+    """
+    return sql, [Sample._meta.pk.get_db_prep_value(root_id, connection)]
+
+
+def aggregates_cache_key(sample_id):
+    return f'sample-subtree:{sample_id}'
+
+
+def subtree_aggregates(sample):
+    """
+    Totals over sample and all its descendants, from one SQL statement:
+    quantity by unit, counts by sample_type and relationship_type, open
+    alert counts and the depth distribution
+    """
+    key = aggregates_cache_key(sample.pk)
+    result = caches[AGGREGATES_CACHE].get(key)
+    if result is not None:
+        return result
+
+    cte, params = subtree_cte(sample.pk)
+    sample_table = Sample._meta.db_table
+    alert_table = SampleAlert._meta.db_table
+    sql = cte + f"""
+        , nodes AS (
+            SELECT s.unit, s.quantity, s.sample_type, s.relationship_type, subtree.depth
+            FROM {sample_table} s JOIN subtree ON s.id = subtree.id
+        )
+        SELECT 'unit', unit, COUNT(*), SUM(quantity) FROM nodes GROUP BY unit
+        UNION ALL
+        SELECT 'sample_type', sample_type, COUNT(*), NULL FROM nodes GROUP BY sample_type
+        UNION ALL
+        SELECT 'relationship_type', relationship_type, COUNT(*), NULL FROM nodes GROUP BY relationship_type
+        UNION ALL
+        SELECT 'depth', CAST(depth AS TEXT), COUNT(*), NULL FROM nodes GROUP BY depth
+        UNION ALL
+        SELECT 'alert', a.alert_type, COUNT(*), NULL
+        FROM {alert_table} a JOIN subtree ON a.sample_id = subtree.id
+        WHERE a.resolved_at IS NULL
+        GROUP BY a.alert_type
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    result = {
+        'sample_count': 0,
+        'quantity_by_unit': {},
+        'by_sample_type': {},
+        'by_relationship_type': {},
+        'alerts': {},
+        'depth_distribution': {},
+        'max_depth': 0,
+    }
+    for kind, value, count, total in rows:
+        if kind == 'unit':
+            result['sample_count'] += count
+            result['quantity_by_unit'][value] = {'sample_count': count, 'total_quantity': float(total or 0)}
+        elif kind == 'sample_type':
+            result['by_sample_type'][value] = count
+        elif kind == 'relationship_type':
+            result['by_relationship_type'][value or 'NONE'] = count
+        elif kind == 'alert':
+            result['alerts'][value] = count
+        else:
+            result['depth_distribution'][int(value)] = count
+    result['max_depth'] = max(result['depth_distribution'], default=0)
+    result['depth_distribution'] = [
+        {'depth': depth, 'count': count} for depth, count in sorted(result['depth_distribution'].items())
+    ]
+
+    caches[AGGREGATES_CACHE].set(key, result, AGGREGATES_CACHE_TIMEOUT)
+    return result
+
+
+def invalidate_subtree_aggregates(sample_ids):
+    """
+    Drop cached aggregates of these samples and every ancestor, in one
+    query, once the current transaction commits. Dropping them earlier
+    would let a concurrent read cache the pre-commit totals again.
+    """
+    sample_ids = [sample_id for sample_id in sample_ids if sample_id is not None]
+    if sample_ids:
+        transaction.on_commit(lambda: drop_subtree_aggregates(sample_ids))
+
+
+def drop_subtree_aggregates(sample_ids):
+    prep = Sample._meta.pk.get_db_prep_value
+    sql = f"""
+        WITH RECURSIVE chain (id, parent_id, depth) AS (
+            SELECT id, parent_sample_id, 0 FROM {Sample._meta.db_table}
+            WHERE id IN ({', '.join(['%s'] * len(sample_ids))})
+            UNION ALL
+            SELECT parent.id, parent.parent_sample_id, chain.depth + 1
+            FROM {Sample._meta.db_table} parent
+            JOIN chain ON parent.id = chain.parent_id
+            WHERE chain.depth < {MAX_TREE_DEPTH}
+        )
+        SELECT DISTINCT id FROM chain
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [prep(sample_id, connection) for sample_id in sample_ids])
+        found = {Sample._meta.pk.to_python(row[0]) for row in cursor.fetchall()}
+    # Deleted samples are no longer in the table
+    found.update(Sample._meta.pk.to_python(sample_id) for sample_id in sample_ids)
+    caches[AGGREGATES_CACHE].delete_many([aggregates_cache_key(sample_id) for sample_id in found])
+
+
+def impacted_experiments(sample):
+    """
+    Experiments linked to sample or any sample derived from it; the
+    descendant set and the link join are resolved inside one subquery
+    """
+    from experiments.models import Experiment
+
+    cte, params = subtree_cte(sample.pk)
+    links = Experiment.samples.through._meta.db_table
+    return Experiment.objects.filter(
+        pk__in=RawSQL(cte + f"SELECT link.experiment_id FROM {links} link JOIN subtree ON link.sample_id = subtree.id",
+                      params)
+    )
+
+
+def impacting_samples(sample, experiment_ids):
+    """Map each experiment id to the sample_ids from sample's subtree it uses"""
+    from experiments.models import Experiment
+
+    cte, params = subtree_cte(sample.pk)
+    rows = Experiment.samples.through.objects.filter(
+        experiment_id__in=experiment_ids,
+        sample_id__in=RawSQL(cte + "SELECT id FROM subtree", params)
+    ).order_by('sample__sample_id').values_list('experiment_id', 'sample__sample_id')
+    matched = {}
+    for experiment_id, sample_id in rows:
+        matched.setdefault(experiment_id, []).append(sample_id)
+    return matched
@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import live
+from samples import legacy_import, storage
+from samples.alerts import refresh_all_alerts
+
+
+class Command(BaseCommand):
+    help = ("Import storage locations, samples and quantity logs exported from a legacy LIMS "
+            "as CSV. Files are loaded with COPY into staging tables, validated with set-based "
+            "SQL and inserted in chunked transactions. Re-running after an interruption resumes "
+            "from the last finished step or chunk; use --reset to start over. Requires PostgreSQL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--locations', help="CSV: legacy_id, name, location_type[, temperature, description]")
+        parser.add_argument('--samples', help="CSV: legacy_id, name, sample_type, quantity, unit[, min_quantity, "
+                                              "expiration_date, location_legacy_id, parent_legacy_id, "
+                                              "relationship_type, derivation_notes, created_by, created_at]")
+        parser.add_argument('--quantity-logs', help="CSV: sample_legacy_id, change_type, quantity_change, "
+                                                    "quantity_after[, reason, changed_by, changed_at]")
+        parser.add_argument('--default-user', help="Username for rows whose user is blank or unknown")
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Rows inserted per transaction")
+        parser.add_argument('--strict', action='store_true', help="Stop before inserting if any row is rejected")
+        parser.add_argument('--error-report', help="Write rejected rows with their reasons to this CSV file")
+        parser.add_argument('--reset', action='store_true', help="Drop staging data from a previous run first")
+        parser.add_argument('--keep-staging', action='store_true',
+                            help="Keep staging tables after a successful import")
+
+    def handle(self, *args, **options):
+        default_user_id = None
+        if options['default_user']:
+            try:
+                default_user_id = User.objects.get(username=options['default_user']).pk
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['default_user']} does not exist")
+
+        try:
+            if options['reset']:
+                legacy_import.drop()
+            legacy_import.setup()
+            self.stage(options)
+            self.prepare(options, default_user_id)
+            inserted = legacy_import.insert_all(options['chunk_size'], self.progress)
+        except legacy_import.LegacyImportError as exc:
+            raise CommandError(str(exc))
+
+        counts = legacy_import.stage_counts()
+        if not options['keep_staging']:
+            legacy_import.drop()
+
+        if inserted['locations'] or inserted['samples']:
+            self.stdout.write("Rebuilding storage counters...")
+            storage.rebuild_index()
+        if inserted['samples']:
+            self.stdout.write("Evaluating alerts for imported samples...")
+            refresh_all_alerts()
+            live.publish('counts', {'samples': inserted['samples']})
+
+        for name, rows, rejected, imported in counts:
+            self.stdout.write(f"  {name:<14} {rows:>10} staged  {rejected:>8} rejected  {imported:>10} imported")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {inserted['locations']} locations, {inserted['samples']} samples and "
+            f"{inserted['quantity_logs']} quantity logs"
+        ))
+
+    def stage(self, options):
+        for stage in legacy_import.STAGES:
+            step = f'staged:{stage.name}'
+            if legacy_import.step_done(step):
+                self.stdout.write(f"{stage.name}: already staged")
+                continue
+            path = options[stage.name]
+            if path:
+                self.stdout.write(f"{stage.name}: loading {path}...")
+                rows = legacy_import.load(stage, path)
+                self.stdout.write(f"{stage.name}: {rows} rows staged")
+            legacy_import.mark_done(step)
+
+    def prepare(self, options, default_user_id):
+        if legacy_import.step_done('prepared'):
+            self.stdout.write("Validation already done")
+            return
+
+        self.stdout.write("Validating and assigning ids...")
+        legacy_import.prepare(default_user_id)
+        summary = legacy_import.error_summary()
+        for name, reason, count in summary:
+            self.stdout.write(self.style.WARNING(f"  {name}: {count} rejected, {reason}"))
+        if options['error_report'] and summary:
+            legacy_import.write_error_report(options['error_report'])
+            self.stdout.write(f"Rejected rows written to {options['error_report']}")
+        if options['strict'] and summary:
+            raise CommandError("Rows were rejected and --strict is set; fix the input and rerun with --reset")
+        legacy_import.mark_done('prepared')
+
+    def progress(self, name, done, total, elapsed):
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f"  {name}: {done}/{total} inserted ({rate:,.0f} rows/s)")
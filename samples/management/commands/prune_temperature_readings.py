@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from samples.telemetry import drop_readings_before, retention_days
+
+
+class Command(BaseCommand):
+    help = ("Delete raw temperature readings older than --keep-days. Minute, hour and day "
+            "rollups are kept, so history charts beyond the raw window still work. On "
+            "PostgreSQL whole months are dropped as partitions. Run daily, e.g. from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=retention_days(),
+                            help="Days of raw readings to keep (default TEMPERATURE_RAW_RETENTION_DAYS)")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['keep_days'])
+        dropped = drop_readings_before(cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed raw readings before {cutoff:%Y-%m-%d %H:%M} ({dropped} monthly partitions dropped)"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from samples.storage import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ("Recompute storage location paths, box occupancy bitmaps and sample counters "
+            "from the samples table. Placements made through the API and admin keep these "
+            "current; run this after writes that bypass model signals, such as raw SQL "
+            "or bulk updates.")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt storage index for {rebuilt} locations"))
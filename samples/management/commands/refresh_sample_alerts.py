@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core import live
+from samples.alerts import refresh_all_alerts
+
+
+class Command(BaseCommand):
+    help = ("Re-evaluate expiry and stock alerts into the SampleAlert table. Run daily just "
+            "after midnight (e.g. cron: 1 0 * * * manage.py refresh_sample_alerts) so "
+            "date-based alerts open and days-until-expiry stay current; quantity and "
+            "threshold edits update alerts as they are saved.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Samples evaluated per transaction")
+
+    def handle(self, *args, **options):
+        evaluated, opened, resolved = refresh_all_alerts(batch_size=options['batch_size'])
+        if opened or resolved:
+            live.publish('sample.alert', {'refreshed': True, 'opened': opened, 'resolved': resolved})
+        self.stdout.write(self.style.SUCCESS(
+            f"Evaluated {evaluated} samples: {opened} alerts opened, {resolved} resolved"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from samples.attributes import sync_indexes
+
+
+class Command(BaseCommand):
+    help = ("Create an expression index for every numeric sample attribute a schema marks "
+            "\"indexed\", so range filters such as attributes__concentration__gt=50 use it, "
+            "and drop indexes no schema asks for any more. On PostgreSQL the indexes are "
+            "built concurrently, so samples stay writable. Run after changing schemas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-stale', action='store_true',
+                            help="Do not drop indexes of attributes that are no longer indexed")
+
+    def handle(self, *args, **options):
+        created, dropped = sync_indexes(drop_stale=not options['keep_stale'])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        for name in dropped:
+            self.stdout.write(f"Dropped {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Attribute indexes in sync: {len(created)} created, {len(dropped)} dropped"
+        ))
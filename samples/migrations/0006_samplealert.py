@@ -0,0 +1,93 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("samples", "0005_sample_derivation_notes_sample_parent_sample_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SampleAlert",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "alert_type",
+                    models.CharField(
+                        choices=[
+                            ("EXPIRED", "Expired"),
+                            ("EXPIRING_SOON", "Expiring soon"),
+                            ("LOW_QUANTITY", "Low quantity"),
+                            ("OUT_OF_STOCK", "Out of stock"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "severity",
+                    models.CharField(
+                        choices=[("critical", "Critical"), ("warning", "Warning")],
+                        max_length=10,
+                    ),
+                ),
+                ("message", models.CharField(max_length=255)),
+                (
+                    "days_until_expiry",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Days until the expiration date as of the last evaluation",
+                        null=True,
+                    ),
+                ),
+                ("first_seen_at", models.DateTimeField()),
+                (
+                    "evaluated_on",
+                    models.DateField(
+                        help_text="Date of the last evaluation that changed this row"
+                    ),
+                ),
+                ("resolved_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "sample",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_records",
+                        to="samples.sample",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-first_seen_at"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("resolved_at__isnull", True)),
+                        fields=["alert_type", "days_until_expiry"],
+                        name="sample_alert_open_idx",
+                    ),
+                    models.Index(
+                        fields=["sample", "-first_seen_at"],
+                        name="sample_alert_history_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("resolved_at__isnull", True)),
+                        fields=("sample", "alert_type"),
+                        name="one_open_alert_per_sample_and_type",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    """Existing locations are all top level and have no grid"""
+    StorageLocation = apps.get_model("samples", "StorageLocation")
+
+    locations = list(StorageLocation.objects.annotate(stored=Count("sample")))
+    for location in locations:
+        location.path = f"/{location.pk}/"
+        location.sample_count = location.total_sample_count = location.stored
+    StorageLocation.objects.bulk_update(
+        locations, ["path", "sample_count", "total_sample_count"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("samples", "0006_samplealert"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sample",
+            name="storage_position",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Slot in a box, numbered row by row from 0",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="capacity",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="columns",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="occupancy",
+            field=models.BinaryField(default=b""),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="occupied_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="children",
+                to="samples.storagelocation",
+            ),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="path",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="rows",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="sample_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, help_text="Samples stored directly here"
+            ),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="total_capacity",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Box positions here and in any sub-location",
+            ),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="total_sample_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                help_text="Samples stored here or in any sub-location",
+            ),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="storagelocation",
+            index=models.Index(
+                fields=["path"],
+                name="storage_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="sample",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("storage_position__isnull", False)),
+                fields=("storage_location", "storage_position"),
+                name="one_sample_per_storage_position",
+            ),
+        ),
+    ]
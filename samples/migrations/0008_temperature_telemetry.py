@@ -0,0 +1,188 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def partition_readings(apps, schema_editor):
+    """
+    On PostgreSQL, replace the new (empty) readings table with one
+    range-partitioned by recorded_at. Monthly partitions are created on
+    demand by samples.telemetry.ensure_partitions. The foreign key is
+    added by CreateModel's deferred SQL at the end of the migration.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP TABLE samples_temperaturereading")
+    schema_editor.execute("""
+        CREATE TABLE samples_temperaturereading (
+            location_id bigint NOT NULL,
+            recorded_at timestamp with time zone NOT NULL,
+            temperature double precision NOT NULL,
+            PRIMARY KEY (location_id, recorded_at)
+        ) PARTITION BY RANGE (recorded_at)
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("samples", "0007_storage_hierarchy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storagelocation",
+            name="last_reading_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="last_temperature",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="max_temperature",
+            field=models.FloatField(
+                blank=True, help_text="Highest allowed reading, °C", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="storagelocation",
+            name="min_temperature",
+            field=models.FloatField(
+                blank=True, help_text="Lowest allowed reading, °C", null=True
+            ),
+        ),
+        migrations.CreateModel(
+            name="TemperatureReading",
+            fields=[
+                (
+                    "pk",
+                    models.CompositePrimaryKey(
+                        "location",
+                        "recorded_at",
+                        blank=True,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("recorded_at", models.DateTimeField()),
+                ("temperature", models.FloatField()),
+                (
+                    "location",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="temperature_readings",
+                        to="samples.storagelocation",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(partition_readings, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="TemperatureExcursion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                (
+                    "ended_at",
+                    models.DateTimeField(
+                        blank=True, help_text="First reading back in range", null=True
+                    ),
+                ),
+                (
+                    "min_temperature",
+                    models.FloatField(
+                        blank=True, help_text="Allowed range when it started", null=True
+                    ),
+                ),
+                ("max_temperature", models.FloatField(blank=True, null=True)),
+                (
+                    "peak_temperature",
+                    models.FloatField(help_text="Reading furthest outside the range"),
+                ),
+                ("reading_count", models.PositiveIntegerField(default=0)),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="temperature_excursions",
+                        to="samples.storagelocation",
+                    ),
+                ),
+                (
+                    "samples",
+                    models.ManyToManyField(
+                        blank=True,
+                        related_name="temperature_excursions",
+                        to="samples.sample",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started_at"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("ended_at__isnull", True)),
+                        fields=("location",),
+                        name="one_open_excursion_per_location",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="TemperatureRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[("1m", "1 minute"), ("1h", "1 hour"), ("1d", "1 day")],
+                        max_length=2,
+                    ),
+                ),
+                ("bucket", models.DateTimeField(help_text="Start of the interval")),
+                ("reading_count", models.PositiveIntegerField()),
+                ("minimum", models.FloatField()),
+                ("maximum", models.FloatField()),
+                ("total", models.FloatField()),
+                (
+                    "location",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="temperature_rollups",
+                        to="samples.storagelocation",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["bucket"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("location", "resolution", "bucket"),
+                        name="one_rollup_per_bucket",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.6 on 2026-10-19 00:57
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("samples", "0008_temperature_telemetry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SampleAttributeSchema",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sample_type", models.CharField(max_length=100, unique=True)),
+                (
+                    "definition",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Attribute name to spec: type (string, number, integer, boolean or date), required, minimum, maximum, choices, pattern, max_length, unit, indexed",
+                    ),
+                ),
+                (
+                    "allow_other",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Accept attributes not in the definition",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["sample_type"],
+            },
+        ),
+        migrations.AddField(
+            model_name="sample",
+            name="attributes",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Custom attributes, e.g. concentration or species",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sample",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["attributes"],
+                name="sample_attributes_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ),
+    ]
@@ -1,21 +1,88 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.core.exceptions import ValidationError
 import uuid
 from datetime import datetime
 from barcode import Code128
 from barcode.writer import ImageWriter
 from io import BytesIO
 import base64
+from core import activity
 
 class StorageLocation(models.Model):
+    """
+    A node in the storage hierarchy (freezer, rack, box, ...). Locations
+    with rows and columns are boxes whose slots samples occupy; the
+    occupancy bitmap and the counters are maintained by samples.storage.
+    """
     name = models.CharField(max_length=100)
     location_type = models.CharField(max_length=50)  # freezer, shelf, etc.
     temperature = models.CharField(max_length=20, blank=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True,
+                               related_name='children')
+    # Materialized ancestor ids, e.g. /3/17/42/, for subtree and ancestor lookups
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    
+    # Grid of a box; positions are numbered row by row from 0
+    rows = models.PositiveSmallIntegerField(null=True, blank=True)
+    columns = models.PositiveSmallIntegerField(null=True, blank=True)
+    capacity = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # One bit per position, set when occupied
+    occupancy = models.BinaryField(default=b'', editable=False)
+    occupied_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    # Rollups kept current on every placement instead of counted per request
+    sample_count = models.PositiveIntegerField(default=0, editable=False,
+                                               help_text="Samples stored directly here")
+    total_sample_count = models.PositiveIntegerField(default=0, editable=False,
+                                                     help_text="Samples stored here or in any sub-location")
+    total_capacity = models.PositiveIntegerField(default=0, editable=False,
+                                                 help_text="Box positions here and in any sub-location")
+    
+    # Cold-chain monitoring; readings outside the range open a TemperatureExcursion
+    min_temperature = models.FloatField(null=True, blank=True, help_text="Lowest allowed reading, °C")
+    max_temperature = models.FloatField(null=True, blank=True, help_text="Highest allowed reading, °C")
+    last_temperature = models.FloatField(null=True, blank=True, editable=False)
+    last_reading_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='storage_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
+    
     def __str__(self):
         return self.name
+    
+    @property
+    def is_box(self):
+        return self.capacity is not None
+    
+    def ancestor_ids(self):
+        """Ids from the root down to and including this location"""
+        return [int(part) for part in self.path.strip('/').split('/') if part]
+    
+    def position_label(self, position):
+        """Row letter and 1-based column, e.g. 0 -> A1"""
+        row, column = divmod(position, self.columns)
+        letters = ''
+        row += 1
+        while row:
+            row, remainder = divmod(row - 1, 26)
+            letters = chr(ord('A') + remainder) + letters
+        return f'{letters}{column + 1}'
+    
+    def save(self, *args, **kwargs):
+        from . import storage
+        storage.prepare_location_save(self)
+        if self._previous is not None and not kwargs.get('update_fields'):
+            # Counters, path and occupancy are only written by samples.storage
+            kwargs['update_fields'] = storage.location_update_fields(self)
+        super().save(*args, **kwargs)
+        storage.location_saved(self)
 
 class Sample(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -24,6 +91,9 @@ class Sample(models.Model):
     sample_type = models.CharField(max_length=100)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     storage_location = models.ForeignKey(StorageLocation, on_delete=models.SET_NULL, null=True, blank=True)
+    storage_position = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Slot in a box, numbered row by row from 0"
+    )
     quantity = models.DecimalField(max_digits=10, decimal_places=3)
     unit = models.CharField(max_length=20)
     
@@ -58,17 +128,38 @@ class Sample(models.Model):
     expiration_date = models.DateField(null=True, blank=True,
                                        help_text="Date when sample expires")
     
+    # Lab-specific fields, checked against the SampleAttributeSchema for the sample type
+    attributes = models.JSONField(default=dict, blank=True,
+                                  help_text="Custom attributes, e.g. concentration or species")
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['storage_location', 'storage_position'],
+                                    condition=models.Q(storage_position__isnull=False),
+                                    name='one_sample_per_storage_position'),
+        ]
+        indexes = [
+            # Serves attribute equality filters (attributes @> '{...}')
+            GinIndex(fields=['attributes'], opclasses=['jsonb_path_ops'], name='sample_attributes_gin'),
+        ]
+    
     @classmethod
     def generate_sample_id(cls):
+        return cls.allocate_sample_ids(1)[0]
+    
+    @classmethod
+    def allocate_sample_ids(cls, count):
+        """Next count consecutive sample IDs for this year"""
+        from django.db.models.functions import Length
         year = datetime.now().year
         
-        # Find the last sample for this year
+        # Find the last sample for this year; longer IDs are past 999
         last_sample = cls.objects.filter(
             sample_id__startswith=f'SAMP-{year}-'
-        ).order_by('sample_id').last()
+        ).order_by(Length('sample_id').desc(), '-sample_id').first()
         
         if last_sample:
             # Extract number from last sample ID and increment
@@ -77,7 +168,7 @@ class Sample(models.Model):
         else:
             new_number = 1
         
-        return f'SAMP-{year}-{new_number:03d}'
+        return [f'SAMP-{year}-{number:03d}' for number in range(new_number, new_number + count)]
     
     def save(self, *args, **kwargs):
         if not self.sample_id:
@@ -90,6 +181,13 @@ class Sample(models.Model):
             else:
                 raise ValueError("Could not generate unique sample ID")
         super().save(*args, **kwargs)
+    
+    def clean(self):
+        from .attributes import validate_attributes
+        
+        errors = validate_attributes(self.sample_type, self.attributes)
+        if errors:
+            raise ValidationError({'attributes': [f'{key}: {error}' for key, error in errors.items()]})
 
     def generate_barcode(self):
         """Generate barcode for sample ID"""
@@ -125,7 +223,7 @@ class Sample(models.Model):
         
         # Update sample quantity
         self.quantity = new_quantity
-        self.save()
+        self.save(update_fields=['quantity', 'updated_at'])
         
         # Create log entry
         QuantityLog.objects.create(
@@ -137,6 +235,12 @@ class Sample(models.Model):
             changed_by=changed_by
         )
         
+        activity.record(
+            'QUANTITY_CHANGED', self, changed_by,
+            change_type=change_type, quantity_change=str(quantity_change),
+            quantity_after=str(new_quantity), unit=self.unit, reason=reason
+        )
+        
         return self.quantity
     
     def use_quantity(self, amount, changed_by, reason=''):
@@ -154,6 +258,78 @@ class Sample(models.Model):
         from decimal import Decimal
         return self.record_quantity_change('ADJUST', Decimal(str(amount)), changed_by, reason)
     
+    def split(self, quantities, changed_by, names, relationship_type='SPLIT',
+              derivation_notes='', storage_location_id=None):
+        """
+        Divide this sample into one child per quantity in a single transaction
+        
+        Children get a consecutive block of sample IDs and are inserted with
+        bulk_create; the parent is decremented once with a single SPLIT
+        QuantityLog entry naming the children. Returns the children.
+        """
+        from decimal import Decimal
+        from .alerts import sync_sample_alerts
+        from . import storage
+        from core import live
+        
+        quantities = [Decimal(str(quantity)) for quantity in quantities]
+        total = sum(quantities, Decimal('0'))
+        
+        with transaction.atomic():
+            # Lock the parent so concurrent splits cannot overdraw it
+            self.quantity = Sample.objects.select_for_update().values_list(
+                'quantity', flat=True
+            ).get(pk=self.pk)
+            if total > self.quantity:
+                raise ValueError(f"Parent sample only has {self.quantity} {self.unit} available")
+            
+            children = [
+                Sample(
+                    name=name,
+                    sample_type=self.sample_type,
+                    quantity=quantity,
+                    unit=self.unit,
+                    created_by=changed_by,
+                    parent_sample=self,
+                    relationship_type=relationship_type,
+                    derivation_notes=derivation_notes,
+                    storage_location_id=storage_location_id,
+                    attributes=dict(self.attributes),
+                )
+                for name, quantity in zip(names, quantities)
+            ]
+            
+            for attempt in range(5):
+                for child, sample_id in zip(children, Sample.allocate_sample_ids(len(children))):
+                    child.sample_id = sample_id
+                try:
+                    # A concurrent insert may have taken part of the block
+                    with transaction.atomic():
+                        Sample.objects.bulk_create(children, batch_size=500)
+                    break
+                except IntegrityError:
+                    continue
+            else:
+                raise ValueError("Could not allocate sample IDs for the split")
+            
+            if len(children) == 1:
+                reason = f'Split into aliquot: {children[0].sample_id}'
+            else:
+                reason = (f'Split into {len(children)} aliquots: '
+                          f'{children[0].sample_id} to {children[-1].sample_id}')
+            self.record_quantity_change('SPLIT', -total, changed_by, reason)
+            
+            # bulk_create skips the post_save handlers
+            activity.record_many([
+                activity.build_event('CREATED', child, changed_by, parent_id=str(self.pk))
+                for child in children
+            ])
+            sync_sample_alerts(children)
+            if storage_location_id:
+                storage.apply_moves([(None, None, storage_location_id, None)] * len(children))
+            live.publish('counts', {'samples': len(children)})
+        return children
+    
     # Alert-related methods
     def is_low_quantity(self):
         """Check if sample quantity is below minimum threshold"""
@@ -245,6 +421,36 @@ class Sample(models.Model):
         return f"{self.sample_id} - {self.name}"
 
 
+class SampleAttributeSchema(models.Model):
+    """
+    Custom attributes allowed on samples of one type. definition maps each
+    attribute name to its spec, e.g.
+    {"concentration": {"type": "number", "minimum": 0, "unit": "ng/µl", "indexed": true}}
+    """
+    sample_type = models.CharField(max_length=100, unique=True)
+    definition = models.JSONField(
+        default=dict,
+        help_text="Attribute name to spec: type (string, number, integer, boolean or date), required, "
+                  "minimum, maximum, choices, pattern, max_length, unit, indexed"
+    )
+    allow_other = models.BooleanField(default=False, help_text="Accept attributes not in the definition")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['sample_type']
+    
+    def clean(self):
+        from .attributes import check_definition
+        
+        try:
+            check_definition(self.definition)
+        except ValueError as e:
+            raise ValidationError({'definition': str(e)})
+    
+    def __str__(self):
+        return self.sample_type
+
+
 class QuantityLog(models.Model):
     CHANGE_TYPES = [
         ('USE', 'Used in experiment'),
@@ -266,4 +472,127 @@ class QuantityLog(models.Model):
         ordering = ['-changed_at']
     
     def __str__(self):
-        return f"{self.sample.sample_id} - {self.change_type} - {self.quantity_change} {self.sample.unit}"
\ No newline at end of file
+        return f"{self.sample.sample_id} - {self.change_type} - {self.quantity_change} {self.sample.unit}"
+
+class SampleAlert(models.Model):
+    """
+    Materialized alert state for a sample, one row per alert episode
+
+    An open row (resolved_at is null) means the condition currently holds.
+    Rows are opened and resolved by samples.alerts.sync_sample_alerts, from
+    the nightly refresh_sample_alerts job and whenever a save changes the
+    fields alerts depend on.
+    """
+    ALERT_TYPES = [
+        ('EXPIRED', 'Expired'),
+        ('EXPIRING_SOON', 'Expiring soon'),
+        ('LOW_QUANTITY', 'Low quantity'),
+        ('OUT_OF_STOCK', 'Out of stock'),
+    ]
+    SEVERITY_CHOICES = [
+        ('critical', 'Critical'),
+        ('warning', 'Warning'),
+    ]
+    
+    sample = models.ForeignKey(Sample, on_delete=models.CASCADE, related_name='alert_records')
+    alert_type = models.CharField(max_length=20, choices=ALERT_TYPES)
+    severity = models.CharField(max_length=10, choices=SEVERITY_CHOICES)
+    message = models.CharField(max_length=255)
+    days_until_expiry = models.IntegerField(null=True, blank=True,
+                                            help_text="Days until the expiration date as of the last evaluation")
+    first_seen_at = models.DateTimeField()
+    evaluated_on = models.DateField(help_text="Date of the last evaluation that changed this row")
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-first_seen_at']
+        constraints = [
+            models.UniqueConstraint(fields=['sample', 'alert_type'], condition=models.Q(resolved_at__isnull=True),
+                                    name='one_open_alert_per_sample_and_type'),
+        ]
+        indexes = [
+            models.Index(fields=['alert_type', 'days_until_expiry'], condition=models.Q(resolved_at__isnull=True),
+                         name='sample_alert_open_idx'),
+            models.Index(fields=['sample', '-first_seen_at'], name='sample_alert_history_idx'),
+        ]
+    
+    def __str__(self):
+        state = 'resolved' if self.resolved_at else 'open'
+        return f"{self.sample.sample_id} - {self.alert_type} ({state})"
+
+
+class TemperatureReading(models.Model):
+    """
+    One probe reading. On PostgreSQL the table is range-partitioned by
+    month of recorded_at (see samples.telemetry); the composite key makes
+    resent readings no-ops.
+    """
+    pk = models.CompositePrimaryKey('location', 'recorded_at')
+    # The primary key already leads with location
+    location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='temperature_readings',
+                                 db_index=False)
+    recorded_at = models.DateTimeField()
+    temperature = models.FloatField()
+    
+    def __str__(self):
+        return f"{self.location_id} {self.recorded_at:%Y-%m-%d %H:%M:%S} {self.temperature}°C"
+
+
+class TemperatureRollup(models.Model):
+    """
+    Per-location reading statistics over one minute, hour or UTC day,
+    merged in as readings are ingested. Mean is total / reading_count.
+    """
+    RESOLUTIONS = [
+        ('1m', '1 minute'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    ]
+    
+    location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='temperature_rollups')
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket = models.DateTimeField(help_text="Start of the interval")
+    reading_count = models.PositiveIntegerField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+    total = models.FloatField()
+    
+    class Meta:
+        ordering = ['bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'resolution', 'bucket'], name='one_rollup_per_bucket'),
+        ]
+    
+    @property
+    def mean(self):
+        return self.total / self.reading_count
+    
+    def __str__(self):
+        return f"{self.location_id} {self.resolution} {self.bucket:%Y-%m-%d %H:%M}"
+
+
+class TemperatureExcursion(models.Model):
+    """
+    A run of readings outside a location's allowed range. Every sample
+    stored at or below the location while it is open is linked in samples.
+    """
+    location = models.ForeignKey(StorageLocation, on_delete=models.CASCADE, related_name='temperature_excursions')
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, blank=True, help_text="First reading back in range")
+    min_temperature = models.FloatField(null=True, blank=True, help_text="Allowed range when it started")
+    max_temperature = models.FloatField(null=True, blank=True)
+    peak_temperature = models.FloatField(help_text="Reading furthest outside the range")
+    reading_count = models.PositiveIntegerField(default=0)
+    samples = models.ManyToManyField(Sample, related_name='temperature_excursions', blank=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+        constraints = [
+            models.UniqueConstraint(fields=['location'], condition=models.Q(ended_at__isnull=True),
+                                    name='one_open_excursion_per_location'),
+        ]
+    
+    def __str__(self):
+        state = 'ended' if self.ended_at else 'open'
+        return f"{self.location.name} excursion at {self.started_at:%Y-%m-%d %H:%M} ({state})"
+
@@ -1,10 +1,45 @@
+from decimal import Decimal, ROUND_DOWN
+
 from rest_framework import serializers
-from .models import Sample, StorageLocation, QuantityLog
+from .models import (
+    Sample, SampleAlert, SampleAttributeSchema, StorageLocation, QuantityLog, TemperatureExcursion
+)
 
 class StorageLocationSerializer(serializers.ModelSerializer):
+    utilization = serializers.SerializerMethodField(read_only=True)
+    
     class Meta:
         model = StorageLocation
-        fields = '__all__'
+        exclude = ('occupancy',)
+    
+    def get_utilization(self, obj):
+        """Samples in this location's subtree per box position, in percent"""
+        if not obj.total_capacity:
+            return None
+        return round(100 * obj.total_sample_count / obj.total_capacity, 1)
+    
+    def validate(self, attrs):
+        from .storage import ancestors_of
+        
+        rows = attrs.get('rows', self.instance.rows if self.instance else None)
+        columns = attrs.get('columns', self.instance.columns if self.instance else None)
+        if bool(rows) != bool(columns):
+            raise serializers.ValidationError('Boxes need both rows and columns')
+        
+        if self.instance:
+            parent = attrs.get('parent', self.instance.parent)
+            if parent and (parent.pk == self.instance.pk or self.instance.pk in ancestors_of(parent.path)):
+                raise serializers.ValidationError({'parent': 'A location cannot be moved inside itself'})
+            capacity = rows * columns if rows else 0
+            if self.instance.occupied_count and capacity != (self.instance.capacity or 0):
+                last = self.instance.sample_set.filter(storage_position__isnull=False).order_by(
+                    '-storage_position'
+                ).values_list('storage_position', flat=True).first()
+                if last is not None and last >= capacity:
+                    raise serializers.ValidationError(
+                        'Occupied positions would fall outside the new grid; move those samples first'
+                    )
+        return attrs
 
 class SampleSerializer(serializers.ModelSerializer):
     storage_location = StorageLocationSerializer(read_only=True)
@@ -17,12 +52,57 @@ class SampleSerializer(serializers.ModelSerializer):
     children_count = serializers.SerializerMethodField(read_only=True)
     is_parent = serializers.SerializerMethodField(read_only=True)
     is_child = serializers.SerializerMethodField(read_only=True)
+    storage_position_label = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = Sample
         fields = '__all__'
         read_only_fields = ('sample_id',)
     
+    def get_storage_position_label(self, obj):
+        if obj.storage_position is None or not obj.storage_location or not obj.storage_location.is_box:
+            return None
+        return obj.storage_location.position_label(obj.storage_position)
+    
+    def validate(self, attrs):
+        """Positions must be a free slot within the location's grid; attributes must fit the type's schema"""
+        from .attributes import validate_attributes
+        from .storage import validate_position
+        
+        instance = self.instance
+        if instance is None or 'attributes' in attrs or 'sample_type' in attrs:
+            sample_type = attrs.get('sample_type', instance.sample_type if instance else None)
+            errors = validate_attributes(sample_type, attrs.get('attributes', instance.attributes if instance else {}))
+            if errors:
+                raise serializers.ValidationError({'attributes': errors})
+        
+        location_id = attrs.get('storage_location_id', instance.storage_location_id if instance else None)
+        if 'storage_position' in attrs:
+            position = attrs['storage_position']
+        elif instance and location_id == instance.storage_location_id:
+            position = instance.storage_position
+        else:
+            # Moving to another location without a position leaves the old slot
+            position = attrs['storage_position'] = None
+        
+        location = None
+        if location_id:
+            location = StorageLocation.objects.filter(pk=location_id).first()
+            if location is None:
+                raise serializers.ValidationError({'storage_location_id': 'Storage location not found'})
+        error = validate_position(location, position)
+        if error:
+            raise serializers.ValidationError({'storage_position': error})
+        if position is not None:
+            taken = Sample.objects.filter(storage_location_id=location_id, storage_position=position)
+            if instance:
+                taken = taken.exclude(pk=instance.pk)
+            if taken.exists():
+                raise serializers.ValidationError({
+                    'storage_position': f'{location.position_label(position)} in {location.name} is occupied'
+                })
+        return attrs
+    
     def get_parent_sample_info(self, obj):
         """Return basic info about parent sample"""
         if obj.parent_sample:
@@ -73,6 +153,21 @@ class SampleSerializer(serializers.ModelSerializer):
         
         return super().update(instance, validated_data)
 
+class SampleAttributeSchemaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SampleAttributeSchema
+        fields = '__all__'
+        read_only_fields = ('updated_at',)
+    
+    def validate_definition(self, value):
+        from .attributes import check_definition
+        
+        try:
+            check_definition(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
 class LineageSerializer(serializers.ModelSerializer):
     """Simplified serializer for lineage display"""
     class Meta:
@@ -95,4 +190,90 @@ class QuantityLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuantityLog
         fields = '__all__'
-        read_only_fields = ('changed_at',)
\ No newline at end of file
+        read_only_fields = ('changed_at',)
+
+class TemperatureExcursionSerializer(serializers.ModelSerializer):
+    location_name = serializers.CharField(source='location.name', read_only=True)
+    sample_count = serializers.IntegerField(read_only=True)
+    is_open = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = TemperatureExcursion
+        exclude = ('samples',)
+    
+    def get_is_open(self, obj):
+        return obj.ended_at is None
+
+class SampleAlertSerializer(serializers.ModelSerializer):
+    sample_code = serializers.CharField(source='sample.sample_id', read_only=True)
+    sample_name = serializers.CharField(source='sample.name', read_only=True)
+    is_open = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = SampleAlert
+        fields = ['id', 'sample', 'sample_code', 'sample_name', 'alert_type', 'severity', 'message',
+                  'days_until_expiry', 'first_seen_at', 'evaluated_on', 'resolved_at', 'is_open']
+    
+    def get_is_open(self, obj):
+        return obj.resolved_at is None
+
+class SampleSplitSerializer(serializers.Serializer):
+    """Input for splitting a sample into aliquots; expects the parent in context"""
+    MAX_CHILDREN = 1000
+    
+    quantities = serializers.ListField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=3, min_value=Decimal('0.001')),
+        required=False, min_length=1, max_length=MAX_CHILDREN,
+        help_text="Explicit quantity of each child"
+    )
+    count = serializers.IntegerField(min_value=1, max_value=MAX_CHILDREN, required=False)
+    total_quantity = serializers.DecimalField(
+        max_digits=10, decimal_places=3, min_value=Decimal('0.001'), required=False,
+        help_text="Amount divided evenly between count children; defaults to the whole parent"
+    )
+    name_prefix = serializers.CharField(max_length=180, required=False)
+    relationship_type = serializers.ChoiceField(choices=['ALIQUOT', 'SPLIT'], required=False)
+    derivation_notes = serializers.CharField(required=False, allow_blank=True, default='')
+    storage_location_id = serializers.IntegerField(required=False, allow_null=True, default=None)
+    
+    def validate(self, attrs):
+        parent = self.context['parent']
+        quantities = attrs.get('quantities')
+        count = attrs.get('count')
+        
+        if quantities is not None:
+            if count is not None and count != len(quantities):
+                raise serializers.ValidationError('count must match the number of quantities')
+            if 'total_quantity' in attrs:
+                raise serializers.ValidationError('total_quantity only applies to an even division')
+            attrs.setdefault('relationship_type', 'ALIQUOT')
+        elif count is not None:
+            # Round each share down; any remainder stays with the parent
+            total = attrs.get('total_quantity', parent.quantity)
+            share = (total / count).quantize(Decimal('0.001'), rounding=ROUND_DOWN)
+            if share <= 0:
+                raise serializers.ValidationError(f'{total} {parent.unit} cannot be divided into {count} aliquots')
+            quantities = [share] * count
+            attrs.setdefault('relationship_type', 'SPLIT')
+        else:
+            raise serializers.ValidationError('quantities or count is required')
+        
+        total = sum(quantities, Decimal('0'))
+        if total > parent.quantity:
+            raise serializers.ValidationError(
+                f'Parent sample only has {parent.quantity} {parent.unit} available, {total} requested'
+            )
+        
+        storage_location_id = attrs['storage_location_id']
+        if storage_location_id is not None and not StorageLocation.objects.filter(pk=storage_location_id).exists():
+            raise serializers.ValidationError({'storage_location_id': 'Storage location not found'})
+        
+        attrs['quantities'] = quantities
+        return attrs
+    
+    def get_names(self):
+        """One name per child, numbered after the prefix"""
+        data = self.validated_data
+        prefix = data.get('name_prefix') or f"{self.context['parent'].name} aliquot"[:180]
+        width = len(str(len(data['quantities'])))
+        return [f'{prefix} {index:0{width}d}' for index in range(1, len(data['quantities']) + 1)]
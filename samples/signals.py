@@ -0,0 +1,117 @@
+import copy
+
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from core import activity, live
+from .alerts import sync_sample_alerts
+from . import storage
+from .lineage import invalidate_subtree_aggregates
+from .models import Sample, StorageLocation
+
+# Saves made by record_quantity_change() record their own event
+QUANTITY_FIELDS = {'quantity', 'updated_at'}
+# Fields that decide a sample's alert status
+ALERT_FIELDS = ('quantity', 'min_quantity', 'expiration_date')
+STORAGE_FIELDS = {'storage_location', 'storage_location_id', 'storage_position'}
+# Fields lineage.subtree_aggregates reads
+AGGREGATE_FIELDS = ('quantity', 'unit', 'sample_type', 'relationship_type', 'parent_sample_id')
+
+
+def alert_types(sample):
+    return sorted(alert['type'] for alert in sample.get_alert_status())
+
+
+@receiver(post_init, sender=Sample)
+def remember_alert_fields(sender, instance, **kwargs):
+    """Keep the values as loaded so saves can tell when alert thresholds are crossed"""
+    instance._loaded_alert_fields = {
+        field: instance.__dict__[field] for field in ALERT_FIELDS if field in instance.__dict__
+    }
+    instance._loaded_parent_id = instance.__dict__.get('parent_sample_id')
+    instance._loaded_aggregate_fields = {
+        field: instance.__dict__[field] for field in AGGREGATE_FIELDS if field in instance.__dict__
+    }
+    if 'storage_location_id' in instance.__dict__ and 'storage_position' in instance.__dict__:
+        instance._loaded_storage = (instance.storage_location_id, instance.storage_position)
+    else:
+        # Deferred; placement changes made through this instance are not tracked
+        instance._loaded_storage = None
+
+
+@receiver(post_save, sender=Sample)
+def record_sample_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        activity.record('CREATED', instance, instance.created_by)
+        live.publish('counts', {'samples': 1})
+    elif update_fields is None or not set(update_fields) <= QUANTITY_FIELDS:
+        activity.record('UPDATED', instance)
+    
+    publish_sample_changes(instance, created)
+    
+    current = {field: getattr(instance, field) for field in ALERT_FIELDS}
+    if created or instance._loaded_alert_fields != current:
+        sync_sample_alerts([instance])
+    instance._loaded_alert_fields = current
+    
+    # Cached subtree aggregates of every ancestor, old and new, are stale
+    # when a field they count changed; deferred fields may have
+    loaded = instance._loaded_aggregate_fields
+    current = {field: getattr(instance, field) for field in loaded}
+    if created or len(loaded) < len(AGGREGATE_FIELDS) or loaded != current:
+        invalidate_subtree_aggregates([instance.pk, instance._loaded_parent_id])
+    instance._loaded_aggregate_fields = current
+    instance._loaded_parent_id = instance.parent_sample_id
+    
+    if update_fields is None or STORAGE_FIELDS & set(update_fields):
+        current = (instance.storage_location_id, instance.storage_position)
+        previous = (None, None) if created else instance._loaded_storage
+        if previous is not None and current != previous:
+            storage.apply_moves([(*previous, *current)])
+        instance._loaded_storage = current
+
+
+def publish_sample_changes(instance, created):
+    """Push quantity changes and alert threshold crossings to live clients"""
+    loaded = instance._loaded_alert_fields
+    current = {'id': str(instance.pk), 'sample_id': instance.sample_id, 'name': instance.name}
+    
+    if not created and 'quantity' in loaded and loaded['quantity'] != instance.quantity:
+        live.publish('sample.quantity', {
+            **current, 'quantity': float(instance.quantity), 'previous_quantity': float(loaded['quantity']),
+            'unit': instance.unit
+        })
+    
+    alerts = alert_types(instance)
+    if created:
+        previous_alerts = []
+    elif len(loaded) == len(ALERT_FIELDS):
+        previous = copy.copy(instance)
+        for field, value in loaded.items():
+            setattr(previous, field, value)
+        previous_alerts = alert_types(previous)
+    else:
+        # Loaded with deferred fields; the previous state is unknown
+        return
+    if alerts != previous_alerts:
+        live.publish('sample.alert', {**current, 'alerts': alerts, 'previous_alerts': previous_alerts})
+
+
+@receiver(post_delete, sender=Sample)
+def record_sample_deleted(sender, instance, **kwargs):
+    activity.record('DELETED', instance)
+    live.publish('counts', {'samples': -1})
+    invalidate_subtree_aggregates([instance.pk, instance.parent_sample_id])
+    if instance._loaded_storage is not None:
+        storage.apply_moves([(*instance._loaded_storage, None, None)])
+    alerts = alert_types(instance)
+    if alerts:
+        live.publish('sample.alert', {
+            'id': str(instance.pk), 'sample_id': instance.sample_id, 'name': instance.name,
+            'alerts': [], 'previous_alerts': alerts
+        })
+
+
+@receiver(pre_delete, sender=StorageLocation)
+def release_storage_location(sender, instance, **kwargs):
+    storage.location_deleted(instance)
@@ -0,0 +1,354 @@
+"""
+Storage hierarchy bookkeeping.
+
+Each box keeps an occupancy bitmap with one bit per position, so finding
+free slots never touches the sample table. Every location keeps counters:
+samples stored directly in it, samples and box capacity in its whole
+subtree. Placements update the bitmaps and counters in the same
+transaction, so utilization rollups are read rather than recomputed.
+Writes that bypass model signals (bulk imports) should finish with
+``rebuild_index()``.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Concat, Substr
+
+from .models import Sample, StorageLocation
+
+
+# Occupancy bitmaps
+
+def bitmap_size(capacity):
+    return ((capacity or 0) + 7) // 8
+
+
+def is_occupied(bitmap, position):
+    return bool(bitmap[position >> 3] & (1 << (position & 7)))
+
+
+def popcount(bitmap):
+    return int.from_bytes(bitmap, 'little').bit_count()
+
+
+def set_position(bitmap, position, occupied):
+    if occupied:
+        bitmap[position >> 3] |= 1 << (position & 7)
+    else:
+        bitmap[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+
+
+def free_positions(bitmap, capacity, count, start=0):
+    """Up to count free positions, scanning forward from start"""
+    found = []
+    position = start
+    while position < capacity and len(found) < count:
+        byte = bitmap[position >> 3]
+        if byte == 0xFF and position & 7 == 0:
+            # Whole byte full; skip eight positions at once
+            position += 8
+            continue
+        if not byte & (1 << (position & 7)):
+            found.append(position)
+        position += 1
+    return found
+
+
+# Locations
+
+COUNTER_FIELDS = ('occupied_count', 'sample_count', 'total_sample_count', 'total_capacity')
+
+
+def location_update_fields(location):
+    """Fields a save of an existing location may write"""
+    fields = [
+        field.name for field in StorageLocation._meta.concrete_fields
+        if not field.primary_key and field.name not in COUNTER_FIELDS + ('path', 'occupancy')
+    ]
+    if location.capacity != location._previous['capacity']:
+        fields.append('occupancy')
+    return fields
+
+def prepare_location_save(location):
+    """Derive capacity and size the bitmap before a location is written"""
+    if location.rows and location.columns:
+        capacity = location.rows * location.columns
+    else:
+        capacity = None
+
+    previous = None
+    if location.pk:
+        previous = StorageLocation.objects.filter(pk=location.pk).values(
+            'parent_id', 'path', 'capacity', 'occupancy', *COUNTER_FIELDS
+        ).first()
+    location._previous = previous
+    if previous:
+        # The instance may have been loaded before later placements
+        location.path = previous['path']
+        for field in COUNTER_FIELDS:
+            setattr(location, field, previous[field])
+
+    if previous:
+        bitmap = bytes(previous['occupancy'] or b'')
+        if location.parent_id and location.parent_id != previous['parent_id']:
+            parent_path = StorageLocation.objects.values_list('path', flat=True).get(pk=location.parent_id)
+            if parent_path.startswith(previous['path']):
+                raise ValueError("A location cannot be moved inside itself")
+    else:
+        bitmap = b''
+    used = [position for position in range(len(bitmap) * 8) if is_occupied(bitmap, position)]
+    if used and (capacity is None or max(used) >= capacity):
+        raise ValueError("Occupied positions would fall outside the new grid")
+
+    location.capacity = capacity
+    location.occupancy = bitmap[:bitmap_size(capacity)].ljust(bitmap_size(capacity), b'\0')
+    if previous is None:
+        location.total_capacity = capacity or 0
+
+
+def location_saved(location):
+    """Refresh paths and ancestor rollups after a location is written"""
+    previous = location._previous
+    parent_path = ''
+    if location.parent_id:
+        parent_path = StorageLocation.objects.values_list('path', flat=True).get(pk=location.parent_id)
+    path = f"{parent_path or '/'}{location.pk}/"
+
+    with transaction.atomic():
+        if previous is None:
+            StorageLocation.objects.filter(pk=location.pk).update(path=path)
+            location.path = path
+            adjust_totals(ancestors_of(path), capacity=location.total_capacity)
+            return
+
+        capacity_delta = (location.capacity or 0) - (previous['capacity'] or 0)
+        if capacity_delta:
+            StorageLocation.objects.filter(pk=location.pk).update(
+                total_capacity=F('total_capacity') + capacity_delta
+            )
+
+        if path != previous['path']:
+            # Moved: rewrite the subtree's paths and move its totals
+            old_path = previous['path']
+            StorageLocation.objects.filter(path__startswith=old_path).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1))
+            )
+            location.path = path
+            totals = StorageLocation.objects.values('total_sample_count', 'total_capacity').get(pk=location.pk)
+            adjust_totals(ancestors_of(old_path), samples=-totals['total_sample_count'],
+                          capacity=-(totals['total_capacity'] - capacity_delta))
+            adjust_totals(ancestors_of(path), samples=totals['total_sample_count'],
+                          capacity=totals['total_capacity'])
+        elif capacity_delta:
+            adjust_totals(ancestors_of(path), capacity=capacity_delta)
+        location.refresh_from_db(fields=['total_capacity', 'total_sample_count'])
+
+
+def ancestors_of(path):
+    """Ancestor ids in a path, excluding the location itself"""
+    return [int(part) for part in path.strip('/').split('/')[:-1] if part]
+
+
+def adjust_totals(location_ids, samples=0, capacity=0):
+    if not location_ids or not (samples or capacity):
+        return
+    StorageLocation.objects.filter(pk__in=location_ids).update(
+        total_sample_count=F('total_sample_count') + samples,
+        total_capacity=F('total_capacity') + capacity,
+    )
+
+
+def location_deleted(location):
+    """Take a deleted leaf location's totals off its ancestors"""
+    Sample.objects.filter(storage_location=location).update(storage_position=None)
+    adjust_totals(ancestors_of(location.path), samples=-location.total_sample_count,
+                  capacity=-location.total_capacity)
+
+
+# Placements
+
+def apply_moves(moves):
+    """
+    Record sample placement changes, each (old_location_id, old_position,
+    new_location_id, new_position), in bitmaps and counters. Callers must
+    already have written the samples.
+    """
+    direct = Counter()
+    bits = defaultdict(dict)
+    for old_location, old_position, new_location, new_position in moves:
+        if old_location != new_location:
+            if old_location:
+                direct[old_location] -= 1
+            if new_location:
+                direct[new_location] += 1
+        if old_location and old_position is not None:
+            bits[old_location][old_position] = False
+        if new_location and new_position is not None:
+            bits[new_location][new_position] = True
+    direct = {location_id: delta for location_id, delta in direct.items() if delta}
+    if not direct and not bits:
+        return
+
+    with transaction.atomic():
+        # Lock in id order so concurrent placements cannot deadlock
+        locations = {
+            location.pk: location
+            for location in StorageLocation.objects.select_for_update().filter(
+                pk__in=set(direct) | set(bits)
+            ).only('path', 'capacity', 'occupancy').order_by('pk')
+        }
+
+        for location_id, changes in bits.items():
+            location = locations.get(location_id)
+            if location is None or location.capacity is None:
+                continue
+            bitmap = bytearray(location.occupancy)
+            for position, occupied in changes.items():
+                if position < location.capacity:
+                    set_position(bitmap, position, occupied)
+            StorageLocation.objects.filter(pk=location_id).update(
+                occupancy=bytes(bitmap), occupied_count=popcount(bitmap)
+            )
+
+        totals = Counter()
+        for location_id, delta in direct.items():
+            if location_id not in locations:
+                continue
+            StorageLocation.objects.filter(pk=location_id).update(sample_count=F('sample_count') + delta)
+            for ancestor_id in locations[location_id].ancestor_ids():
+                totals[ancestor_id] += delta
+        by_delta = defaultdict(list)
+        for location_id, delta in totals.items():
+            if delta:
+                by_delta[delta].append(location_id)
+        for delta, location_ids in by_delta.items():
+            adjust_totals(location_ids, samples=delta)
+
+
+def validate_position(location, position):
+    """Error message for an invalid placement, or None"""
+    if position is None:
+        return None
+    if location is None:
+        return "A storage position needs a storage location"
+    if location.capacity is None:
+        return f"{location.name} is not a box with positions"
+    if position >= location.capacity:
+        return f"{location.name} only has positions 0 to {location.capacity - 1}"
+    return None
+
+
+# Allocation
+
+def candidate_boxes(location):
+    """Boxes at or below location with at least one free position, in tree order"""
+    return StorageLocation.objects.filter(
+        path__startswith=location.path, capacity__isnull=False, occupied_count__lt=F('capacity')
+    ).order_by('path', 'pk')
+
+
+def find_free_slots(location, count, start=0, lock=False):
+    """
+    The first count free (box, position) pairs at or below location:
+    from start in location itself when it is a box, then onward through
+    the boxes beneath it in tree order
+    """
+    boxes = candidate_boxes(location).only('name', 'path', 'rows', 'columns', 'capacity', 'occupancy')
+    if lock:
+        boxes = boxes.select_for_update()
+    slots = []
+    for box in boxes.iterator(chunk_size=200):
+        offset = start if box.pk == location.pk else 0
+        bitmap = bytes(box.occupancy)
+        for position in free_positions(bitmap, box.capacity, count - len(slots), offset):
+            slots.append((box, position))
+        if len(slots) >= count:
+            break
+    return slots
+
+
+def allocate(location, samples, start=0):
+    """
+    Place samples in the nearest free positions at or below location.
+    Returns the (sample, box, position) placements; raises ValueError if
+    there are not enough free positions.
+    """
+    with transaction.atomic():
+        slots = find_free_slots(location, len(samples), start, lock=True)
+        if len(slots) < len(samples):
+            raise ValueError(f"Only {len(slots)} free positions under {location.name}, {len(samples)} needed")
+
+        moves = []
+        placements = []
+        for sample, (box, position) in zip(samples, slots):
+            moves.append((sample.storage_location_id, sample.storage_position, box.pk, position))
+            sample.storage_location_id = box.pk
+            sample.storage_position = position
+            placements.append((sample, box, position))
+        # Clear old positions first so samples can move within one box
+        Sample.objects.filter(pk__in=[sample.pk for sample in samples]).update(storage_position=None)
+        Sample.objects.bulk_update(samples, ['storage_location', 'storage_position'], batch_size=500)
+        apply_moves(moves)
+    return placements
+
+
+# Rebuild
+
+def rebuild_index():
+    """
+    Recompute paths, bitmaps and every counter from the samples table.
+    Returns the number of locations rebuilt.
+    """
+    with transaction.atomic():
+        locations = {
+            location.pk: location
+            for location in StorageLocation.objects.select_for_update().only(
+                'parent', 'rows', 'columns', 'capacity'
+            )
+        }
+        children = defaultdict(list)
+        for location in locations.values():
+            children[location.parent_id].append(location)
+
+        direct = dict(
+            Sample.objects.filter(storage_location__isnull=False).values('storage_location').annotate(
+                count=Count('pk')
+            ).values_list('storage_location', 'count')
+        )
+        bitmaps = {
+            location.pk: bytearray(bitmap_size(location.capacity))
+            for location in locations.values() if location.capacity
+        }
+        for location_id, position in Sample.objects.filter(
+            storage_location__isnull=False, storage_position__isnull=False
+        ).values_list('storage_location', 'storage_position').iterator(chunk_size=5000):
+            location = locations[location_id]
+            if location.capacity and position < location.capacity:
+                set_position(bitmaps[location_id], position, True)
+
+        updated = []
+
+        def visit(location, parent_path):
+            location.path = f"{parent_path}{location.pk}/"
+            location.capacity = (location.rows * location.columns) if location.rows and location.columns else None
+            location.occupancy = bytes(bitmaps.get(location.pk, b''))
+            location.occupied_count = popcount(location.occupancy)
+            location.sample_count = direct.get(location.pk, 0)
+            location.total_sample_count = location.sample_count
+            location.total_capacity = location.capacity or 0
+            for child in children[location.pk]:
+                visit(child, location.path)
+                location.total_sample_count += child.total_sample_count
+                location.total_capacity += child.total_capacity
+            updated.append(location)
+
+        for root in children[None]:
+            visit(root, '/')
+        StorageLocation.objects.bulk_update(
+            updated,
+            ['path', 'capacity', 'occupancy', 'occupied_count', 'sample_count', 'total_sample_count',
+             'total_capacity'],
+            batch_size=500
+        )
+    return len(updated)
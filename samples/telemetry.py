@@ -0,0 +1,390 @@
+"""
+Cold-chain temperature telemetry.
+
+Probes post batches of readings for storage locations. Each batch is
+written with one multi-row INSERT per chunk; on PostgreSQL the readings
+table is partitioned by month, so old raw data is dropped a partition at a
+time. The same transaction merges the new readings into 1-minute, 1-hour
+and 1-day rollups, so long time ranges are read from the rollups instead
+of raw points. Readings outside a location's allowed range open a
+TemperatureExcursion that links every sample stored at or below it.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import live
+from .models import Sample, StorageLocation, TemperatureExcursion, TemperatureReading, TemperatureRollup
+
+MAX_BATCH = 10000
+# Rows per INSERT statement
+INSERT_CHUNK = 1000
+MAX_POINTS = 5000
+RESOLUTION_SECONDS = {'1m': 60, '1h': 3600, '1d': 86400}
+# With ?resolution=auto the finest resolution whose span limit fits is used
+AUTO_RESOLUTIONS = [
+    (timedelta(hours=2), 'raw'),
+    (timedelta(days=3), '1m'),
+    (timedelta(days=180), '1h'),
+    (None, '1d'),
+]
+READINGS_TABLE = TemperatureReading._meta.db_table
+ROLLUPS_TABLE = TemperatureRollup._meta.db_table
+DEFAULT_RETENTION_DAYS = 90
+
+# Months this process has created or seen; another process may drop one
+_known_partitions = set()
+
+
+class InvalidReadings(ValueError):
+    pass
+
+
+def parse_timestamp(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed, dt_timezone.utc)
+            return parsed
+    raise ValueError('recorded_at must be an ISO 8601 timestamp or epoch seconds')
+
+
+def retention_days():
+    return getattr(settings, 'TEMPERATURE_RAW_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def parse_readings(items):
+    """
+    Validate a batch of readings, each {location, recorded_at, temperature}
+    or [location, recorded_at, temperature]. Naive timestamps are UTC.
+    Readings older than the raw retention window are refused, since their
+    month may already have been pruned.
+    """
+    if not isinstance(items, list) or not items:
+        raise InvalidReadings('readings must be a non-empty list')
+    if len(items) > MAX_BATCH:
+        raise InvalidReadings(f'At most {MAX_BATCH} readings per request')
+
+    days = retention_days()
+    oldest = timezone.now() - timedelta(days=days)
+    readings = []
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, dict):
+                location, recorded_at, temperature = item['location'], item['recorded_at'], item['temperature']
+            else:
+                location, recorded_at, temperature = item
+            location = int(location)
+            temperature = float(temperature)
+            if not math.isfinite(temperature):
+                raise ValueError('temperature must be a finite number')
+            recorded_at = parse_timestamp(recorded_at)
+            if recorded_at < oldest:
+                raise ValueError(f'recorded_at is older than the {days}-day retention window')
+            readings.append((location, recorded_at, temperature))
+        except (KeyError, TypeError, ValueError) as exc:
+            detail = f'missing {exc}' if isinstance(exc, KeyError) else str(exc)
+            raise InvalidReadings(f'readings[{index}]: {detail or "expected location, recorded_at, temperature"}')
+    return readings
+
+
+# Partitions
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def ensure_partitions(timestamps):
+    """Create the monthly partitions these readings fall in (PostgreSQL only)"""
+    if connection.vendor != 'postgresql':
+        return
+    months = {month_start(value) for value in timestamps} - _known_partitions
+    with connection.cursor() as cursor:
+        for month in sorted(months):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{READINGS_TABLE}_p{month:%Y%m}" '
+                f'PARTITION OF "{READINGS_TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                [month, next_month(month)]
+            )
+            _known_partitions.add(month)
+
+
+def is_missing_partition(error):
+    return 'no partition of relation' in str(error)
+
+
+def drop_readings_before(cutoff):
+    """
+    Delete raw readings older than cutoff; rollups are kept. Whole months
+    are dropped as partitions on PostgreSQL. Returns the number of
+    partitions dropped.
+    """
+    dropped = 0
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+            """, [READINGS_TABLE])
+            for (name,) in cursor.fetchall():
+                month = datetime.strptime(name.rsplit('_p', 1)[1], '%Y%m').replace(tzinfo=dt_timezone.utc)
+                if next_month(month) <= cutoff:
+                    cursor.execute(f'DROP TABLE "{name}"')
+                    _known_partitions.discard(month)
+                    dropped += 1
+    TemperatureReading.objects.filter(recorded_at__lt=cutoff).delete()
+    return dropped
+
+
+# Ingest
+
+def as_utc(value):
+    # Backends without timezone support hand back naive UTC values
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if timezone.is_naive(value):
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def insert_readings(readings):
+    """Insert readings, skipping ones already stored; returns those inserted"""
+    adapt = connection.ops.adapt_datetimefield_value
+    by_key = {(location, recorded_at): (location, recorded_at, temperature)
+              for location, recorded_at, temperature in readings}
+    rows = list(by_key.values())
+    inserted = []
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), INSERT_CHUNK):
+            chunk = rows[offset:offset + INSERT_CHUNK]
+            cursor.execute(
+                f'INSERT INTO "{READINGS_TABLE}" (location_id, recorded_at, temperature) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(chunk))} '
+                f'ON CONFLICT DO NOTHING RETURNING location_id, recorded_at',
+                [value for location, recorded_at, temperature in chunk
+                 for value in (location, adapt(recorded_at), temperature)]
+            )
+            inserted.extend(by_key[(location, as_utc(recorded_at))] for location, recorded_at in cursor.fetchall())
+    return inserted
+
+
+def bucket_start(value, seconds):
+    epoch = int(value.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=dt_timezone.utc)
+
+
+def merge_rollups(readings):
+    """Fold new readings into every rollup resolution with additive upserts"""
+    buckets = {}
+    for location, recorded_at, temperature in readings:
+        for resolution, seconds in RESOLUTION_SECONDS.items():
+            key = (location, resolution, bucket_start(recorded_at, seconds))
+            stats = buckets.get(key)
+            if stats is None:
+                buckets[key] = [1, temperature, temperature, temperature]
+            else:
+                stats[0] += 1
+                stats[1] = min(stats[1], temperature)
+                stats[2] = max(stats[2], temperature)
+                stats[3] += temperature
+
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = list(buckets.items())
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), INSERT_CHUNK):
+            chunk = rows[offset:offset + INSERT_CHUNK]
+            cursor.execute(
+                f'INSERT INTO "{ROLLUPS_TABLE}" AS r '
+                f'(location_id, resolution, bucket, reading_count, minimum, maximum, total) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))} '
+                f'ON CONFLICT (location_id, resolution, bucket) DO UPDATE SET '
+                f'reading_count = r.reading_count + excluded.reading_count, '
+                f'minimum = {least}(r.minimum, excluded.minimum), '
+                f'maximum = {greatest}(r.maximum, excluded.maximum), '
+                f'total = r.total + excluded.total',
+                [value for (location, resolution, bucket), stats in chunk
+                 for value in (location, resolution, adapt(bucket), *stats)]
+            )
+    return len(buckets)
+
+
+def deviation(temperature, minimum, maximum):
+    """How far a reading lies outside [minimum, maximum]; 0 when inside"""
+    if minimum is not None and temperature < minimum:
+        return minimum - temperature
+    if maximum is not None and temperature > maximum:
+        return temperature - maximum
+    return 0
+
+
+def flag_samples(excursion, location):
+    """Link the samples stored at or below location to excursion"""
+    through = TemperatureExcursion.samples.through
+    sample_ids = Sample.objects.filter(
+        storage_location__path__startswith=location.path
+    ).values_list('pk', flat=True)
+    through.objects.bulk_create(
+        [through(temperatureexcursion_id=excursion.pk, sample_id=sample_id) for sample_id in sample_ids],
+        batch_size=1000, ignore_conflicts=True
+    )
+
+
+def detect_excursions(locations, readings):
+    """Open, extend and close excursions from new readings; returns (opened, closed)"""
+    by_location = defaultdict(list)
+    for location, recorded_at, temperature in readings:
+        by_location[location].append((recorded_at, temperature))
+
+    open_excursions = {
+        excursion.location_id: excursion
+        for excursion in TemperatureExcursion.objects.select_for_update().filter(
+            location_id__in=list(by_location), ended_at__isnull=True
+        )
+    }
+    opened, closed = [], []
+    # Unsaved instances are unhashable, so track changes by identity
+    changed = {}
+    for location_id, points in by_location.items():
+        location = locations[location_id]
+        current = open_excursions.get(location_id)
+        if current is None and location.min_temperature is None and location.max_temperature is None:
+            continue
+        for recorded_at, temperature in sorted(points):
+            if current is None:
+                if deviation(temperature, location.min_temperature, location.max_temperature):
+                    current = TemperatureExcursion(
+                        location_id=location_id, started_at=recorded_at, peak_temperature=temperature,
+                        min_temperature=location.min_temperature, max_temperature=location.max_temperature
+                    )
+                    opened.append(current)
+                else:
+                    continue
+            outside = deviation(temperature, current.min_temperature, current.max_temperature)
+            if outside:
+                current.started_at = min(current.started_at, recorded_at)
+                current.reading_count += 1
+                if outside > deviation(current.peak_temperature, current.min_temperature, current.max_temperature):
+                    current.peak_temperature = temperature
+                changed[id(current)] = current
+            elif recorded_at > current.started_at:
+                current.ended_at = recorded_at
+                closed.append(current)
+                changed[id(current)] = current
+                current = None
+
+    for excursion in changed.values():
+        excursion.save()
+    # Samples present when it started, plus any placed there while it lasted
+    for excursion in dict.fromkeys(opened + closed):
+        flag_samples(excursion, locations[excursion.location_id])
+    return opened, closed
+
+
+def ingest(readings):
+    """
+    Store a parsed batch: raw readings, rollups, latest value per location
+    and excursions, in one transaction. Returns a summary dict.
+    """
+    location_ids = {location for location, _, _ in readings}
+    for attempt in range(2):
+        ensure_partitions(recorded_at for _, recorded_at, _ in readings)
+        try:
+            locations, inserted, opened, closed = store(readings, location_ids)
+            break
+        except IntegrityError as exc:
+            if attempt or not is_missing_partition(exc):
+                raise
+            # A prune in another process dropped a month this one had seen
+            _known_partitions.clear()
+
+    for excursion in opened + closed:
+        live.publish('storage.excursion', {
+            'id': excursion.pk, 'location': excursion.location_id,
+            'location_name': locations[excursion.location_id].name,
+            'started_at': excursion.started_at, 'ended_at': excursion.ended_at,
+            'peak_temperature': excursion.peak_temperature,
+        })
+    return {
+        'received': len(readings),
+        'inserted': len(inserted),
+        'duplicates': len(readings) - len(inserted),
+        'excursions_opened': len(opened),
+        'excursions_closed': len(closed),
+    }
+
+
+def store(readings, location_ids):
+    """The transactional part of ingest; returns (locations, inserted, opened, closed)"""
+    with transaction.atomic():
+        # Serializes concurrent batches for the same locations
+        locations = StorageLocation.objects.select_for_update().only(
+            'name', 'path', 'min_temperature', 'max_temperature', 'last_temperature', 'last_reading_at'
+        ).order_by('pk').in_bulk(location_ids)
+        missing = sorted(location_ids - set(locations))
+        if missing:
+            raise InvalidReadings(f'Unknown storage locations: {", ".join(map(str, missing[:20]))}')
+
+        inserted = insert_readings(readings)
+        merge_rollups(inserted)
+
+        latest = {}
+        for location, recorded_at, temperature in inserted:
+            if location not in latest or recorded_at > latest[location][0]:
+                latest[location] = (recorded_at, temperature)
+        updated = []
+        for location_id, (recorded_at, temperature) in latest.items():
+            location = locations[location_id]
+            if location.last_reading_at is None or recorded_at > location.last_reading_at:
+                location.last_reading_at = recorded_at
+                location.last_temperature = temperature
+                updated.append(location)
+        StorageLocation.objects.bulk_update(updated, ['last_reading_at', 'last_temperature'])
+
+        opened, closed = detect_excursions(locations, inserted)
+    return locations, inserted, opened, closed
+
+
+# Queries
+
+def pick_resolution(start, end):
+    span = end - start
+    for limit, resolution in AUTO_RESOLUTIONS:
+        if limit is None or span <= limit:
+            return resolution
+
+
+def temperature_series(location, start, end, resolution='auto'):
+    """(resolution, points) for location between start and end"""
+    if resolution == 'auto':
+        resolution = pick_resolution(start, end)
+
+    if resolution == 'raw':
+        rows = TemperatureReading.objects.filter(
+            location=location, recorded_at__gte=start, recorded_at__lt=end
+        ).order_by('recorded_at').values_list('recorded_at', 'temperature')[:MAX_POINTS]
+        return resolution, [{'t': recorded_at, 'temperature': temperature} for recorded_at, temperature in rows]
+
+    rows = TemperatureRollup.objects.filter(
+        location=location, resolution=resolution,
+        bucket__gte=bucket_start(start, RESOLUTION_SECONDS[resolution]), bucket__lt=end
+    ).order_by('bucket').values_list('bucket', 'reading_count', 'minimum', 'maximum', 'total')[:MAX_POINTS]
+    return resolution, [
+        {'t': bucket, 'count': count, 'min': minimum, 'max': maximum, 'mean': round(total / count, 3)}
+        for bucket, count, minimum, maximum, total in rows
+    ]
@@ -1,3 +1,163 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from . import storage
+from .models import Sample, StorageLocation
+
+INDEX_FIELDS = ('path', 'capacity', 'occupancy', 'occupied_count', 'sample_count', 'total_sample_count',
+                'total_capacity')
+
+
+class StorageIndexTests(TestCase):
+    """Incrementally maintained bitmaps and counters agree with a full rebuild"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('technician', password='secret')
+        self.freezer = StorageLocation.objects.create(name='Freezer 1', location_type='freezer')
+        self.rack = StorageLocation.objects.create(name='Rack A', location_type='rack', parent=self.freezer)
+        self.box_a = StorageLocation.objects.create(
+            name='Box A', location_type='box', parent=self.rack, rows=2, columns=3
+        )
+        self.box_b = StorageLocation.objects.create(
+            name='Box B', location_type='box', parent=self.rack, rows=2, columns=2
+        )
+        self.freezer2 = StorageLocation.objects.create(name='Freezer 2', location_type='freezer')
+        self.box_c = StorageLocation.objects.create(
+            name='Box C', location_type='box', parent=self.freezer2, rows=3, columns=3
+        )
+
+    def add_sample(self, location=None, position=None, name='Sample'):
+        return Sample.objects.create(
+            name=name, sample_type='DNA', quantity=1, unit='mL', created_by=self.user,
+            storage_location=location, storage_position=position
+        )
+
+    def index(self):
+        return {
+            row['pk']: {**row, 'occupancy': bytes(row['occupancy'])}
+            for row in StorageLocation.objects.values('pk', *INDEX_FIELDS)
+        }
+
+    def location(self, location):
+        return StorageLocation.objects.get(pk=location.pk)
+
+    def occupied(self, location):
+        location = self.location(location)
+        return [
+            position for position in range(location.capacity)
+            if storage.is_occupied(bytes(location.occupancy), position)
+        ]
+
+    def assert_matches_rebuild(self):
+        maintained = self.index()
+        self.assertEqual(storage.rebuild_index(), len(maintained))
+        self.assertEqual(self.index(), maintained)
+
+    def test_placing_samples_updates_bitmaps_and_rollups(self):
+        self.add_sample(self.box_a, 0)
+        self.add_sample(self.box_a, 4)
+        self.add_sample(self.box_b, 3)
+        self.add_sample(self.rack)
+
+        self.assertEqual(self.occupied(self.box_a), [0, 4])
+        self.assertEqual(self.location(self.box_a).occupied_count, 2)
+        self.assertEqual(self.location(self.rack).sample_count, 1)
+        self.assertEqual(self.location(self.rack).total_sample_count, 4)
+        self.assertEqual(self.location(self.freezer).total_sample_count, 4)
+        self.assertEqual(self.location(self.freezer).total_capacity, 10)
+        self.assert_matches_rebuild()
+
+    def test_moving_a_sample_between_boxes(self):
+        sample = self.add_sample(self.box_a, 1)
+
+        sample.storage_location = self.box_c
+        sample.storage_position = 8
+        sample.save()
+
+        self.assertEqual(self.occupied(self.box_a), [])
+        self.assertEqual(self.occupied(self.box_c), [8])
+        self.assertEqual(self.location(self.box_a).sample_count, 0)
+        self.assertEqual(self.location(self.box_c).sample_count, 1)
+        self.assertEqual(self.location(self.freezer).total_sample_count, 0)
+        self.assertEqual(self.location(self.freezer2).total_sample_count, 1)
+        self.assert_matches_rebuild()
+
+        # Within one box only the bitmap changes
+        sample.storage_position = 2
+        sample.save()
+        self.assertEqual(self.occupied(self.box_c), [2])
+        self.assertEqual(self.location(self.box_c).sample_count, 1)
+        self.assert_matches_rebuild()
+
+    def test_reparenting_a_location_moves_its_subtree_totals(self):
+        self.add_sample(self.box_a, 0)
+        self.add_sample(self.box_b, 1)
+        self.add_sample(self.rack)
+
+        rack = self.location(self.rack)
+        rack.parent = self.freezer2
+        rack.save()
+
+        self.assertEqual(self.location(self.freezer).total_sample_count, 0)
+        self.assertEqual(self.location(self.freezer).total_capacity, 0)
+        self.assertEqual(self.location(self.freezer2).total_sample_count, 3)
+        self.assertEqual(self.location(self.freezer2).total_capacity, 19)
+        self.assertEqual(
+            self.location(self.box_a).path, f'/{self.freezer2.pk}/{self.rack.pk}/{self.box_a.pk}/'
+        )
+        self.assert_matches_rebuild()
+
+    def test_location_cannot_move_inside_itself(self):
+        rack = self.location(self.rack)
+        rack.parent = self.box_a
+        with self.assertRaises(ValueError):
+            rack.save()
+
+    def test_deleting_a_sample_frees_its_position(self):
+        kept = self.add_sample(self.box_a, 0)
+        removed = self.add_sample(self.box_a, 5)
+
+        removed.delete()
+
+        self.assertEqual(self.occupied(self.box_a), [0])
+        self.assertEqual(self.location(self.box_a).sample_count, 1)
+        self.assertEqual(self.location(self.freezer).total_sample_count, 1)
+        self.assertTrue(Sample.objects.filter(pk=kept.pk).exists())
+        self.assert_matches_rebuild()
+
+    def test_allocate_fills_free_positions_in_tree_order(self):
+        self.add_sample(self.box_a, 0)
+        self.add_sample(self.box_a, 2)
+        samples = [self.add_sample(name=f'Aliquot {number}') for number in range(6)]
+
+        placements = storage.allocate(self.location(self.freezer), samples)
+
+        self.assertEqual(
+            [(box.pk, position) for _, box, position in placements],
+            [(self.box_a.pk, 1), (self.box_a.pk, 3), (self.box_a.pk, 4), (self.box_a.pk, 5),
+             (self.box_b.pk, 0), (self.box_b.pk, 1)]
+        )
+        self.assertEqual(self.location(self.box_a).occupied_count, 6)
+        self.assertEqual(self.location(self.freezer).total_sample_count, 8)
+        self.assert_matches_rebuild()
+
+        with self.assertRaises(ValueError):
+            storage.allocate(self.location(self.freezer), [self.add_sample() for _ in range(3)])
+        self.assert_matches_rebuild()
+
+    def test_rebuild_repairs_counters_after_bulk_writes(self):
+        self.add_sample(self.box_a, 0)
+        maintained = self.index()
+        # Bulk writes skip the signals that keep the index
+        Sample.objects.bulk_create([
+            Sample(sample_id=f'BULK-{number}', name='Bulk', sample_type='DNA', quantity=1, unit='mL',
+                   created_by=self.user, storage_location=self.box_b, storage_position=number)
+            for number in range(3)
+        ])
+        self.assertEqual(self.index(), maintained)
+
+        storage.rebuild_index()
+
+        self.assertEqual(self.occupied(self.box_b), [0, 1, 2])
+        self.assertEqual(self.location(self.rack).total_sample_count, 4)
+        self.assert_matches_rebuild()
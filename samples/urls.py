@@ -1,10 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SampleViewSet, StorageLocationViewSet
+from .views import (
+    QuantityLogViewSet, SampleAttributeSchemaViewSet, SampleViewSet, StorageLocationViewSet,
+    TemperatureExcursionViewSet
+)
 
 router = DefaultRouter()
 router.register(r'samples', SampleViewSet)
 router.register(r'storage-locations', StorageLocationViewSet)
+router.register(r'quantity-logs', QuantityLogViewSet)
+router.register(r'temperature-excursions', TemperatureExcursionViewSet)
+router.register(r'sample-attribute-schemas', SampleAttributeSchemaViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -3,23 +3,202 @@ from rest_framework.permissions import IsAuthenticated
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
-from .models import Sample, StorageLocation
-from .serializers import SampleSerializer, StorageLocationSerializer
+from datetime import timedelta
+from django.utils import timezone
+from django.db.models import Count
+from .alerts import EXPIRING_SOON_DAYS
+from .export import ExportMixin, QUANTITY_LOG_COLUMNS, SAMPLE_COLUMNS
+from .models import (
+    QuantityLog, Sample, SampleAlert, SampleAttributeSchema, StorageLocation, TemperatureExcursion
+)
+from .serializers import (
+    QuantityLogSerializer, SampleAttributeSchemaSerializer, SampleSerializer, StorageLocationSerializer,
+    TemperatureExcursionSerializer
+)
 
 class StorageLocationViewSet(viewsets.ModelViewSet):
     queryset = StorageLocation.objects.all()
     serializer_class = StorageLocationSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['location_type']
+    filterset_fields = ['location_type', 'parent']
     search_fields = ['name', 'location_type', 'description']
-    ordering_fields = ['name', 'created_at']
+    ordering_fields = ['name', 'created_at', 'path', 'total_sample_count']
     ordering = ['name']
+    
+    def destroy(self, request, *args, **kwargs):
+        location = self.get_object()
+        if location.children.exists():
+            return Response({'error': 'Move or delete the sub-locations first'}, status=400)
+        return super().destroy(request, *args, **kwargs)
+    
+    @action(detail=False, methods=['post'])
+    def readings(self, request):
+        """
+        Batch temperature ingest. Body: {"readings": [{location, recorded_at,
+        temperature}, ...]} or the list itself; [location, recorded_at,
+        temperature] triples are accepted too. Resent readings are skipped.
+        """
+        from .telemetry import InvalidReadings, ingest, parse_readings
+        
+        items = request.data.get('readings') if isinstance(request.data, dict) else request.data
+        try:
+            summary = ingest(parse_readings(items))
+        except InvalidReadings as exc:
+            return Response({'error': str(exc)}, status=400)
+        return Response(summary, status=201)
+    
+    @action(detail=True, methods=['get'])
+    def temperature(self, request, pk=None):
+        """
+        Temperature history between ?start= and ?end= (default: the last 24
+        hours). ?resolution=raw|1m|1h|1d, or auto to use the coarsest data
+        that still gives a detailed chart for the span.
+        """
+        from django.utils.dateparse import parse_datetime
+        from .telemetry import RESOLUTION_SECONDS, temperature_series
+        location = self.get_object()
+        
+        end = timezone.now()
+        start = end - timedelta(days=1)
+        for name in ('start', 'end'):
+            value = request.query_params.get(name)
+            if value:
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    return Response({'error': f'{name} must be an ISO 8601 timestamp'}, status=400)
+                if timezone.is_naive(parsed):
+                    parsed = timezone.make_aware(parsed)
+                if name == 'start':
+                    start = parsed
+                else:
+                    end = parsed
+        if start >= end:
+            return Response({'error': 'start must be before end'}, status=400)
+        resolution = request.query_params.get('resolution', 'auto')
+        if resolution not in ('auto', 'raw', *RESOLUTION_SECONDS):
+            return Response({'error': 'resolution must be auto, raw, 1m, 1h or 1d'}, status=400)
+        
+        resolution, points = temperature_series(location, start, end, resolution)
+        return Response({
+            'location': location.id,
+            'min_temperature': location.min_temperature,
+            'max_temperature': location.max_temperature,
+            'start': start,
+            'end': end,
+            'resolution': resolution,
+            'points': points,
+        })
+    
+    @action(detail=True, methods=['get'])
+    def free_slots(self, request, pk=None):
+        """
+        The next ?count= free positions at or below this location, starting
+        at ?start= when it is a box and continuing through the boxes under it
+        """
+        from .storage import find_free_slots
+        location = self.get_object()
+        
+        try:
+            count = min(max(int(request.query_params.get('count', 1)), 1), 10000)
+            start = max(int(request.query_params.get('start', 0)), 0)
+        except ValueError:
+            return Response({'error': 'count and start must be integers'}, status=400)
+        
+        slots = find_free_slots(location, count, start)
+        return Response({
+            'location': location.id,
+            'requested': count,
+            'found': len(slots),
+            'slots': [
+                {'location': box.id, 'location_name': box.name, 'position': position,
+                 'label': box.position_label(position)}
+                for box, position in slots
+            ]
+        })
+    
+    @action(detail=True, methods=['post'])
+    def allocate(self, request, pk=None):
+        """Place sample_ids in the nearest free positions at or below this location"""
+        from uuid import UUID
+        from .storage import allocate
+        location = self.get_object()
+        
+        sample_ids = request.data.get('sample_ids')
+        if not isinstance(sample_ids, list) or not sample_ids:
+            return Response({'error': 'sample_ids must be a non-empty list'}, status=400)
+        if len(sample_ids) > 10000:
+            return Response({'error': 'At most 10000 samples can be allocated at once'}, status=400)
+        try:
+            start = max(int(request.data.get('start', 0)), 0)
+        except (TypeError, ValueError):
+            return Response({'error': 'start must be an integer'}, status=400)
+        
+        try:
+            requested = list(dict.fromkeys(UUID(str(sample_id)) for sample_id in sample_ids))
+        except ValueError:
+            return Response({'error': 'sample_ids must be sample UUIDs'}, status=400)
+        samples = Sample.objects.only('id', 'sample_id', 'storage_location', 'storage_position').in_bulk(requested)
+        missing = [str(sample_id) for sample_id in requested if sample_id not in samples]
+        if missing:
+            return Response({'error': f'Samples not found: {", ".join(missing[:20])}'}, status=400)
+        
+        try:
+            placements = allocate(location, [samples[sample_id] for sample_id in requested], start)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=400)
+        return Response({
+            'allocated': len(placements),
+            'placements': [
+                {'id': str(sample.id), 'sample_id': sample.sample_id, 'location': box.id,
+                 'location_name': box.name, 'position': position, 'label': box.position_label(position)}
+                for sample, box, position in placements
+            ]
+        })
+
+class TemperatureExcursionViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = TemperatureExcursion.objects.select_related('location').annotate(sample_count=Count('samples'))
+    serializer_class = TemperatureExcursionSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = {
+        'location': ['exact'],
+        'samples': ['exact'],
+        'ended_at': ['isnull'],
+        'started_at': ['gte', 'lte'],
+    }
+    ordering_fields = ['started_at', 'peak_temperature']
+    ordering = ['-started_at']
+
+class SampleAttributeSchemaViewSet(viewsets.ModelViewSet):
+    queryset = SampleAttributeSchema.objects.all()
+    serializer_class = SampleAttributeSchemaSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['sample_type']
+
+class QuantityLogViewSet(ExportMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = QuantityLog.objects.select_related('sample', 'changed_by')
+    serializer_class = QuantityLogSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_fields = {
+        'sample': ['exact'],
+        'change_type': ['exact', 'in'],
+        'changed_by': ['exact'],
+        'changed_at': ['gte', 'lte'],
+    }
+    search_fields = ['sample__sample_id', 'reason']
+    ordering_fields = ['changed_at']
+    ordering = ['-changed_at']
+    export_columns = QUANTITY_LOG_COLUMNS
+    export_filename = 'quantity-logs'
 
-class SampleViewSet(viewsets.ModelViewSet):
+class SampleViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = Sample.objects.all()
     serializer_class = SampleSerializer
     permission_classes = [IsAuthenticated]
@@ -28,6 +207,18 @@ class SampleViewSet(viewsets.ModelViewSet):
     search_fields = ['sample_id', 'name', 'sample_type']
     ordering_fields = ['created_at', 'sample_id', 'name', 'updated_at']
     ordering = ['-created_at']
+    export_columns = SAMPLE_COLUMNS
+    export_filename = 'samples'
+    
+    def filter_queryset(self, queryset):
+        """Also filter on attributes__<name>=value and attributes__<name>__gt|gte|lt|lte=number"""
+        from .attributes import filter_samples
+        
+        queryset = super().filter_queryset(queryset)
+        try:
+            return filter_samples(queryset, self.request.query_params)
+        except ValueError as e:
+            raise ParseError({'error': str(e)})
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -126,11 +317,18 @@ class SampleViewSet(viewsets.ModelViewSet):
             'history': serializer.data
         })
     
+    def _open_alerts(self, *alert_types):
+        """Open materialized alerts, with the sample fields the endpoints return"""
+        alerts = SampleAlert.objects.filter(resolved_at__isnull=True).select_related(
+            'sample__storage_location'
+        )
+        if alert_types:
+            alerts = alerts.filter(alert_type__in=alert_types)
+        return alerts
+    
     @action(detail=False, methods=['get'])
     def alerts(self, request):
         """Get all samples with active alerts"""
-        samples = Sample.objects.all()
-        
         alerts_data = {
             'critical': [],
             'warning': [],
@@ -142,12 +340,18 @@ class SampleViewSet(viewsets.ModelViewSet):
                 'total_alerts': 0
             }
         }
+        summary_keys = {
+            'EXPIRED': 'expired',
+            'EXPIRING_SOON': 'expiring_soon',
+            'LOW_QUANTITY': 'low_quantity',
+            'OUT_OF_STOCK': 'out_of_stock',
+        }
         
-        for sample in samples:
-            sample_alerts = sample.get_alert_status()
-            
-            if sample_alerts:
-                sample_data = {
+        samples_data = {}
+        for alert in self._open_alerts().order_by('sample_id', 'alert_type'):
+            sample = alert.sample
+            if sample.pk not in samples_data:
+                samples_data[sample.pk] = {
                     'id': str(sample.id),
                     'sample_id': sample.sample_id,
                     'name': sample.name,
@@ -155,49 +359,66 @@ class SampleViewSet(viewsets.ModelViewSet):
                     'quantity': float(sample.quantity),
                     'unit': sample.unit,
                     'storage_location': sample.storage_location.name if sample.storage_location else None,
-                    'alerts': sample_alerts
+                    'alerts': []
                 }
-                
-                # Categorize by severity
-                has_critical = any(alert['severity'] == 'critical' for alert in sample_alerts)
-                if has_critical:
-                    alerts_data['critical'].append(sample_data)
-                else:
-                    alerts_data['warning'].append(sample_data)
-                
-                # Update summary counts
-                for alert in sample_alerts:
-                    if alert['type'] == 'EXPIRED':
-                        alerts_data['summary']['expired'] += 1
-                    elif alert['type'] == 'EXPIRING_SOON':
-                        alerts_data['summary']['expiring_soon'] += 1
-                    elif alert['type'] == 'LOW_QUANTITY':
-                        alerts_data['summary']['low_quantity'] += 1
-                    elif alert['type'] == 'OUT_OF_STOCK':
-                        alerts_data['summary']['out_of_stock'] += 1
-                
-                alerts_data['summary']['total_alerts'] += len(sample_alerts)
+            samples_data[sample.pk]['alerts'].append({
+                'type': alert.alert_type,
+                'severity': alert.severity,
+                'message': alert.message
+            })
+            alerts_data['summary'][summary_keys[alert.alert_type]] += 1
+            alerts_data['summary']['total_alerts'] += 1
+        
+        # Categorize by severity
+        for sample_data in samples_data.values():
+            has_critical = any(alert['severity'] == 'critical' for alert in sample_data['alerts'])
+            alerts_data['critical' if has_critical else 'warning'].append(sample_data)
         
         return Response(alerts_data)
     
+    @action(detail=False, methods=['get'])
+    def alert_history(self, request):
+        """
+        Opened and resolved alerts, newest first
+        
+        Query params: sample (id), alert_type, state (open or resolved)
+        """
+        from .serializers import SampleAlertSerializer
+        
+        alerts = SampleAlert.objects.select_related('sample')
+        sample = request.query_params.get('sample')
+        alert_type = request.query_params.get('alert_type')
+        state = request.query_params.get('state')
+        if sample:
+            alerts = alerts.filter(sample_id=sample)
+        if alert_type:
+            alerts = alerts.filter(alert_type=alert_type)
+        if state == 'open':
+            alerts = alerts.filter(resolved_at__isnull=True)
+        elif state == 'resolved':
+            alerts = alerts.filter(resolved_at__isnull=False)
+        
+        page = self.paginate_queryset(alerts)
+        serializer = SampleAlertSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         """Get samples with low quantity"""
-        samples = Sample.objects.all()
         low_stock_samples = []
         
-        for sample in samples:
-            if sample.is_low_quantity():
-                low_stock_samples.append({
-                    'id': str(sample.id),
-                    'sample_id': sample.sample_id,
-                    'name': sample.name,
-                    'sample_type': sample.sample_type,
-                    'quantity': float(sample.quantity),
-                    'min_quantity': float(sample.min_quantity) if sample.min_quantity else None,
-                    'unit': sample.unit,
-                    'storage_location': sample.storage_location.name if sample.storage_location else None
-                })
+        for alert in self._open_alerts('LOW_QUANTITY').order_by('sample__quantity'):
+            sample = alert.sample
+            low_stock_samples.append({
+                'id': str(sample.id),
+                'sample_id': sample.sample_id,
+                'name': sample.name,
+                'sample_type': sample.sample_type,
+                'quantity': float(sample.quantity),
+                'min_quantity': float(sample.min_quantity) if sample.min_quantity else None,
+                'unit': sample.unit,
+                'storage_location': sample.storage_location.name if sample.storage_location else None
+            })
         
         return Response({
             'count': len(low_stock_samples),
@@ -207,19 +428,18 @@ class SampleViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def expired(self, request):
         """Get expired samples"""
-        samples = Sample.objects.all()
         expired_samples = []
         
-        for sample in samples:
-            if sample.is_expired():
-                expired_samples.append({
-                    'id': str(sample.id),
-                    'sample_id': sample.sample_id,
-                    'name': sample.name,
-                    'sample_type': sample.sample_type,
-                    'expiration_date': sample.expiration_date,
-                    'storage_location': sample.storage_location.name if sample.storage_location else None
-                })
+        for alert in self._open_alerts('EXPIRED').order_by('days_until_expiry'):
+            sample = alert.sample
+            expired_samples.append({
+                'id': str(sample.id),
+                'sample_id': sample.sample_id,
+                'name': sample.name,
+                'sample_type': sample.sample_type,
+                'expiration_date': sample.expiration_date,
+                'storage_location': sample.storage_location.name if sample.storage_location else None
+            })
         
         return Response({
             'count': len(expired_samples),
@@ -230,22 +450,31 @@ class SampleViewSet(viewsets.ModelViewSet):
     def expiring_soon(self, request):
         """Get samples expiring within specified days (default 30)"""
         days = int(request.query_params.get('days', 30))
-        samples = Sample.objects.all()
         expiring_samples = []
         
-        for sample in samples:
-            if sample.is_expiring_soon(days=days):
-                from datetime import datetime
-                days_until = (sample.expiration_date - datetime.now().date()).days
-                expiring_samples.append({
-                    'id': str(sample.id),
-                    'sample_id': sample.sample_id,
-                    'name': sample.name,
-                    'sample_type': sample.sample_type,
-                    'expiration_date': sample.expiration_date,
-                    'days_until_expiration': days_until,
-                    'storage_location': sample.storage_location.name if sample.storage_location else None
-                })
+        if days <= EXPIRING_SOON_DAYS:
+            alerts = self._open_alerts('EXPIRING_SOON').filter(
+                days_until_expiry__lte=days
+            ).order_by('days_until_expiry')
+            rows = [(alert.sample, alert.days_until_expiry) for alert in alerts]
+        else:
+            # Wider than the materialized window; fall back to a date range query
+            today = timezone.localdate()
+            samples = Sample.objects.select_related('storage_location').filter(
+                expiration_date__gte=today, expiration_date__lte=today + timedelta(days=days)
+            ).order_by('expiration_date')
+            rows = [(sample, (sample.expiration_date - today).days) for sample in samples]
+        
+        for sample, days_until in rows:
+            expiring_samples.append({
+                'id': str(sample.id),
+                'sample_id': sample.sample_id,
+                'name': sample.name,
+                'sample_type': sample.sample_type,
+                'expiration_date': sample.expiration_date,
+                'days_until_expiration': days_until,
+                'storage_location': sample.storage_location.name if sample.storage_location else None
+            })
         
         return Response({
             'count': len(expiring_samples),
@@ -327,7 +556,47 @@ class SampleViewSet(viewsets.ModelViewSet):
             },
             'child_sample': serializer.data
         }, status=201)
-    
+
+    @action(detail=True, methods=['post'])
+    def split(self, request, pk=None):
+        """
+        Split this sample into many aliquots at once
+
+        Expected payload, either explicit volumes:
+        {"quantities": [10, 10, 5], "name_prefix": "Plate A"}
+        or an even division of total_quantity (default: all of the parent):
+        {"count": 96, "total_quantity": 960}
+        Optional: relationship_type, derivation_notes, storage_location_id
+        """
+        from .serializers import ChildSampleSerializer, SampleSplitSerializer
+        parent_sample = self.get_object()
+
+        serializer = SampleSplitSerializer(data=request.data, context={'parent': parent_sample})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        data = serializer.validated_data
+
+        try:
+            children = parent_sample.split(
+                data['quantities'], request.user, serializer.get_names(),
+                relationship_type=data['relationship_type'],
+                derivation_notes=data['derivation_notes'],
+                storage_location_id=data['storage_location_id']
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=400)
+
+        return Response({
+            'message': f'Split {parent_sample.sample_id} into {len(children)} aliquots',
+            'parent_sample': {
+                'id': str(parent_sample.id),
+                'sample_id': parent_sample.sample_id,
+                'new_quantity': float(parent_sample.quantity)
+            },
+            'child_count': len(children),
+            'children': ChildSampleSerializer(children, many=True).data
+        }, status=201)
+
     @action(detail=True, methods=['post'])
     def create_derivative(self, request, pk=None):
         """
@@ -457,7 +726,82 @@ class SampleViewSet(viewsets.ModelViewSet):
             'descendants_count': len(descendants),
             'descendants': serializer.data
         })
-    
+
+    @action(detail=True, methods=['get'])
+    def graph(self, request, pk=None):
+        """
+        Ancestors and descendants of this sample as nodes and edges.
+        depth limits descendant generations and limit the descendant nodes
+        returned; when a traversal is cut short the response carries a
+        `next` cursor to pass back as ?expand= for the following slice.
+        """
+        from .lineage import InvalidCursor, build_graph
+        sample = self.get_object()
+
+        try:
+            depth = min(max(int(request.query_params.get('depth', 1)), 1), 20)
+            limit = min(max(int(request.query_params.get('limit', 500)), 1), 5000)
+        except ValueError:
+            return Response({'error': 'depth and limit must be integers'}, status=400)
+
+        try:
+            graph = build_graph(sample, depth=depth, budget=limit,
+                                cursor=request.query_params.get('expand'))
+        except InvalidCursor as exc:
+            return Response({'error': str(exc)}, status=400)
+        return Response(graph)
+
+    @action(detail=True, methods=['get'])
+    def subtree_aggregates(self, request, pk=None):
+        """Totals over this sample and everything derived from it"""
+        from .lineage import subtree_aggregates
+        sample = self.get_object()
+        return Response({
+            'id': str(sample.id),
+            'sample_id': sample.sample_id,
+            **subtree_aggregates(sample)
+        })
+
+    @action(detail=True, methods=['get'])
+    def impact(self, request, pk=None):
+        """
+        Experiments that used this sample or anything derived from it,
+        grouped by status and paginated. Query params: status
+        """
+        from django.db.models import Count
+        from .lineage import impacted_experiments, impacting_samples
+        sample = self.get_object()
+
+        experiments = impacted_experiments(sample)
+        by_status = dict(
+            experiments.order_by().values('status').annotate(count=Count('id')).values_list('status', 'count')
+        )
+        status_filter = request.query_params.get('status')
+        if status_filter:
+            experiments = experiments.filter(status=status_filter)
+
+        page = self.paginate_queryset(
+            experiments.select_related('created_by').only(
+                'id', 'title', 'status', 'start_date', 'created_at', 'created_by__username'
+            ).order_by('status', '-created_at', 'id')
+        )
+        matched = impacting_samples(sample, [experiment.id for experiment in page])
+        response = self.get_paginated_response([
+            {
+                'id': experiment.id,
+                'title': experiment.title,
+                'status': experiment.status,
+                'start_date': experiment.start_date,
+                'created_by_name': experiment.created_by.username,
+                'matched_samples': matched.get(experiment.id, []),
+            }
+            for experiment in page
+        ])
+        response.data['sample_id'] = sample.sample_id
+        response.data['by_status'] = by_status
+        response.data['experiment_count'] = sum(by_status.values())
+        return response
+
     @action(detail=False, methods=['get'])
     def root_samples(self, request):
         """Get all samples that have no parent (root samples)"""